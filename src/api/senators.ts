@@ -1,7 +1,7 @@
 import sqlite3 from 'sqlite3';
 import { Router, Request, Response } from 'express';
 import path from 'path';
-import { fileURLToPath } from 'url';
+import { fileURLToPath, pathToFileURL } from 'url';
 
 // Get the directory name of the current module
 const __filename = fileURLToPath(import.meta.url);
@@ -18,8 +18,9 @@ interface SenatorRow {
 const router = Router();
 
 router.get('/api/senators', (req: Request, res: Response) => {
-  const dbPath = path.resolve(__dirname, '../services/politicaldata.db');
-  const db = new sqlite3.Database(dbPath, (err: Error | null) => {
+  // the published snapshot is only ever replaced, so it is read without locking
+  const dbPath = process.env.POLITICALDATA_DB || path.resolve(__dirname, '../services/politicaldata.db');
+  const db = new sqlite3.Database(`${pathToFileURL(dbPath).href}?immutable=1`, sqlite3.OPEN_READONLY | sqlite3.OPEN_URI, (err: Error | null) => {
     if (err) {
       console.error('Error opening database:', err);
       console.error('Database path:', dbPath);
@@ -1,19 +1,38 @@
 import sqlite3 from 'sqlite3';
 import { open } from 'sqlite';
 import path from 'path';
-import { fileURLToPath } from 'url';
+import { fileURLToPath, pathToFileURL } from 'url';
 import fs from 'fs';
+import { execFileSync } from 'child_process';
 
 // Get the directory name of the current module
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
 
+// politicaldata.db is the read snapshot published by the ingest pipeline
+// (services/snapshot.py) and is only ever replaced, never written in place.
+// Tables are written to the writer database and the snapshot is republished.
+const dbPath = process.env.POLITICALDATA_DB || path.resolve(__dirname, '../services/politicaldata.db');
+const writerDbPath = process.env.POLITICALDATA_WRITER_DB ||
+  path.format({ ...path.parse(dbPath), base: undefined, name: `${path.parse(dbPath).name}-writer` });
+
+// Publish the writer database as the read snapshot
+function publishSnapshot() {
+  execFileSync(process.env.PYTHON || 'python', [path.resolve(__dirname, '../services/snapshot.py')], {
+    stdio: 'inherit'
+  });
+}
+
 // Database setup
 export async function setupDatabase() {
-  const dbPath = path.resolve(__dirname, '../services/politicaldata.db');
-  
+  // seed the writer from the current snapshot the first time, the copy is
+  // consistent because the snapshot is never written to
+  if (!fs.existsSync(writerDbPath) && fs.existsSync(dbPath)) {
+    fs.copyFileSync(dbPath, writerDbPath);
+  }
+
   const db = await open({
-    filename: dbPath,
+    filename: writerDbPath,
     driver: sqlite3.Database
   });
 
@@ -105,6 +124,7 @@ export async function populateDatabase(senators: any[]) {
   }
   
   await db.close();
+  publishSnapshot();
 }
 
 // Function to populate the candidates table from multiple data files
@@ -199,7 +219,11 @@ async function populateCandidatesTable(db: any) {
 
 // Function to get all senators from the database
 export async function getAllSenators() {
-  const db = await setupDatabase();
+  const db = await open({
+    filename: `${pathToFileURL(dbPath).href}?immutable=1`,
+    mode: sqlite3.OPEN_READONLY | sqlite3.OPEN_URI,
+    driver: sqlite3.Database
+  });
   const senators = await db.all('SELECT * FROM senate');
   await db.close();
   
@@ -0,0 +1,160 @@
+import { spawn } from 'child_process';
+import readline from 'readline';
+
+// Pool of long-lived Python processes running services/query_worker.py.
+// Requests are JSON lines on stdin, responses JSON lines on stdout. Each
+// worker handles one request at a time; extra requests wait in a queue.
+export class PythonWorkerPool {
+  constructor({ script, size = 2, pythonPath = 'python', requestTimeoutMs = 30000, restartDelayMs = 500 }) {
+    this.script = script;
+    this.size = size;
+    this.pythonPath = pythonPath;
+    this.requestTimeoutMs = requestTimeoutMs;
+    this.restartDelayMs = restartDelayMs;
+    this.workers = [];
+    this.queue = [];
+    this.nextId = 1;
+    this.closed = false;
+
+    for (let i = 0; i < size; i++) {
+      this.workers.push(this.startWorker(i));
+    }
+  }
+
+  startWorker(index) {
+    const proc = spawn(this.pythonPath, [this.script], { stdio: ['pipe', 'pipe', 'pipe'] });
+    const worker = { index, proc, current: null, exited: false, startedAt: Date.now() };
+
+    readline.createInterface({ input: proc.stdout }).on('line', (line) => {
+      this.handleResponse(worker, line);
+    });
+
+    proc.stdin.on('error', (error) => {
+      // the exit handler takes care of the pending request
+      console.error(`Python worker ${index} stdin error:`, error.message);
+    });
+
+    proc.stderr.on('data', (data) => {
+      console.error(`[python worker ${index}] ${data.toString().trimEnd()}`);
+    });
+
+    proc.on('error', (error) => {
+      console.error(`Python worker ${index} error:`, error.message);
+      if (proc.pid === undefined) {
+        // failed to spawn, no exit event is guaranteed
+        this.handleExit(worker, `failed to start: ${error.message}`);
+      }
+    });
+
+    proc.on('exit', (code, signal) => {
+      this.handleExit(worker, `code ${code}, signal ${signal}`);
+    });
+
+    return worker;
+  }
+
+  handleExit(worker, reason) {
+    if (worker.exited) {
+      return;
+    }
+    worker.exited = true;
+    if (worker.current) {
+      this.finishRequest(worker, new Error(`Python worker exited (${reason})`));
+    }
+    if (this.closed) {
+      return;
+    }
+    // back off when a worker dies right after starting so a broken
+    // environment doesn't turn into a spawn loop
+    const uptime = Date.now() - worker.startedAt;
+    const delay = uptime < 1000 ? this.restartDelayMs * 10 : this.restartDelayMs;
+    console.error(`Python worker ${worker.index} exited (${reason}), restarting in ${delay}ms`);
+    setTimeout(() => {
+      if (!this.closed) {
+        this.workers[worker.index] = this.startWorker(worker.index);
+        this.dispatch();
+      }
+    }, delay);
+  }
+
+  handleResponse(worker, line) {
+    let response;
+    try {
+      response = JSON.parse(line);
+    } catch (e) {
+      console.error(`Python worker ${worker.index} sent invalid output: ${line}`);
+      return;
+    }
+
+    const request = worker.current;
+    if (!request || response.id !== request.id) {
+      console.error(`Python worker ${worker.index} sent a response for an unknown request: ${line}`);
+      return;
+    }
+
+    if (response.error) {
+      this.finishRequest(worker, new Error(response.error));
+    } else {
+      this.finishRequest(worker, null, response.result);
+    }
+  }
+
+  finishRequest(worker, error, result) {
+    const request = worker.current;
+    worker.current = null;
+    clearTimeout(request.timer);
+    if (error) {
+      request.reject(error);
+    } else {
+      request.resolve(result);
+    }
+    this.dispatch();
+  }
+
+  dispatch() {
+    for (const worker of this.workers) {
+      if (this.queue.length === 0) {
+        return;
+      }
+      if (worker.current || worker.exited || worker.proc.killed) {
+        continue;
+      }
+
+      const request = this.queue.shift();
+      worker.current = request;
+      request.timer = setTimeout(() => {
+        // a stuck call takes the worker with it, the exit handler restarts it
+        console.error(`Python worker ${worker.index} timed out on ${request.functionName}`);
+        worker.proc.kill('SIGKILL');
+      }, this.requestTimeoutMs);
+
+      worker.proc.stdin.write(JSON.stringify({
+        id: request.id,
+        function: request.functionName,
+        args: request.args
+      }) + '\n');
+    }
+  }
+
+  call(functionName, args = []) {
+    if (this.closed) {
+      return Promise.reject(new Error('Python worker pool is closed'));
+    }
+    return new Promise((resolve, reject) => {
+      this.queue.push({ id: this.nextId++, functionName, args, resolve, reject });
+      this.dispatch();
+    });
+  }
+
+  close() {
+    this.closed = true;
+    for (const request of this.queue) {
+      request.reject(new Error('Python worker pool is closed'));
+    }
+    this.queue = [];
+    for (const worker of this.workers) {
+      worker.proc.stdin.end();
+      worker.proc.kill();
+    }
+  }
+}
@@ -3,9 +3,10 @@ import cors from 'cors';
 import sqlite3 from 'sqlite3';
 import { open } from 'sqlite';
 import path from 'path';
-import { fileURLToPath } from 'url';
-import { spawn } from 'child_process';
+import { fileURLToPath, pathToFileURL } from 'url';
 import fs from 'fs';
+import { execFile } from 'child_process';
+import { PythonWorkerPool } from './pythonWorkerPool.js';
 
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
@@ -13,13 +14,37 @@ const __dirname = path.dirname(__filename);
 const app = express();
 const PORT = process.env.PORT || 3001;
 
+// Industry taxonomy shared with the Python services
+const industryTaxonomy = JSON.parse(
+  fs.readFileSync(path.resolve(__dirname, 'services/industries.json'), 'utf8')
+);
+const industryNames = new Set(industryTaxonomy.industries.map(entry => entry.name));
+
 // Enable CORS
 app.use(cors());
 
+// Read snapshot published by the ingest pipeline (services/snapshot.py). It
+// is never written in place, only replaced, so it is opened read-only with
+// immutable=1 and no locking; the writer database is only written to.
+// Both follow POLITICALDATA_DB and POLITICALDATA_WRITER_DB like database.py.
+const dbPath = process.env.POLITICALDATA_DB || path.resolve(__dirname, 'services/politicaldata.db');
+const writerDbPath = process.env.POLITICALDATA_WRITER_DB ||
+  path.format({ ...path.parse(dbPath), base: undefined, name: `${path.parse(dbPath).name}-writer` });
+
+// Publish the writer database as the read snapshot (services/snapshot.py)
+function publishSnapshot() {
+  return new Promise((resolve, reject) => {
+    execFile(process.env.PYTHON || 'python', [path.resolve(__dirname, 'services/snapshot.py')], (error, stdout) => {
+      if (error) {
+        return reject(error);
+      }
+      resolve(stdout);
+    });
+  });
+}
+
 // Database setup
 async function setupDatabase() {
-  const dbPath = path.resolve(__dirname, 'services/politicaldata.db');
-  
   // Check if file exists
   if (!fs.existsSync(dbPath)) {
     console.error(`Database file does not exist at: ${dbPath}`);
@@ -31,7 +56,8 @@ async function setupDatabase() {
   try {
     // Open the database connection with consistent configuration
     const db = await open({
-      filename: dbPath,
+      filename: `${pathToFileURL(dbPath).href}?immutable=1`,
+      mode: sqlite3.OPEN_READONLY | sqlite3.OPEN_URI,
       driver: sqlite3.Database
     });
     
@@ -46,63 +72,122 @@ async function setupDatabase() {
   }
 }
 
-// Helper function to run Python code and get the result
+// Long-lived Python workers for the service functions
+const pythonPool = new PythonWorkerPool({
+  script: path.resolve(__dirname, 'services/query_worker.py'),
+  size: parseInt(process.env.PYTHON_WORKERS || '2', 10),
+  pythonPath: process.env.PYTHON || 'python',
+  requestTimeoutMs: parseInt(process.env.PYTHON_TIMEOUT_MS || '30000', 10)
+});
+
+// Helper function to call a Python service function and get the result
 async function runPythonFunction(functionName, args = []) {
-  return new Promise((resolve, reject) => {
-    // Create a Python script that imports and calls the function
-    const pythonCode = `
-import sys
-import json
-sys.path.append('${path.resolve(__dirname, 'services')}')
-from candidate_functions import ${functionName}
-
-try:
-    # Call the function with the provided arguments
-    result = ${functionName}(${args.map(arg => JSON.stringify(arg)).join(', ')})
-    # Print the result as JSON
-    print(json.dumps(result))
-except Exception as e:
-    # Print error message
-    print(json.dumps({"error": str(e)}))
-`;
-
-    // Run the Python code
-    const pythonProcess = spawn('python', ['-c', pythonCode]);
-    
-    let resultData = '';
-    let errorData = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-      resultData += data.toString();
-    });
+  return pythonPool.call(functionName, args);
+}
 
-    pythonProcess.stderr.on('data', (data) => {
-      errorData += data.toString();
-    });
+// Names of the given query parameters that are not a whole number, so bad
+// input gets a 400 instead of failing in Python
+function invalidIntegerParams(query, names) {
+  return names.filter((name) => query[name] !== undefined && query[name] !== '' && !/^\d+$/.test(query[name]));
+}
 
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        console.error(`Python process exited with code ${code}`);
-        console.error('Error:', errorData);
-        reject(new Error(`Python process failed: ${errorData}`));
-        return;
-      }
+// Resolve once a response can take more data or was closed, removing both
+// listeners either way
+function waitForDrain(res) {
+  return new Promise((resolve) => {
+    const done = () => {
+      res.off('drain', done);
+      res.off('close', done);
+      resolve();
+    };
+    res.on('drain', done);
+    res.on('close', done);
+  });
+}
 
-      try {
-        const result = JSON.parse(resultData);
-        if (result && result.error) {
-          reject(new Error(result.error));
-        } else {
-          resolve(result);
-        }
-      } catch (e) {
-        reject(new Error(`Failed to parse Python output: ${resultData}`));
-      }
+// Static reports written by services/static_reports.py after each ingest
+const reportsDir = process.env.STATIC_REPORTS_DIR || path.resolve(__dirname, 'services/reports');
+
+// A getter for read(), re-read at most once every intervalMs
+function pollEvery(intervalMs, read) {
+  let value = null;
+  let checkedAt = 0;
+  return () => {
+    const now = Date.now();
+    if (now - checkedAt >= intervalMs) {
+      checkedAt = now;
+      value = read();
+    }
+    return value;
+  };
+}
+
+// The published report build directory from current.json. Every build has
+// its own directory, so it also names the contents for ETags.
+const currentReportsVersion = pollEvery(1000, () => {
+  try {
+    const current = JSON.parse(fs.readFileSync(path.join(reportsDir, 'current.json'), 'utf8'));
+    return current.directory || current.version;
+  } catch {
+    return null;
+  }
+});
+
+// Send a report file as is, picking the brotli or gzip variant if the client
+// accepts it, so serving a report costs no SQL and no compression
+function sendReport(req, res, relativePath) {
+  const version = currentReportsVersion();
+  if (!version) {
+    return res.status(404).json({ error: 'Reports have not been built' });
+  }
+  const file = path.join(reportsDir, version, relativePath);
+  const accepted = req.headers['accept-encoding'] || '';
+  const variants = [['br', '.br'], ['gzip', '.gz']].filter(([encoding]) => accepted.includes(encoding));
+  variants.push([null, '']);
+  for (const [encoding, suffix] of variants) {
+    if (!fs.existsSync(file + suffix)) {
+      continue;
+    }
+    res.set({
+      'Content-Type': 'application/json',
+      'Vary': 'Accept-Encoding',
+      'ETag': `"${version}${suffix}"`,
+      'Cache-Control': 'no-cache'
     });
-  });
+    if (encoding) {
+      res.set('Content-Encoding', encoding);
+    }
+    return res.sendFile(file + suffix, { etag: false, lastModified: false });
+  }
+  res.status(404).json({ error: 'Report not found' });
+}
+
+// Same file names as industry_slug in static_reports.py
+function industrySlug(industry) {
+  return industry.toLowerCase().replace(/[^a-z0-9]+/g, '-').replace(/^-+|-+$/g, '');
 }
 
 // API Routes
+app.get('/api/reports', (req, res) => {
+  sendReport(req, res, 'index.json');
+});
+
+app.get('/api/reports/candidates/:candidateId', (req, res) => {
+  const { candidateId } = req.params;
+  if (!/^[A-Za-z0-9]+$/.test(candidateId)) {
+    return res.status(400).json({ error: 'Invalid candidate ID' });
+  }
+  sendReport(req, res, `candidates/${candidateId.toUpperCase()}.json`);
+});
+
+app.get('/api/reports/industries/:industry', (req, res) => {
+  const slug = industrySlug(req.params.industry);
+  if (!slug) {
+    return res.status(400).json({ error: 'Invalid industry' });
+  }
+  sendReport(req, res, `industries/${slug}.json`);
+});
+
 app.get('/api/senators', async (req, res) => {
   let db;
   try {
@@ -163,66 +248,25 @@ app.get('/api/industry-contributions/:industry', async (req, res) => {
     db = await setupDatabase();
     console.log(`Fetching contributions for industry: ${industry}`);
     
-    // Industry classification logic from contribute.py
-    const industryKeywords = {
-      'Pharmaceuticals': ['health', 'pharmaceutical', 'drugs', 'medical', 'pharma', 'medicine', 'healthcare'],
-      'Military & Defense': ['defense', 'military', 'army', 'navy', 'lockheed', 'marine', 'force', 'security'],
-      'Insurance': ['insurance', 'finance', 'fund', 'financial', 'capital', 'invest', 'bank'],
-      'Oil & Gas': ['energy', 'oil', 'gas', 'petroleum', 'pipeline', 'drill', 'fuel'],
-      'Electronics & Tech': ['tech', 'electronics', 'digital', 'communications', 'google', 'facebook', 'meta', 'software']
-    };
-    
-    // Get keywords for the selected industry
-    const keywords = industryKeywords[industry] || [industry.toLowerCase()];
-    
-    // Build LIKE clauses for each keyword
-    const whereClauses = keywords.map(() => 'LOWER(cc.contributor_name) LIKE ?').join(' OR ');
-    const params = keywords.map(keyword => `%${keyword.toLowerCase()}%`);
-    
-    // First, get all contributions that match the industry
-    const contributionsQuery = `
-      SELECT 
-        cc.candidate_id, 
-        cc.contributor_name, 
-        cc.amount
-      FROM 
-        contributorsFromCommittees cc 
-      WHERE 
-        (${whereClauses})
-        AND cc.entity_type != 'IND' -- Skip individual contributors (from contribute.py)
-    `;
-    
-    console.log('Fetching all industry contributions');
-    const industryContributions = await db.all(contributionsQuery, params);
-    
-    // Group by senator and sum amounts
-    const senatorContributions = {};
-    
-    for (const contribution of industryContributions) {
-      const { candidate_id, contributor_name, amount } = contribution;
-      
-      if (!senatorContributions[candidate_id]) {
-        senatorContributions[candidate_id] = {
-          candidate_id,
-          total: 0,
-          contributors: {}
-        };
-      }
-      
-      senatorContributions[candidate_id].total += amount;
-      
-      // Track top contributors
-      if (!senatorContributions[candidate_id].contributors[contributor_name]) {
-        senatorContributions[candidate_id].contributors[contributor_name] = 0;
-      }
-      senatorContributions[candidate_id].contributors[contributor_name] += amount;
+    let sortedSenators;
+    if (industryNames.has(industry)) {
+      // Industries from the shared taxonomy are classified at ingest time and
+      // rolled up per candidate in candidate_industry_totals
+      console.log('Fetching industry totals from rollup');
+      sortedSenators = await db.all(`
+        SELECT candidate_id, total_amount AS total, top_contributor
+        FROM candidate_industry_totals
+        WHERE industry = ?
+        ORDER BY total_amount DESC
+        LIMIT 20
+      `, [industry]);
+    } else {
+      // Anything else is a search on contributor names, answered from the
+      // full-text index, see services/contributor_search.py
+      console.log('Fetching contributions matching keyword');
+      sortedSenators = await runPythonFunction('contributor_search.keyword_candidate_totals', [industry, 20]);
     }
     
-    // Convert to array and sort by total amount
-    const sortedSenators = Object.values(senatorContributions)
-      .sort((a, b) => b.total - a.total)
-      .slice(0, 20); // Top 20 senators
-    
     // Get senator details from the candidates table first, then senate table as fallback
     const results = [];
     
@@ -234,9 +278,7 @@ app.get('/api/industry-contributions/:industry', async (req, res) => {
           senator.candidate_id
         );
         
-        // Find top contributor
-        const topContributor = Object.entries(senator.contributors)
-          .sort((a, b) => b[1] - a[1])[0];
+        const topContributor = senator.top_contributor;
         
         if (candidateInfo) {
           console.log(`Found candidate ${senator.candidate_id} in candidates table`);
@@ -245,7 +287,7 @@ app.get('/api/industry-contributions/:industry', async (req, res) => {
             name: candidateInfo.name,
             party: getFullPartyName(candidateInfo.PTY_CD, candidateInfo.CAND_PTY_AFFILIATION),
             state: candidateInfo.state,
-            contributor_name: topContributor ? topContributor[0] : 'Unknown',
+            contributor_name: topContributor || 'Unknown',
             amount: senator.total,
             candidate_id: senator.candidate_id // Include the ID for lookups
           });
@@ -265,7 +307,7 @@ app.get('/api/industry-contributions/:industry', async (req, res) => {
               name: masterCandidate.CAND_NAME,
               party: getFullPartyName(null, masterCandidate.CAND_PTY_AFFILIATION),
               state: 'Unknown',
-              contributor_name: topContributor ? topContributor[0] : 'Unknown',
+              contributor_name: topContributor || 'Unknown',
               amount: senator.total,
               candidate_id: senator.candidate_id
             });
@@ -278,7 +320,7 @@ app.get('/api/industry-contributions/:industry', async (req, res) => {
               name: candidateName && candidateName.CAND_NAME ? candidateName.CAND_NAME : `Candidate ${senator.candidate_id}`,
               party: 'Unknown',
               state: 'Unknown',
-              contributor_name: topContributor ? topContributor[0] : 'Unknown',
+              contributor_name: topContributor || 'Unknown',
               amount: senator.total,
               candidate_id: senator.candidate_id
             });
@@ -288,8 +330,7 @@ app.get('/api/industry-contributions/:industry', async (req, res) => {
         console.error(`Error processing candidate ${senator.candidate_id}:`, error);
         
         // Error fallback
-        const topContributor = Object.entries(senator.contributors)
-          .sort((a, b) => b[1] - a[1])[0];
+        const topContributor = senator.top_contributor;
         
         // Try to get the name from candidates_master first
         const masterCandidate = await db.get(
@@ -302,7 +343,7 @@ app.get('/api/industry-contributions/:industry', async (req, res) => {
             name: masterCandidate.CAND_NAME,
             party: getFullPartyName(null, masterCandidate.CAND_PTY_AFFILIATION),
             state: 'Unknown',
-            contributor_name: topContributor ? topContributor[0] : 'Unknown',
+            contributor_name: topContributor || 'Unknown',
             amount: senator.total,
             candidate_id: senator.candidate_id
           });
@@ -315,7 +356,7 @@ app.get('/api/industry-contributions/:industry', async (req, res) => {
             name: candidateName && candidateName.CAND_NAME ? candidateName.CAND_NAME : `Candidate ${senator.candidate_id}`,
             party: 'Unknown',
             state: 'Unknown',
-            contributor_name: topContributor ? topContributor[0] : 'Unknown',
+            contributor_name: topContributor || 'Unknown',
             amount: senator.total,
             candidate_id: senator.candidate_id
           });
@@ -353,6 +394,152 @@ app.get('/api/candidate/:candidateId', async (req, res) => {
   }
 });
 
+// One page of a candidate's contributors; pass nextCursor back as ?cursor=
+app.get('/api/candidate/:candidateId/contributors', async (req, res) => {
+  try {
+    const { candidateId } = req.params;
+    const { year = null, cursor = null, limit = null } = req.query;
+    const invalid = invalidIntegerParams(req.query, ['year', 'limit']);
+    if (invalid.length) {
+      return res.status(400).json({ error: `Invalid ${invalid.join(', ')}` });
+    }
+    const page = await runPythonFunction('query_contributors.contributors_page', [candidateId, year, cursor, limit]);
+    res.json({ contributors: page.records, nextCursor: page.next_cursor });
+  } catch (error) {
+    console.error('Error fetching candidate contributors:', error);
+    const status = error.message.startsWith('Invalid cursor') ? 400 : 500;
+    res.status(status).json({ error: 'Failed to fetch candidate contributors', details: error.message });
+  }
+});
+
+// Where a committee's money went, following committee -> committee -> candidate
+// edges for up to ?hops= steps; the top candidates and paths by amount
+app.get('/api/committees/:committeeId/flows', async (req, res) => {
+  try {
+    const { committeeId } = req.params;
+    const { hops = null, top = null, year = null } = req.query;
+    res.json(await runPythonFunction('committee_graph.committee_flows', [committeeId, hops, top, year]));
+  } catch (error) {
+    console.error('Error tracing committee flows:', error);
+    res.status(500).json({ error: 'Failed to trace committee flows', details: error.message });
+  }
+});
+
+// Contributors whose names match ?q=, e.g. lockheed "united technologies" pharma*;
+// order=rank (best match) or amount, pass nextCursor back as ?cursor=
+app.get('/api/contributors/search', async (req, res) => {
+  try {
+    const { q = '', cursor = null, limit = null, order = 'rank' } = req.query;
+    const page = await runPythonFunction('contributor_search.search_contributors', [q, cursor, limit, order]);
+    res.json({ contributors: page.records, nextCursor: page.next_cursor });
+  } catch (error) {
+    console.error('Error searching contributors:', error);
+    const status = error.message.startsWith('Invalid') ? 400 : 500;
+    res.status(status).json({ error: 'Failed to search contributors', details: error.message });
+  }
+});
+
+// All of a candidate's contributors as newline-delimited JSON, fetched page
+// by page so neither the server nor the worker holds the full list
+app.get('/api/candidate/:candidateId/contributors/stream', async (req, res) => {
+  const { candidateId } = req.params;
+  const { year = null } = req.query;
+  const invalid = invalidIntegerParams(req.query, ['year']);
+  if (invalid.length) {
+    return res.status(400).json({ error: `Invalid ${invalid.join(', ')}` });
+  }
+  let aborted = false;
+  req.on('close', () => { aborted = true; });
+
+  res.setHeader('Content-Type', 'application/x-ndjson');
+  try {
+    let cursor = null;
+    do {
+      const page = await runPythonFunction('query_contributors.contributors_page', [candidateId, year, cursor, 1000]);
+      const chunk = page.records.map((record) => JSON.stringify(record)).join('\n');
+      if (chunk && !res.write(chunk + '\n')) {
+        await waitForDrain(res);
+      }
+      cursor = page.next_cursor;
+    } while (cursor && !aborted);
+    res.end();
+  } catch (error) {
+    console.error('Error streaming candidate contributors:', error);
+    if (!res.headersSent) {
+      res.status(500).json({ error: 'Failed to stream candidate contributors', details: error.message });
+    } else {
+      res.end();
+    }
+  }
+});
+
+// An industry's money per candidate in a date range, from the daily and
+// monthly cubes: ?start=2024-01-01&end=2024-03-31, or ?before=2024-03-15&days=90
+// for the window before a vote; optional &office=S&limit=20
+app.get('/api/industry-contributions/:industry/range', async (req, res) => {
+  try {
+    const { industry } = req.params;
+    const { start, end, before, days = 90, office = null, limit = 20 } = req.query;
+    let candidates;
+    if (before) {
+      candidates = await runPythonFunction('contribution_cubes.industry_money_before',
+        [industry, before, days, office, limit]);
+    } else if (start && end) {
+      candidates = await runPythonFunction('contribution_cubes.industry_totals_between',
+        [industry, start, end, office, limit]);
+    } else {
+      return res.status(400).json({ error: 'Pass start and end, or before' });
+    }
+    res.json(candidates);
+  } catch (error) {
+    console.error('Error fetching industry contributions by date:', error);
+    const status = error.message.startsWith('Invalid date') ? 400 : 500;
+    res.status(status).json({ error: 'Failed to fetch industry contributions', details: error.message });
+  }
+});
+
+// Monthly or quarterly totals for an industry: ?start=&end=&period=quarter&candidateId=
+app.get('/api/industry-contributions/:industry/trend', async (req, res) => {
+  try {
+    const { industry } = req.params;
+    const { start, end, period = 'month', candidateId = null } = req.query;
+    if (!start || !end) {
+      return res.status(400).json({ error: 'start and end are required' });
+    }
+    res.json(await runPythonFunction('contribution_cubes.industry_trend', [industry, start, end, period, candidateId]));
+  } catch (error) {
+    console.error('Error fetching industry trend:', error);
+    const status = error.message.startsWith('Invalid') ? 400 : 500;
+    res.status(status).json({ error: 'Failed to fetch industry trend', details: error.message });
+  }
+});
+
+// Current senators with their recent sponsored bills from Congress.gov, fetched
+// concurrently and cached on disk by the worker; optional ?state=CA&bills=5
+app.get('/api/congress/senators', async (req, res) => {
+  try {
+    const { state = null, bills = null } = req.query;
+    res.json(await runPythonFunction('congress_client.senator_activity', [state, bills]));
+  } catch (error) {
+    console.error('Error fetching Congress.gov senator data:', error);
+    res.status(502).json({ error: 'Failed to fetch Congress.gov data', details: error.message });
+  }
+});
+
+// The same for a comma-separated list of bioguide IDs: ?ids=S000148,P000145
+app.get('/api/congress/members', async (req, res) => {
+  try {
+    const ids = String(req.query.ids || '').split(',').map((id) => id.trim()).filter(Boolean);
+    if (ids.length === 0) {
+      return res.status(400).json({ error: 'ids is required' });
+    }
+    res.json(await runPythonFunction('congress_client.members_activity', [ids, req.query.bills || null]));
+  } catch (error) {
+    console.error('Error fetching Congress.gov member data:', error);
+    res.status(502).json({ error: 'Failed to fetch Congress.gov data', details: error.message });
+  }
+});
+
 // New endpoint to get candidate name
 app.get('/api/candidate/name/:candidateId', async (req, res) => {
   try {
@@ -470,7 +657,6 @@ app.get('/api/candidate-info/:candidateId', async (req, res) => {
 app.get('/api/debug', async (req, res) => {
   try {
     // Test database connection and return detailed info
-    const dbPath = path.resolve(__dirname, 'services/politicaldata.db');
     const stats = fs.statSync(dbPath);
     
     const diagnosticInfo = {
@@ -495,7 +681,8 @@ app.get('/api/debug', async (req, res) => {
     // Try to connect to the database and get tables
     try {
       const db = await open({
-        filename: dbPath,
+        filename: `${pathToFileURL(dbPath).href}?immutable=1`,
+        mode: sqlite3.OPEN_READONLY | sqlite3.OPEN_URI,
         driver: sqlite3.Database
       });
       
@@ -717,11 +904,20 @@ app.listen(PORT, () => {
   console.log(`Server running on port ${PORT}`);
 });
 
-// Function to create and populate the candidates-master table
+// Function to create and populate the candidates-master table. It is written
+// to the writer database, and the read snapshot is republished afterwards.
 async function setupCandidatesMasterTable() {
   let db;
+  let totalRecords = 0;
   try {
-    db = await setupDatabase();
+    if (!fs.existsSync(writerDbPath)) {
+      console.log(`No writer database at ${writerDbPath}, skipping candidates_master import`);
+      return;
+    }
+    db = await open({
+      filename: writerDbPath,
+      driver: sqlite3.Database
+    });
     
     // Create the candidates-master table
     await db.exec(`
@@ -769,8 +965,6 @@ async function setupCandidatesMasterTable() {
       throw new Error('Required header fields not found in header file');
     }
     
-    let totalRecords = 0;
-    
     // Process each candidate file
     for (const relativeFilePath of candidateFiles) {
       const fullPath = path.resolve(__dirname, relativeFilePath);
@@ -839,6 +1033,10 @@ async function setupCandidatesMasterTable() {
       await db.close();
     }
   }
+
+  if (totalRecords > 0) {
+    await publishSnapshot();
+  }
 }
 
 // Create the new table when the server starts
@@ -0,0 +1,310 @@
+"""
+Benchmark the ingest and query paths on synthetic FEC data.
+
+For every scale a fresh dataset is generated with fec_synthetic and each
+scale runs in its own subprocess, so peak RSS is measured per scale and
+POLITICALDATA_DB points the services at that scale's database. Results are
+written as JSON; pass an earlier results file as --baseline to flag
+regressions (the exit status is 1 if any metric regressed).
+
+    python src/services/benchmark.py --scales 10000,1000000 --out results.json
+    python src/services/benchmark.py --scales 10000,1000000 --baseline results.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+SERVICES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RESULTS_VERSION = 1
+
+# the row-by-row legacy loader is only timed up to this many rows
+LEGACY_MAX_ROWS = 2000000
+
+# relative change that counts as a regression when comparing to a baseline
+DEFAULT_THRESHOLD = 0.2
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def time_calls(function, args_list):
+    """Call function once per args tuple and summarize the latencies in milliseconds"""
+    latencies = []
+    for args in args_list:
+        started = time.perf_counter()
+        function(*args)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {
+        'calls': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50), 4),
+        'p99_ms': round(percentile(latencies, 0.99), 4),
+        'mean_ms': round(sum(latencies) / len(latencies), 4),
+    }
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak resident set size in MB (ru_maxrss is KB on Linux, bytes on macOS)"""
+    maxrss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss /= 1024
+    return round(maxrss / 1024, 1)
+
+def run_legacy_load(dataset, headers, db_path):
+    """Time load_contributions_to_db on its own database"""
+    from initialize_db import load_contributions_to_db
+    from compact_schema import create_compact_schema
+
+    conn = sqlite3.connect(db_path)
+    create_compact_schema(conn)
+    started = time.perf_counter()
+    for file_path, year in dataset['files']:
+        load_contributions_to_db(file_path, headers, conn, year)
+    seconds = time.perf_counter() - started
+    conn.close()
+    return {'seconds': round(seconds, 3), 'rows_per_sec': round(dataset['rows'] / seconds)}
+
+def run_scale(rows, work_dir, seed, queries, workers, legacy):
+    """Generate, ingest and query one scale. Runs inside the scale's subprocess."""
+    # imported here so POLITICALDATA_DB from the parent is in effect
+    from fec_synthetic import generate_dataset, write_reference_tables
+    from initialize_db import init_db, ingest_contributions, load_headers
+    from contribute import get_contributions_by_candidate
+    from candidate_functions import candidate_info, get_candidate_name
+    from industries import classify_industry, get_matcher, get_taxonomy
+    from query_contributors import fetch_contributors, contributors_page, page_query_plan, decode_cursor
+    from senator_contributors import analyze_senators
+    from contribution_matrix import ContributionMatrix
+    from contribution_cubes import industry_money_before
+    from database import DB_PATH, WRITER_DB_PATH, get_db_connection
+
+    result = {'rows': rows, 'seed': seed}
+
+    started = time.perf_counter()
+    dataset = generate_dataset(os.path.join(work_dir, 'data'), rows, seed=seed)
+    result['generate_seconds'] = round(time.perf_counter() - started, 3)
+    result['data_bytes'] = dataset['bytes']
+    headers = load_headers(os.path.join(work_dir, 'data', 'con-from-com-header.csv'))
+
+    if legacy:
+        result['legacy_ingest'] = run_legacy_load(dataset, headers, os.path.join(work_dir, 'legacy.db'))
+
+    write_reference_tables(WRITER_DB_PATH, dataset['candidates'], seed=seed)
+    conn = init_db()
+    started = time.perf_counter()
+    stats = ingest_contributions(dataset['files'], headers, conn, workers=workers)
+    seconds = time.perf_counter() - started
+    conn.close()
+    result['ingest'] = {'seconds': round(seconds, 3), 'rows_per_sec': round(rows / seconds)}
+    # the bulk load alone, the step comparable to the legacy loader; the rest
+    # of the ingest builds the derived tables and publishes the snapshot
+    result['load'] = {'seconds': round(stats['seconds'], 3), 'rows_per_sec': round(rows / stats['seconds'])}
+    result['peak_worker_rss_mb'] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    result['db_bytes'] = os.path.getsize(DB_PATH)
+
+    # sample candidates the way traffic does: a few popular ones most of the time
+    rng = random.Random(seed)
+    reader = get_db_connection()
+    candidate_ids = [row[0] for row in reader.execute('''
+        SELECT candidate_id FROM contributorsFromCommittees
+        GROUP BY candidate_id ORDER BY COUNT(*) DESC
+    ''')]
+    weights = [1.0 / rank for rank in range(1, len(candidate_ids) + 1)]
+    sampled = rng.choices(candidate_ids, weights=weights, k=queries)
+    names = [row[0] for row in reader.execute(
+        'SELECT contributor_name FROM contributorsFromCommittees LIMIT ?', (queries,))]
+
+    taxonomy = get_taxonomy()
+    matcher = get_matcher()
+    matrix = ContributionMatrix()
+    started = time.perf_counter()
+    matrix.build(reader)
+    result['matrix_build_seconds'] = round(time.perf_counter() - started, 3)
+    industry_names = [industry['name'] for industry in taxonomy['industries']]
+    result['queries'] = {
+        'get_contributions_by_candidate': time_calls(get_contributions_by_candidate, [(cid,) for cid in sampled]),
+        'candidate_info': time_calls(candidate_info, [(cid, reader) for cid in sampled]),
+        'get_candidate_name': time_calls(get_candidate_name, [(cid, reader) for cid in sampled]),
+        # an explicit connection bypasses the result cache
+        'fetch_contributors': time_calls(fetch_contributors, [(cid, None, reader) for cid in sampled]),
+        'contributors_page': time_calls(contributors_page, [(cid, None, None, 100, reader) for cid in sampled]),
+        'classify_industry': time_calls(classify_industry, [(name, taxonomy) for name in names]),
+        'IndustryMatcher.classify': time_calls(matcher.classify, [(name,) for name in names]),
+        'ContributionMatrix.top_candidates': time_calls(
+            matrix.top_candidates, [(rng.choice(industry_names), 10, None, 'S') for _ in range(queries)]),
+        'industry_money_before': time_calls(
+            industry_money_before,
+            [(rng.choice(industry_names), f'{rng.choice((2022, 2024, 2026))}-{rng.randint(1, 12):02d}-15',
+              90, 'S', 20, reader) for _ in range(queries)]),
+        'analyze_senators': time_calls(analyze_senators, [(5, reader)] * max(1, queries // 100)),
+    }
+    # a deep page should seek on the index rather than scan the candidate
+    first_page = contributors_page(sampled[0], conn=reader)
+    after = decode_cursor(first_page.next_cursor) if first_page.next_cursor else None
+    plan, uses_index = page_query_plan(sampled[0], None, after, reader)
+    result['page_plan'] = {'details': plan, 'uses_index': uses_index}
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+def run_scale_subprocess(rows, args):
+    """Run one scale in a fresh interpreter and return its results"""
+    work_dir = os.path.join(args.work_dir, f'scale_{rows}')
+    os.makedirs(work_dir, exist_ok=True)
+    db_path = os.path.join(work_dir, 'politicaldata.db')
+    writer_path = os.path.join(work_dir, 'politicaldata-writer.db')
+    # the writer holds the ingest manifest, a leftover one would skip the load
+    for path in (db_path, writer_path):
+        for suffix in ('', '-wal', '-shm'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path + suffix)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(work_dir, 'legacy.db'))
+
+    result_path = os.path.join(work_dir, 'result.json')
+    command = [
+        sys.executable, os.path.abspath(__file__),
+        '--run-scale', str(rows),
+        '--work-dir', work_dir,
+        '--result', result_path,
+        '--seed', str(args.seed),
+        '--queries', str(args.queries),
+    ]
+    if args.workers:
+        command += ['--workers', str(args.workers)]
+    if args.skip_legacy:
+        command.append('--skip-legacy')
+    env = dict(os.environ, POLITICALDATA_DB=db_path, POLITICALDATA_WRITER_DB=writer_path)
+    subprocess.run(command, env=env, check=True)
+    with open(result_path) as file:
+        return json.load(file)
+
+def git_commit():
+    """Current commit of the checkout, if there is one"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVICES_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def metrics(scale):
+    """Flatten one scale's results to {metric: (value, higher_is_better)}"""
+    flat = {'ingest.rows_per_sec': (scale['ingest']['rows_per_sec'], True),
+            'peak_rss_mb': (scale['peak_rss_mb'], False)}
+    if 'load' in scale:
+        flat['load.rows_per_sec'] = (scale['load']['rows_per_sec'], True)
+    if 'legacy_ingest' in scale:
+        flat['legacy_ingest.rows_per_sec'] = (scale['legacy_ingest']['rows_per_sec'], True)
+    for name, summary in scale['queries'].items():
+        flat[f'{name}.p50_ms'] = (summary['p50_ms'], False)
+        flat[f'{name}.p99_ms'] = (summary['p99_ms'], False)
+    return flat
+
+def compare(results, baseline, threshold):
+    """List the metrics that got worse than the baseline by more than threshold"""
+    regressions = []
+    baseline_scales = {scale['rows']: scale for scale in baseline['scales']}
+    for scale in results['scales']:
+        old_scale = baseline_scales.get(scale['rows'])
+        if old_scale is None:
+            continue
+        old_metrics = metrics(old_scale)
+        for name, (value, higher_is_better) in metrics(scale).items():
+            if name not in old_metrics or not old_metrics[name][0]:
+                continue
+            old_value = old_metrics[name][0]
+            change = (value - old_value) / old_value
+            if (change < -threshold) if higher_is_better else (change > threshold):
+                regressions.append({'rows': scale['rows'], 'metric': name,
+                                    'baseline': old_value, 'value': value, 'change': round(change, 4)})
+    return regressions
+
+def print_summary(results):
+    """Human-readable summary of a results dict"""
+    for scale in results['scales']:
+        print(f"\n{scale['rows']:,} rows ({scale['data_bytes'] / 1e6:,.1f} MB, peak RSS {scale['peak_rss_mb']} MB, "
+              f"workers {scale['peak_worker_rss_mb']} MB)")
+        print(f"  ingest:        {scale['ingest']['rows_per_sec']:>12,} rows/sec")
+        if 'load' in scale:
+            print(f"  load:          {scale['load']['rows_per_sec']:>12,} rows/sec")
+        if 'legacy_ingest' in scale:
+            print(f"  legacy ingest: {scale['legacy_ingest']['rows_per_sec']:>12,} rows/sec")
+        for name, summary in scale['queries'].items():
+            print(f"  {name:<34} p50 {summary['p50_ms']:>9.3f}ms  p99 {summary['p99_ms']:>9.3f}ms")
+        if not scale['page_plan']['uses_index']:
+            print(f"  contributors_page does not use the page index: {scale['page_plan']['details']}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ingest and queries on synthetic FEC data')
+    parser.add_argument('--scales', default='10000,100000', help='comma separated row counts (10000 to 50000000)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=500, help='calls per query benchmark')
+    parser.add_argument('--workers', type=int, default=None, help='parser processes for the ingest')
+    parser.add_argument('--skip-legacy', action='store_true', help='do not time load_contributions_to_db')
+    parser.add_argument('--work-dir', default=None, help='where to put generated data (default: a temp dir)')
+    parser.add_argument('--out', default=None, help='write results JSON here')
+    parser.add_argument('--baseline', default=None, help='results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='relative change counted as a regression')
+    parser.add_argument('--run-scale', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--result', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scale:
+        # child process: keep service output off stdout and write the result file
+        with contextlib.redirect_stdout(sys.stderr):
+            legacy = not args.skip_legacy and args.run_scale <= LEGACY_MAX_ROWS
+            result = run_scale(args.run_scale, args.work_dir, args.seed, args.queries, args.workers, legacy)
+        with open(args.result, 'w') as file:
+            json.dump(result, file)
+        return 0
+
+    if args.work_dir is None:
+        args.work_dir = tempfile.mkdtemp(prefix='fec-benchmark-')
+    results = {
+        'version': RESULTS_VERSION,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'scales': [run_scale_subprocess(int(rows), args) for rows in args.scales.split(',')],
+    }
+    print_summary(results)
+
+    status = 0
+    if not all(scale['page_plan']['uses_index'] for scale in results['scales']):
+        status = 1
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        results['baseline_commit'] = baseline.get('commit')
+        results['regressions'] = compare(results, baseline, args.threshold)
+        for regression in results['regressions']:
+            print(f"REGRESSION {regression['rows']:,} rows {regression['metric']}: "
+                  f"{regression['baseline']} -> {regression['value']} ({regression['change']:+.1%})")
+        if results['regressions']:
+            status = 1
+        else:
+            print(f"\nNo regressions against {args.baseline}")
+
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"\nWrote {args.out}")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
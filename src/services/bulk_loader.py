@@ -0,0 +1,410 @@
+import contextlib
+import os
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from instrumentation import timed
+from fec_files import (complete_lines_size, decode_lines, is_archive, iter_archive_chunks, read_range,
+                       split_file_ranges)
+from compact_schema import create_fact_indexes, delete_contribution_years, drop_fact_indexes, merge_contributions
+from contribution_cubes import queue_cube_years
+
+# size of the byte ranges handed to each worker
+CHUNK_SIZE = 32 * 1024 * 1024
+
+# decompressed archive chunks in flight per worker, so a large archive is
+# never held in memory as a whole
+CHUNKS_PER_WORKER = 2
+
+# pragmas used while the bulk load is running, restored afterwards
+LOAD_PRAGMAS = {
+    'synchronous': 'OFF',
+    'temp_store': 'MEMORY',
+    'cache_size': '-262144',
+}
+
+# AMNDT_IND of a record that terminates the transaction it amends
+TERMINATED = 'T'
+
+def column_indexes(headers, columns):
+    """Look up the positions of the given columns in the header row"""
+    return tuple(headers.index(column) for column in columns)
+
+def transaction_key(parts, cmte_i, tran_i, sub_i):
+    """
+    Key identifying a transaction across amendments. Records without a TRAN_ID
+    fall back to their SUB_ID so they never collide with each other.
+    """
+    return parts[cmte_i], parts[tran_i] or f'SUB{parts[sub_i]}'
+
+def parse_sub_id(value):
+    """Parse a SUB_ID, treating blanks and garbage as 0"""
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+def parse_transaction_date(value):
+    """MMDDYYYY TRANSACTION_DT as YYYY-MM-DD, or None if it is blank or malformed"""
+    if len(value) != 8 or not value.isdigit():
+        return None
+    month, day = value[:2], value[2:4]
+    if not ('01' <= month <= '12' and '01' <= day <= '31'):
+        return None
+    return f'{value[4:]}-{month}-{day}'
+
+def parse_range(task):
+    """
+    Parse one chunk of a contributions file. Runs inside a worker process.
+    The chunk is either a (data_path, start, end) byte range of a plain file
+    or the decompressed bytes of an archive chunk.
+
+    Rows are pre-aggregated by (candidate_id, contributor_name, year) into
+    (candidate_id, contributor_name, entity_type, amount, transactions, year, seq)
+    rows. With track_transactions the range is first reduced to one ledger row
+    per transaction, keeping the record with the highest SUB_ID so amendments
+    replace the records they amend, and the ledger rows are returned as well.
+    A transaction whose latest record terminates it (AMNDT_IND 'T') is not
+    counted and its ledger row has no amount, see TERMINATED.
+    Returns (aggregated, ledger_rows, rows, skipped).
+    """
+    source, headers, year, seq, track_transactions = task
+    n_columns = len(headers)
+    cand_i, name_i, entity_i, amount_i, cmte_i, tran_i, sub_i, date_i, other_i, amndt_i = column_indexes(
+        headers, ('CAND_ID', 'NAME', 'ENTITY_TP', 'TRANSACTION_AMT', 'CMTE_ID', 'TRAN_ID', 'SUB_ID',
+                  'TRANSACTION_DT', 'OTHER_ID', 'AMNDT_IND'))
+
+    data = read_range(*source) if isinstance(source, tuple) else source
+
+    totals = {}
+    ledger = {}
+    # one object per distinct string and date, so the ledger rows pickle
+    # their repeated values as references on the way back to the loader
+    strings = {}
+    dates = {}
+    rows = 0
+    skipped = 0
+    for line in decode_lines(data):
+        parts = line.strip().split('|')
+        if len(parts) != n_columns:
+            if line:
+                skipped += 1
+            continue
+        try:
+            amount = float(parts[amount_i])
+        except ValueError:
+            skipped += 1
+            continue
+
+        rows += 1
+        if track_transactions:
+            sub_id = parse_sub_id(parts[sub_i])
+            key = transaction_key(parts, cmte_i, tran_i, sub_i)
+            existing = ledger.get(key)
+            if existing is None or sub_id > existing[3]:
+                raw_date = parts[date_i]
+                if raw_date not in dates:
+                    dates[raw_date] = parse_transaction_date(raw_date)
+                if parts[amndt_i] == TERMINATED:
+                    amount = None
+                intern = strings.setdefault
+                ledger[key] = (intern(key[0], key[0]), key[1], year, sub_id, intern(parts[cand_i], parts[cand_i]),
+                               intern(parts[name_i], parts[name_i]), intern(parts[entity_i], parts[entity_i]),
+                               amount, dates[raw_date], intern(parts[other_i], parts[other_i]))
+            continue
+
+        key = (parts[cand_i], parts[name_i])
+        entry = totals.get(key)
+        if entry is None:
+            # keep the first entity type seen, like the upsert does
+            totals[key] = [amount, parts[entity_i], 1]
+        else:
+            entry[0] += amount
+            entry[2] += 1
+
+    ledger_rows = list(ledger.values())
+    # the same for the surviving transactions; amendments across chunks are
+    # backed out by the ledger trigger, see create_ledger_trigger
+    for row in ledger_rows:
+        if row[7] is None:
+            continue
+        key = (row[4], row[5])
+        entry = totals.get(key)
+        if entry is None:
+            totals[key] = [row[7], row[6], 1]
+        else:
+            entry[0] += row[7]
+            entry[2] += 1
+
+    aggregated = [
+        (candidate_id, contributor_name, entity_type, amount, transactions, year, seq)
+        for (candidate_id, contributor_name), (amount, entity_type, transactions) in totals.items()
+    ]
+    return aggregated, ledger_rows, rows, skipped
+
+STAGING_INSERT = '''
+    INSERT INTO contributions_staging
+        (candidate_id, contributor_name, entity_type, amount, transactions, year, seq)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+# a transaction seen again is overwritten here; the ledger trigger puts the
+# record with the highest SUB_ID back, see create_ledger_trigger
+LEDGER_UPSERT = '''
+    INSERT INTO contribution_ledger
+        (cmte_id, tran_id, year, sub_id, candidate_id, contributor_name, entity_type, amount, transaction_date,
+         other_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(cmte_id, tran_id, year) DO UPDATE SET
+        sub_id = excluded.sub_id,
+        candidate_id = excluded.candidate_id,
+        contributor_name = excluded.contributor_name,
+        entity_type = excluded.entity_type,
+        amount = excluded.amount,
+        transaction_date = excluded.transaction_date,
+        other_id = excluded.other_id
+'''
+
+def set_pragmas(conn, pragmas):
+    """Apply pragmas and return their previous values"""
+    previous = {}
+    for name, value in pragmas.items():
+        previous[name] = conn.execute(f'PRAGMA {name}').fetchone()[0]
+        conn.execute(f'PRAGMA {name} = {value}')
+    return previous
+
+def create_staging_table(conn):
+    """Create an unindexed staging table for the worker output"""
+    conn.execute('DROP TABLE IF EXISTS contributions_staging')
+    conn.execute('''
+        CREATE TABLE contributions_staging (
+            candidate_id TEXT,
+            contributor_name TEXT,
+            entity_type TEXT,
+            amount REAL,
+            transactions INTEGER,
+            year INTEGER,
+            seq INTEGER
+        )
+    ''')
+
+def create_ledger_trigger(conn):
+    """
+    Resolve transactions that turn up in more than one chunk of a bulk load.
+    The workers resolve amendments within their own chunk, so the version
+    that loses on SUB_ID was already counted in its chunk's totals, unless
+    it was a termination; it is recorded in temp.ledger_superseded to be
+    backed out, and if it arrived last the winning record is written back
+    (recursive_triggers is off, so that write does not fire the trigger
+    again). The trigger only fires on conflicts, so loading transactions
+    seen once costs nothing extra.
+    """
+    conn.execute('DROP TABLE IF EXISTS temp.ledger_superseded')
+    conn.execute('''
+        CREATE TEMP TABLE ledger_superseded (
+            candidate_id TEXT,
+            contributor_name TEXT,
+            amount REAL,
+            year INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TEMP TRIGGER ledger_supersede AFTER UPDATE ON main.contribution_ledger
+        BEGIN
+            INSERT INTO ledger_superseded (candidate_id, contributor_name, amount, year)
+            SELECT candidate_id, contributor_name, amount, NEW.year
+            FROM (SELECT OLD.candidate_id AS candidate_id, OLD.contributor_name AS contributor_name,
+                         OLD.amount AS amount
+                  WHERE NEW.sub_id > OLD.sub_id AND OLD.amount IS NOT NULL
+                  UNION ALL
+                  SELECT NEW.candidate_id, NEW.contributor_name, NEW.amount
+                  WHERE NEW.sub_id <= OLD.sub_id AND NEW.amount IS NOT NULL);
+            UPDATE contribution_ledger SET
+                sub_id = OLD.sub_id,
+                candidate_id = OLD.candidate_id,
+                contributor_name = OLD.contributor_name,
+                entity_type = OLD.entity_type,
+                amount = OLD.amount,
+                transaction_date = OLD.transaction_date,
+                other_id = OLD.other_id
+            WHERE NEW.sub_id <= OLD.sub_id
+              AND cmte_id = NEW.cmte_id AND tran_id = NEW.tran_id AND year = NEW.year;
+        END
+    ''')
+
+def drop_ledger_trigger(conn):
+    """Remove what create_ledger_trigger created, so single-record ingests are not affected"""
+    conn.execute('DROP TRIGGER IF EXISTS temp.ledger_supersede')
+    conn.execute('DROP TABLE IF EXISTS temp.ledger_superseded')
+
+def merge_staging_table(conn):
+    """Merge the staging table into contributorsFromCommittees"""
+    # bare columns come from the row holding MIN(seq), so the entity type is
+    # the one seen first in file order
+    merge_contributions(conn, '''
+        SELECT candidate_id, contributor_name, entity_type, amount, year
+        FROM (
+            SELECT candidate_id, contributor_name, entity_type, SUM(amount) AS amount,
+                   year, MIN(seq) AS first_seq
+            FROM contributions_staging
+            GROUP BY candidate_id, contributor_name, year
+        )
+    ''')
+
+def merge_staging_ledger(conn, years):
+    """
+    Replace the contributorsFromCommittees rows for the given years with the
+    staged totals, less the transactions superseded across chunks, and queue
+    the years for a contribution cube rebuild. The ledger rows were already
+    written during the load; the terminated transactions are dropped from it.
+    """
+    placeholders = ', '.join('?' for _ in years)
+    conn.execute(f'DELETE FROM contribution_ledger WHERE amount IS NULL AND year IN ({placeholders})', years)
+    delete_contribution_years(conn, years)
+    # superseded rows have no seq, so they never pick the entity type, and a
+    # group left without transactions is not added at all
+    merge_contributions(conn, '''
+        SELECT candidate_id, contributor_name, entity_type, amount, year
+        FROM (
+            SELECT candidate_id, contributor_name, entity_type, SUM(amount) AS amount,
+                   year, MIN(seq) AS first_seq
+            FROM (
+                SELECT candidate_id, contributor_name, entity_type, amount, transactions, year, seq
+                FROM contributions_staging
+                UNION ALL
+                SELECT candidate_id, contributor_name, NULL, -amount, -1, year, NULL
+                FROM temp.ledger_superseded
+            )
+            GROUP BY candidate_id, contributor_name, year
+            HAVING SUM(transactions) > 0
+        )
+    ''')
+    queue_cube_years(conn, years)
+
+def map_bounded(pool, function, tasks, window):
+    """
+    Like pool.map, but only submits window tasks ahead of the results being
+    consumed, so tasks carrying data are not all queued at once.
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.submit(function, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+@timed()
+def bulk_load_contributions(data_files, headers, conn, workers=None, chunk_size=CHUNK_SIZE,
+                            track_transactions=False):
+    """
+    Load contribution files into contributorsFromCommittees using a process pool.
+
+    data_files is a list of (file_path, year) tuples, plain text files or
+    .zip/.gz archives. Every file is split into chunks that are parsed and
+    pre-aggregated in parallel: plain files as byte ranges the workers read
+    themselves, archives as decompressed chunks streamed to them. The results are
+    bulk inserted into a staging table and merged in one statement, and the
+    candidate index is rebuilt once the load is done. Returns a dict with the
+    load statistics.
+
+    With track_transactions the rows for the loaded years are replaced instead
+    of merged, and every transaction is recorded in contribution_ledger so
+    later incremental loads can apply amendments.
+    """
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+
+    # plain files are read up to their last newline: a record that is still
+    # being written is left for the next incremental load
+    sizes = {file_path: os.path.getsize(file_path) if is_archive(file_path) else complete_lines_size(file_path)
+             for file_path, _ in data_files}
+
+    def chunk_sources():
+        for file_path, year in data_files:
+            if is_archive(file_path):
+                for data in iter_archive_chunks(file_path, chunk_size):
+                    yield data, year
+            else:
+                for start, end in split_file_ranges(file_path, chunk_size, sizes[file_path]):
+                    yield (file_path, start, end), year
+
+    tasks = ((source, headers, year, seq, track_transactions)
+             for seq, (source, year) in enumerate(chunk_sources()))
+
+    years = sorted({year for _, year in data_files})
+    previous_pragmas = set_pragmas(conn, LOAD_PRAGMAS)
+    rows = 0
+    skipped = 0
+    staged = 0
+    transactions = 0
+    chunks = 0
+    try:
+        c = conn.cursor()
+        drop_fact_indexes(conn)
+        create_staging_table(conn)
+        if track_transactions:
+            placeholders = ', '.join('?' for _ in years)
+            c.execute(f'DELETE FROM contribution_ledger WHERE year IN ({placeholders})', years)
+            create_ledger_trigger(conn)
+
+        with contextlib.ExitStack() as stack:
+            if workers == 1:
+                # nothing to run in parallel, so skip pickling every chunk's
+                # rows across a process boundary
+                results = map(parse_range, tasks)
+            else:
+                pool = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+                results = map_bounded(pool, parse_range, tasks, workers * CHUNKS_PER_WORKER)
+            for aggregated, ledger_rows, n_rows, n_skipped in results:
+                c.executemany(STAGING_INSERT, aggregated)
+                if ledger_rows:
+                    c.executemany(LEDGER_UPSERT, ledger_rows)
+                chunks += 1
+                rows += n_rows
+                skipped += n_skipped
+                staged += len(aggregated)
+                transactions += len(ledger_rows)
+
+        if track_transactions:
+            merge_staging_ledger(conn, years)
+        else:
+            merge_staging_table(conn)
+        c.execute('DROP TABLE contributions_staging')
+
+        # build the index after the data is in place
+        create_fact_indexes(conn)
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        conn.rollback()
+        raise
+    finally:
+        if track_transactions:
+            drop_ledger_trigger(conn)
+        set_pragmas(conn, previous_pragmas)
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        'files': len(data_files),
+        'chunks': chunks,
+        'rows': rows,
+        'skipped': skipped,
+        'staged': staged,
+        'transactions': transactions,
+        'seconds': elapsed,
+        'rows_per_sec': rows / elapsed if elapsed > 0 else 0.0,
+        'sizes': sizes,
+    }
+    print_load_report(stats)
+    return stats
+
+def print_load_report(stats):
+    """Print a throughput report for a bulk load"""
+    print(f"Loaded {stats['rows']:,} rows from {stats['files']} file(s) "
+          f"in {stats['chunks']} chunk(s), {stats['skipped']:,} skipped")
+    print(f"Staged {stats['staged']:,} rows")
+    if stats['transactions']:
+        print(f"Recorded {stats['transactions']:,} transactions in the ledger")
+    print(f"Elapsed: {stats['seconds']:.2f}s ({stats['rows_per_sec']:,.0f} rows/sec)")
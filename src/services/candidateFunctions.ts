@@ -2,7 +2,7 @@
 import { open } from 'sqlite';
 import sqlite3 from 'sqlite3';
 import path from 'path';
-import { fileURLToPath } from 'url';
+import { fileURLToPath, pathToFileURL } from 'url';
 
 // reduce api calls pls
 const nameCache: Record<string, string> = {};
@@ -12,11 +12,13 @@ export async function getCandidateNameFromDb(candidateId: string): Promise<strin
     
     const __filename = fileURLToPath(import.meta.url);
     const __dirname = path.dirname(__filename);
-    const dbPath = path.resolve(__dirname, 'politicaldata.db');
+    const dbPath = process.env.POLITICALDATA_DB || path.resolve(__dirname, 'politicaldata.db');
     
     // is this efficient 
+    // read-only: the published snapshot is never written in place
     const db = await open({
-      filename: dbPath,
+      filename: `${pathToFileURL(dbPath).href}?immutable=1`,
+      mode: sqlite3.OPEN_READONLY | sqlite3.OPEN_URI,
       driver: sqlite3.Database
     });
     
@@ -120,8 +122,10 @@ export async function getCandidateIdByName(candidateName: string): Promise<strin
     const path = require('path');
     
     // Open database connection
+    const dbPath = process.env.POLITICALDATA_DB || path.resolve(__dirname, 'politicaldata.db');
     const db = await open({
-      filename: path.resolve(__dirname, 'politicaldata.db'),
+      filename: `${pathToFileURL(dbPath).href}?immutable=1`,
+      mode: sqlite3.OPEN_READONLY | sqlite3.OPEN_URI,
       driver: sqlite3.Database
     });
     
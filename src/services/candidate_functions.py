@@ -1,16 +1,24 @@
 import os
+import sqlite3
 from dotenv import load_dotenv
 import httpx
 
 load_dotenv()
 
 # src/services/candidateFunctions.py
-import sqlite3
+from database import get_db_connection
+from candidate_index import index_available, resolve_candidates
+from instrumentation import timed
 
-def getCandidateIdByName(candidate_name):
+@timed()
+def getCandidateIdByName(candidate_name, office=None):
     """Get a candidate's ID from the database given their name"""
     try:
-        conn = sqlite3.connect('politicaldata.db')
+        conn = get_db_connection()
+        if index_available(conn):
+            matches = resolve_candidates([candidate_name], office=office)[candidate_name]
+            return matches[0][0] if matches else None
+        
         cursor = conn.cursor()
         
         # Try exact match first
@@ -23,8 +31,94 @@ def getCandidateIdByName(candidate_name):
                           (f'%{candidate_name}%',))
             result = cursor.fetchone()
             
-        conn.close()
         return result[0] if result else None
     except Exception as e:
         print(f"Error finding candidate ID: {e}")
         return None
+
+@timed()
+def getCandidateIdsByNames(candidate_names, conn=None, office=None):
+    """
+    Resolve many candidate names to IDs. Uses the ranked candidate_name_index
+    when it has been built, otherwise a single pass over candidates with the
+    same rules as the LIKE lookup: an exact case-insensitive match first, then
+    the first candidate whose name contains the given name.
+    Returns a dict of name -> CAND_ID (or None).
+    """
+    # without a conn the shared snapshot is used, and the resolver can cache
+    if index_available(conn):
+        matches = resolve_candidates(candidate_names, office=office, conn=conn)
+        return {name: found[0][0] if found else None for name, found in matches.items()}
+    
+    if conn is None:
+        conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT CAND_ID, CAND_NAME FROM candidates ORDER BY rowid')
+    candidates = [(cand_id, (cand_name or '').lower()) for cand_id, cand_name in cursor.fetchall()]
+
+    exact = {}
+    for cand_id, cand_name in candidates:
+        exact.setdefault(cand_name, cand_id)
+
+    result = {}
+    for candidate_name in candidate_names:
+        name = candidate_name.lower()
+        cand_id = exact.get(name)
+        if cand_id is None:
+            cand_id = next((cid for cid, cand_name in candidates if name in cand_name), None)
+        result[candidate_name] = cand_id
+    return result
+
+def find_candidate(conn, candidate_id):
+    """The candidates row for an ID as a dict, else the candidates_master one, else None"""
+    cursor = conn.cursor()
+    for table in ('candidates', 'candidates_master'):
+        try:
+            cursor.execute(f'SELECT * FROM {table} WHERE CAND_ID = ?', (candidate_id,))
+        except sqlite3.OperationalError:
+            # not every database has both tables
+            continue
+        row = cursor.fetchone()
+        if row is not None:
+            return dict(zip((column[0] for column in cursor.description), row))
+    return None
+
+@timed()
+def get_candidate_name(candidate_id, conn=None):
+    """Get a candidate's name from the database given their ID, or None"""
+    if conn is None:
+        conn = get_db_connection()
+    candidate = find_candidate(conn, candidate_id)
+    return candidate['CAND_NAME'] if candidate else None
+
+@timed()
+def candidate_info(candidate_id, conn=None):
+    """
+    A candidate's details and the committee money they received, or None if
+    the ID is not in the database
+    """
+    if conn is None:
+        conn = get_db_connection()
+    candidate = find_candidate(conn, candidate_id)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT SUM(f.amount), COUNT(*)
+        FROM candidate_dim cd
+        JOIN contribution_facts f ON f.candidate_key = cd.candidate_key
+        WHERE cd.candidate_id = ? AND f.entity_type != 'IND'
+    ''', (candidate_id,))
+    total, contributions = cursor.fetchone()
+    if candidate is None and not contributions:
+        return None
+    candidate = candidate or {}
+    return {
+        'id': candidate_id,
+        'name': candidate.get('CAND_NAME'),
+        'party': candidate.get('CAND_PTY_AFFILIATION'),
+        'state': candidate.get('CAND_OFFICE_ST'),
+        'district': candidate.get('CAND_OFFICE_DISTRICT'),
+        # S, H or P, the first letter of every FEC candidate ID
+        'office': candidate_id[:1],
+        'committee_total': total or 0.0,
+        'committee_contributions': contributions,
+    }
@@ -0,0 +1,237 @@
+import hashlib
+import re
+import sqlite3
+import time
+from functools import lru_cache
+from database import connect, current_snapshot, get_db_connection
+from ingest_state import get_state, set_state
+from instrumentation import timed
+from snapshot import publish_snapshot
+
+# tokens that say nothing about who a candidate is
+IGNORED_TOKENS = {'JR', 'SR', 'II', 'III', 'IV', 'V', 'MR', 'MRS', 'MS', 'DR', 'HON', 'SEN', 'SENATOR', 'REP'}
+
+NON_WORD = re.compile(r'[^A-Z0-9]+')
+
+def tokenize(text):
+    """Split a name into upper-case word tokens, dropping suffixes and titles"""
+    return [token for token in NON_WORD.split(text.upper()) if token and token not in IGNORED_TOKENS]
+
+def normalize_name(name):
+    """
+    Normalize a person's name to (surname_tokens, other_tokens).
+
+    Handles FEC's "KING, ANGUS S JR" as well as natural order names such as
+    "Angus S. King, Jr." where the part after the comma is only a suffix.
+    """
+    if ',' in name:
+        before, after = name.split(',', 1)
+        if tokenize(after):
+            # FEC order: surname before the comma
+            return tokenize(before), tokenize(after)
+        name = before
+    tokens = tokenize(name)
+    if not tokens:
+        return [], []
+    return tokens[-1:], tokens[:-1]
+
+def build_candidate_index(conn):
+    """
+    Build the candidate_name_index FTS5 table from candidates. Needs a
+    writable connection; commits.
+    """
+    c = conn.cursor()
+    c.execute('DROP TABLE IF EXISTS candidate_name_index')
+    c.execute('''
+        CREATE VIRTUAL TABLE candidate_name_index USING fts5(
+            surname, name, cand_id UNINDEXED, cand_name UNINDEXED
+        )
+    ''')
+    c.execute('SELECT CAND_ID, CAND_NAME FROM candidates')
+    rows = []
+    for cand_id, cand_name in c.fetchall():
+        surname, others = normalize_name(cand_name or '')
+        rows.append((' '.join(surname), ' '.join(surname + others), cand_id, cand_name))
+    c.executemany('''
+        INSERT INTO candidate_name_index (surname, name, cand_id, cand_name)
+        VALUES (?, ?, ?, ?)
+    ''', rows)
+    set_state(conn, 'candidate_index_source', candidates_signature(conn))
+    conn.commit()
+    clear_cache()
+    return len(rows)
+
+def candidates_signature(conn):
+    """Cheap fingerprint of the candidates table used to detect changes"""
+    c = conn.cursor()
+    c.execute('SELECT COUNT(*), MAX(rowid) FROM candidates')
+    count, max_rowid = c.fetchone()
+    return f'{count}:{max_rowid}'
+
+def refresh_candidate_index(conn):
+    """Rebuild the index if candidates changed since it was built"""
+    try:
+        signature = candidates_signature(conn)
+    except sqlite3.OperationalError:
+        # no candidates table in this database
+        return False
+    if get_state(conn, 'candidate_index_source') == signature:
+        return False
+    count = build_candidate_index(conn)
+    print(f"Indexed {count:,} candidate names")
+    return True
+
+def fts_query(surname, others):
+    """Build an FTS5 query requiring the surname and preferring the other tokens"""
+    query = ' AND '.join(f'surname : "{token}"' for token in surname)
+    if others:
+        query += ' AND (' + ' OR '.join(f'name : "{token}"' for token in others) + ')'
+    return query
+
+def score_match(surname, others, cand_id, indexed_surname, indexed_name, office):
+    """Score a candidate row against the normalized input name"""
+    wanted = set(surname) | set(others)
+    found_tokens = indexed_name.split()
+    found_others = found_tokens[len(indexed_surname.split()):]
+    found = set(found_tokens)
+    score = len(wanted & found) / len(wanted)
+    # small penalty for tokens the input did not mention (middle names etc.)
+    score -= 0.01 * len(found - wanted)
+    if others and found_others and found_others[0] == others[0]:
+        score += 0.25
+    if office and cand_id.startswith(office):
+        score += 0.5
+    return score
+
+def lookup_name(conn, surname, others, limit, office):
+    """Ranked lookup for one normalized name"""
+    c = conn.cursor()
+    rows = []
+    if others:
+        c.execute('''
+            SELECT cand_id, cand_name, surname, name, rank FROM candidate_name_index
+            WHERE candidate_name_index MATCH ?
+            ORDER BY rank LIMIT 50
+        ''', (fts_query(surname, others),))
+        rows = c.fetchall()
+    if not rows:
+        c.execute('''
+            SELECT cand_id, cand_name, surname, name, rank FROM candidate_name_index
+            WHERE candidate_name_index MATCH ?
+            ORDER BY rank LIMIT 50
+        ''', (fts_query(surname, ()),))
+        rows = c.fetchall()
+
+    ranked = sorted(
+        ((score_match(surname, others, cand_id, indexed_surname, indexed_name, office), -rank, cand_id, cand_name)
+         for cand_id, cand_name, indexed_surname, indexed_name, rank in rows),
+        reverse=True
+    )
+    return tuple((cand_id, cand_name, round(score, 4)) for score, _, cand_id, cand_name in ranked[:limit])
+
+@lru_cache(maxsize=8192)
+def _resolve(snapshot, surname, others, limit, office):
+    # snapshot is only part of the key: lookups made against an older
+    # snapshot are not reused once a rebuilt index was published
+    return lookup_name(get_db_connection(), surname, others, limit, office)
+
+@timed()
+def resolve_candidates(names, limit=1, office=None, conn=None):
+    """
+    Resolve candidate names using the candidate_name_index.
+
+    Returns a dict of name -> list of (CAND_ID, CAND_NAME, score), best match
+    first and at most limit entries. office ('S', 'H' or 'P') ranks
+    candidates running for that office higher. Results are cached in-process
+    per published snapshot, except for lookups on an explicit conn, e.g. the
+    writer during ingest.
+    """
+    result = {}
+    snapshot = current_snapshot() if conn is None else None
+    for name in names:
+        surname, others = normalize_name(name)
+        if not surname:
+            result[name] = []
+            continue
+        if conn is not None:
+            result[name] = list(lookup_name(conn, tuple(surname), tuple(others), limit, office))
+        else:
+            result[name] = list(_resolve(snapshot, tuple(surname), tuple(others), limit, office))
+    return result
+
+def index_available(conn=None):
+    """Check whether the candidate_name_index table exists"""
+    if conn is None:
+        conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM sqlite_master WHERE name = 'candidate_name_index'")
+    return c.fetchone() is not None
+
+def clear_cache():
+    """Forget cached lookups, e.g. after the index was rebuilt"""
+    _resolve.cache_clear()
+
+def senate_signature(conn):
+    """Fingerprint of the senators' names and the candidate index they are resolved against"""
+    c = conn.cursor()
+    c.execute('SELECT id, name FROM senate ORDER BY id')
+    names = '\n'.join(f'{senator_id}:{name}' for senator_id, name in c.fetchall())
+    return f"{hashlib.sha1(names.encode()).hexdigest()}:{get_state(conn, 'candidate_index_source')}"
+
+def refresh_senate_candidates(conn):
+    """
+    Resolve every senator to a CAND_ID once and store the mapping in
+    senate_candidates, unless neither senate nor the candidate index changed
+    since the last time. Needs a writable connection; commits.
+    """
+    try:
+        signature = senate_signature(conn)
+    except sqlite3.OperationalError:
+        # no senate table in this database
+        return False
+    if get_state(conn, 'senate_candidates_source') == signature or not index_available(conn):
+        return False
+
+    c = conn.cursor()
+    c.execute('SELECT id, name FROM senate')
+    senators = c.fetchall()
+    matches = resolve_candidates([name for _, name in senators], office='S', conn=conn)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS senate_candidates (
+            senator_id INTEGER PRIMARY KEY,
+            candidate_id TEXT
+        )
+    ''')
+    c.execute('DELETE FROM senate_candidates')
+    c.executemany('INSERT INTO senate_candidates (senator_id, candidate_id) VALUES (?, ?)',
+                  [(senator_id, matches[name][0][0] if matches[name] else None) for senator_id, name in senators])
+    set_state(conn, 'senate_candidates_source', signature)
+    conn.commit()
+    print(f"Mapped {len(senators)} senators to candidate IDs")
+    return True
+
+def load_senate_candidates(conn):
+    """The stored senator id -> CAND_ID mapping, or None if it is missing or out of date"""
+    try:
+        if get_state(conn, 'senate_candidates_source') != senate_signature(conn):
+            return None
+        c = conn.cursor()
+        c.execute('SELECT senator_id, candidate_id FROM senate_candidates')
+        return dict(c.fetchall())
+    except sqlite3.OperationalError:
+        return None
+
+if __name__ == "__main__":
+    writer = connect(readonly=False)
+    refresh_candidate_index(writer)
+    refresh_senate_candidates(writer)
+    publish_snapshot(writer)
+    writer.close()
+
+    names = ['Angus S. King, Jr.', 'Elizabeth Warren', 'Ted Cruz', 'Bernard Sanders']
+    started = time.perf_counter()
+    matches = resolve_candidates(names, limit=3, office='S')
+    elapsed = time.perf_counter() - started
+    for name in names:
+        print(f"{name}: {matches[name]}")
+    print(f"Resolved {len(names)} names in {elapsed * 1000:.2f}ms")
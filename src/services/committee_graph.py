@@ -0,0 +1,280 @@
+"""
+Committee money flow graph.
+
+Every non-individual ledger row moves money from the filing committee
+(CMTE_ID) to the committee it names in OTHER_ID, and from there to the
+candidate (CAND_ID). refresh_committee_graph sums these rows into
+committee_edges once per ingest, one row per (source, target, year). The
+table is clustered on source, so it already is the adjacency list.
+get_committee_graph loads it into CSR arrays (indptr, targets, amounts),
+and a multi-hop query is then a few NumPy operations per hop.
+
+A committee that received money is assumed to pass it on pro rata. Money
+arriving at a committee follows each outgoing edge with the share
+edge / max(money out, money in) of that committee, and whatever the
+committee kept stays there. So "where did this PAC's money land" is
+
+    committee_flows('C00000935', hops=3)
+
+with the candidates that received the most and the largest single paths.
+
+    python committee_graph.py C00000935 [--hops 3] [--top 10] [--year 2024]
+"""
+import argparse
+import threading
+import time
+import numpy as np
+from database import VersionCheck, connect, get_db_connection
+from ingest_state import get_generation, get_state, set_state
+from instrumentation import timed
+
+GRAPH_GENERATION_KEY = 'committee_graph_generation'
+
+MAX_HOPS = 6
+
+# partial flows smaller than this share of the start committee's money are
+# dropped, and at most MAX_FRONTIER of them are followed per hop
+MIN_SHARE = 0.0001
+MAX_FRONTIER = 20000
+
+def create_graph_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS committee_edges (
+            source TEXT,
+            target TEXT,
+            year INTEGER,
+            amount REAL,
+            transactions INTEGER,
+            PRIMARY KEY (source, target, year)
+        ) WITHOUT ROWID
+    ''')
+
+def drop_graph_tables(conn):
+    conn.execute('DROP TABLE IF EXISTS committee_edges')
+
+@timed()
+def refresh_committee_graph(conn):
+    """
+    Rebuild committee_edges from contribution_ledger if new data was loaded
+    since the last time. Needs a writable connection; commits.
+    """
+    create_graph_tables(conn)
+    generation = get_generation(conn)
+    if get_state(conn, GRAPH_GENERATION_KEY) == str(generation):
+        return False
+    c = conn.cursor()
+    c.execute('DELETE FROM committee_edges')
+    # committee IDs start with C, candidate IDs with H, S or P
+    c.execute('''
+        INSERT INTO committee_edges (source, target, year, amount, transactions)
+        SELECT source, target, year, SUM(amount), COUNT(*)
+        FROM (
+            SELECT cmte_id AS source, other_id AS target, year, amount
+            FROM contribution_ledger
+            WHERE entity_type != 'IND' AND other_id LIKE 'C%' AND other_id != cmte_id
+            UNION ALL
+            SELECT CASE WHEN other_id LIKE 'C%' THEN other_id ELSE cmte_id END, candidate_id, year, amount
+            FROM contribution_ledger
+            WHERE entity_type != 'IND' AND candidate_id != ''
+        )
+        GROUP BY source, target, year
+        HAVING SUM(amount) > 0
+    ''')
+    edges = c.rowcount
+    set_state(conn, GRAPH_GENERATION_KEY, generation)
+    conn.commit()
+    print(f"Built the committee graph with {edges:,} edges")
+    return True
+
+class CommitteeGraph:
+    """committee_edges as CSR arrays, per year or over all years"""
+
+    def __init__(self):
+        self.node_ids = np.empty(0, dtype=object)
+        self.node_index = {}
+        self.is_committee = np.empty(0, dtype=bool)
+        # one entry per committee_edges row, ordered by (source, target)
+        self.sources = np.empty(0, dtype=np.int32)
+        self.targets = np.empty(0, dtype=np.int32)
+        self.years = np.empty(0, dtype=np.int16)
+        self.amounts = np.empty(0, dtype=np.float64)
+        self.generation = None
+        self._csr = {}
+
+    def load(self, conn):
+        c = conn.cursor()
+        c.execute('SELECT source, target, year, amount FROM committee_edges')
+        rows = c.fetchall()
+        self.__init__()
+        self.generation = get_generation(conn)
+        if not rows:
+            return
+        sources, targets, years, amounts = zip(*rows)
+        ids, codes = np.unique(np.array(sources + targets, dtype=object), return_inverse=True)
+        self.node_ids = ids
+        self.node_index = {node_id: code for code, node_id in enumerate(ids.tolist())}
+        self.is_committee = np.array([node_id.startswith('C') for node_id in ids.tolist()], dtype=bool)
+        sources, targets = codes[:len(rows)].astype(np.int32), codes[len(rows):].astype(np.int32)
+        order = np.lexsort((targets, sources))
+        self.sources, self.targets = sources[order], targets[order]
+        self.years = np.array(years, dtype=np.int16)[order]
+        self.amounts = np.array(amounts, dtype=np.float64)[order]
+
+    def csr(self, year=None):
+        """
+        (indptr, targets, amounts, passed_on, out_total) for one year or all of
+        them, with the edges of different years added up. passed_on is the
+        share of a node's incoming money that leaves per unit of edge amount.
+        """
+        key = int(year) if year else None
+        if key not in self._csr:
+            rows = np.ones(len(self.sources), dtype=bool) if key is None else self.years == key
+            sources, targets, amounts = self.sources[rows], self.targets[rows], self.amounts[rows]
+            if len(sources):
+                # rows are sorted by (source, target), so equal edges are adjacent
+                changed = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+                starts = np.flatnonzero(np.r_[True, changed])
+                sources, targets = sources[starts], targets[starts]
+                amounts = np.add.reduceat(amounts, starts)
+            n = len(self.node_ids)
+            out_total = np.bincount(sources, weights=amounts, minlength=n)
+            in_total = np.bincount(targets, weights=amounts, minlength=n)
+            indptr = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(sources, minlength=n), out=indptr[1:])
+            denominator = np.maximum(out_total, in_total)
+            passed_on = np.divide(1.0, denominator, out=np.zeros(n), where=denominator > 0)
+            self._csr[key] = (indptr, targets, amounts, passed_on, out_total)
+        return self._csr[key]
+
+    def flows(self, committee_id, hops=3, top=10, year=None, min_share=MIN_SHARE):
+        """
+        Follow committee_id's money for up to hops edges. Returns (total_out,
+        landed, paths): landed holds (candidate_id, amount) for the top
+        candidates, paths holds (node_ids, amount) for the top paths ending at
+        a candidate, largest first.
+        """
+        start = self.node_index.get(committee_id)
+        if start is None:
+            return 0.0, [], []
+        indptr, targets, amounts, passed_on, out_total = self.csr(year)
+        total_out = float(out_total[start])
+        floor = total_out * min_share
+
+        # frontier: one row per partial path, the node it ends at and the money on it
+        paths = np.array([[start]], dtype=np.int32)
+        money = np.array([1.0])
+        scale = np.array([1.0])
+        ended_paths = []
+        ended_money = []
+        for _ in range(min(int(hops), MAX_HOPS)):
+            nodes = paths[:, -1]
+            counts = indptr[nodes + 1] - indptr[nodes]
+            if not counts.sum():
+                break
+            parent = np.repeat(np.arange(len(nodes)), counts)
+            # edge positions: each frontier node's slice of the CSR arrays
+            edges = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + indptr[nodes][parent]
+            next_nodes = targets[edges]
+            next_money = money[parent] * scale[parent] * amounts[edges]
+
+            keep = (next_money >= floor) & ~(paths[parent] == next_nodes[:, None]).any(axis=1)
+            parent, next_nodes, next_money = parent[keep], next_nodes[keep], next_money[keep]
+            next_paths = np.hstack((paths[parent], next_nodes[:, None]))
+
+            # candidates end a path, committees pass the money on
+            landed = ~self.is_committee[next_nodes]
+            ended_paths.append(next_paths[landed])
+            ended_money.append(next_money[landed])
+            paths, money = next_paths[~landed], next_money[~landed]
+            if len(money) > MAX_FRONTIER:
+                kept = np.argpartition(-money, MAX_FRONTIER - 1)[:MAX_FRONTIER]
+                paths, money = paths[kept], money[kept]
+            scale = passed_on[paths[:, -1]]
+            if not len(money):
+                break
+
+        if not ended_money:
+            return total_out, [], []
+        candidates = np.concatenate([path[:, -1] for path in ended_paths])
+        path_money = np.concatenate(ended_money)
+        totals = np.bincount(candidates, weights=path_money, minlength=len(self.node_ids))
+        landed = [(self.node_ids[i], amount) for i, amount in top_k(totals, top)]
+
+        # ended paths are grouped by length, one block per hop
+        offsets = np.cumsum([0] + [len(block) for block in ended_paths])
+        paths = []
+        for i, amount in top_k(path_money, top):
+            block = int(np.searchsorted(offsets, i, side='right')) - 1
+            path = ended_paths[block][i - offsets[block]]
+            paths.append(([self.node_ids[node] for node in path], amount))
+        return total_out, landed, paths
+
+def top_k(values, k):
+    """Indexes and values of the k largest positive values, largest first"""
+    k = min(int(k), int(np.count_nonzero(values > 0)))
+    if k <= 0:
+        return []
+    picked = np.argpartition(-values, k - 1)[:k]
+    picked = picked[np.argsort(-values[picked], kind='stable')]
+    return [(int(i), float(values[i])) for i in picked]
+
+_graph = None
+_generation = VersionCheck(get_generation)
+_lock = threading.Lock()
+
+@timed()
+def get_committee_graph(conn=None):
+    """
+    The process-wide graph, loaded on first use and reloaded when the ingest
+    generation changed.
+    """
+    global _graph
+    with _lock:
+        if conn is None:
+            conn = get_db_connection()
+        if _generation.changed(conn) or _graph is None:
+            graph = CommitteeGraph()
+            graph.load(conn)
+            _graph = graph
+        return _graph
+
+@timed()
+def committee_flows(committee_id, hops=3, top=10, year=None):
+    """Where a committee's money ended up, see CommitteeGraph.flows"""
+    graph = get_committee_graph()
+    total_out, landed, paths = graph.flows(committee_id, int(hops or 3), int(top or 10), year or None)
+    return {
+        'committee_id': committee_id,
+        'total_out': total_out,
+        'candidates': [{'candidate_id': candidate_id, 'amount': amount} for candidate_id, amount in landed],
+        'paths': [{'path': path, 'amount': amount} for path, amount in paths],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trace where a committee's money went")
+    parser.add_argument('committee_id', nargs='?', default=None)
+    parser.add_argument('--hops', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--year', type=int, default=None)
+    parser.add_argument('--refresh', action='store_true', help='rebuild committee_edges in the writer database')
+    args = parser.parse_args()
+
+    if args.refresh:
+        writer = connect(readonly=False)
+        refresh_committee_graph(writer)
+        writer.close()
+
+    graph = get_committee_graph()
+    committee_id = args.committee_id
+    if committee_id is None:
+        # the committee that gave the most
+        _, _, _, _, out_total = graph.csr(args.year)
+        committee_id = graph.node_ids[int(np.argmax(out_total))]
+    started = time.perf_counter()
+    result = committee_flows(committee_id, args.hops, args.top, args.year)
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"{committee_id} gave ${result['total_out']:,.2f} ({elapsed:.2f}ms)")
+    for candidate in result['candidates']:
+        print(f"  {candidate['candidate_id']}: ${candidate['amount']:,.2f}")
+    for path in result['paths']:
+        print(f"  {' -> '.join(path['path'])}: ${path['amount']:,.2f}")
@@ -0,0 +1,274 @@
+"""
+Compact storage for committee contributions.
+
+Candidate IDs and contributor names are stored once in candidate_dim and
+contributor_dim and referenced by integer keys from the contribution_facts
+WITHOUT ROWID table, which is clustered on (candidate_key, contributor_key,
+year). contributorsFromCommittees is kept as a view with the old columns, so
+readers do not change. Inserting into the view goes through an INSTEAD OF
+trigger that adds the amount to an existing row, like the old upsert did.
+Bulk writers should use merge_contributions, which does the same set-based.
+
+Run this module to migrate an existing database from the old single-table
+layout and print the size and query time comparison.
+"""
+import argparse
+import os
+import statistics
+import time
+from database import connect, WRITER_DB_PATH
+from snapshot import ensure_writer_db, publish_snapshot
+
+# secondary indexes on contribution_facts, dropped during bulk loads
+FACT_INDEXES = {
+    # candidate pages ordered by year and amount, with entity_type there to
+    # filter out individuals without touching the table
+    'idx_facts_candidate_year_amount':
+        'contribution_facts(candidate_key, year, amount, entity_type)',
+    # contributor -> candidates, e.g. keyword lookups on contributor_dim
+    'idx_facts_contributor': 'contribution_facts(contributor_key)',
+}
+
+def object_type(conn, name):
+    """'table', 'view', ... for a schema object, or None if it does not exist"""
+    row = conn.execute('SELECT type FROM sqlite_master WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else None
+
+def create_fact_indexes(conn):
+    for name, definition in FACT_INDEXES.items():
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+
+def drop_fact_indexes(conn):
+    for name in FACT_INDEXES:
+        conn.execute(f'DROP INDEX IF EXISTS {name}')
+
+def create_compact_schema(conn):
+    """Create the dimension and fact tables, their indexes and the compatibility view"""
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS candidate_dim (
+            candidate_key INTEGER PRIMARY KEY,
+            candidate_id TEXT NOT NULL UNIQUE
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS contributor_dim (
+            contributor_key INTEGER PRIMARY KEY,
+            contributor_name TEXT NOT NULL UNIQUE
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS contribution_facts (
+            candidate_key INTEGER NOT NULL,
+            contributor_key INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            entity_type TEXT,
+            amount REAL,
+            PRIMARY KEY (candidate_key, contributor_key, year)
+        ) WITHOUT ROWID
+    ''')
+    create_fact_indexes(conn)
+    c.execute('''
+        CREATE VIEW IF NOT EXISTS contributorsFromCommittees AS
+        SELECT cd.candidate_id, kd.contributor_name, f.entity_type, f.amount, f.year
+        FROM contribution_facts f
+        JOIN candidate_dim cd ON cd.candidate_key = f.candidate_key
+        JOIN contributor_dim kd ON kd.contributor_key = f.contributor_key
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS contributorsFromCommittees_insert
+        INSTEAD OF INSERT ON contributorsFromCommittees
+        BEGIN
+            INSERT OR IGNORE INTO candidate_dim (candidate_id) VALUES (NEW.candidate_id);
+            INSERT OR IGNORE INTO contributor_dim (contributor_name) VALUES (NEW.contributor_name);
+            INSERT INTO contribution_facts (candidate_key, contributor_key, year, entity_type, amount)
+            VALUES (
+                (SELECT candidate_key FROM candidate_dim WHERE candidate_id = NEW.candidate_id),
+                (SELECT contributor_key FROM contributor_dim WHERE contributor_name = NEW.contributor_name),
+                NEW.year, NEW.entity_type, NEW.amount
+            )
+            ON CONFLICT (candidate_key, contributor_key, year)
+            DO UPDATE SET amount = amount + excluded.amount;
+        END
+    ''')
+
+def drop_contributions(conn):
+    """Drop contributorsFromCommittees in either layout"""
+    kind = object_type(conn, 'contributorsFromCommittees')
+    if kind == 'view':
+        conn.execute('DROP VIEW contributorsFromCommittees')
+    elif kind == 'table':
+        conn.execute('DROP TABLE contributorsFromCommittees')
+    for table in ('contribution_facts', 'candidate_dim', 'contributor_dim'):
+        conn.execute(f'DROP TABLE IF EXISTS {table}')
+
+def merge_contributions(conn, select_sql, params=()):
+    """
+    Add the rows of a query returning (candidate_id, contributor_name,
+    entity_type, amount, year), unique per (candidate_id, contributor_name,
+    year), to contribution_facts. Existing rows get the amount added and keep
+    their entity type. Does not commit.
+    """
+    c = conn.cursor()
+    c.execute('DROP TABLE IF EXISTS temp.merge_rows')
+    c.execute(f'CREATE TEMP TABLE merge_rows AS {select_sql}', params)
+    c.execute('''
+        INSERT OR IGNORE INTO candidate_dim (candidate_id)
+        SELECT DISTINCT candidate_id FROM temp.merge_rows
+    ''')
+    c.execute('''
+        INSERT OR IGNORE INTO contributor_dim (contributor_name)
+        SELECT DISTINCT contributor_name FROM temp.merge_rows
+    ''')
+    c.execute('''
+        INSERT INTO contribution_facts (candidate_key, contributor_key, year, entity_type, amount)
+        SELECT cd.candidate_key, kd.contributor_key, m.year, m.entity_type, m.amount
+        FROM temp.merge_rows m
+        JOIN candidate_dim cd ON cd.candidate_id = m.candidate_id
+        JOIN contributor_dim kd ON kd.contributor_name = m.contributor_name
+        WHERE true
+        ORDER BY cd.candidate_key, kd.contributor_key, m.year
+        ON CONFLICT (candidate_key, contributor_key, year)
+        DO UPDATE SET amount = amount + excluded.amount
+    ''')
+    merged = c.rowcount
+    c.execute('DROP TABLE temp.merge_rows')
+    return merged
+
+def delete_contribution_years(conn, years):
+    """Remove the facts for the given years. Does not commit."""
+    placeholders = ', '.join('?' for _ in years)
+    conn.execute(f'DELETE FROM contribution_facts WHERE year IN ({placeholders})', tuple(years))
+
+def database_size(conn):
+    """Bytes in use by the database, not counting free pages"""
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return page_size * (page_count - free_pages)
+
+def sample_candidates(conn, count=50):
+    """The candidates with the most contributors, the ones profile pages hit most"""
+    return [candidate_id for (candidate_id,) in conn.execute('''
+        SELECT candidate_id FROM contributorsFromCommittees
+        GROUP BY candidate_id ORDER BY COUNT(*) DESC LIMIT ?
+    ''', (count,))]
+
+# the access patterns used across the services
+BENCHMARK_QUERIES = {
+    'contributors_by_candidate': '''
+        SELECT contributor_name, amount, year
+        FROM contributorsFromCommittees
+        WHERE candidate_id = ? AND entity_type != 'IND'
+        ORDER BY year DESC, amount DESC
+    ''',
+    'contributors_page': '''
+        SELECT contributor_name, amount, year
+        FROM contributorsFromCommittees
+        WHERE candidate_id = ? AND entity_type != 'IND'
+        ORDER BY year DESC, amount DESC, contributor_name DESC
+        LIMIT 100
+    ''',
+    'yearly_totals': '''
+        SELECT year, SUM(amount), COUNT(*)
+        FROM contributorsFromCommittees
+        WHERE candidate_id = ? AND entity_type != 'IND'
+        GROUP BY year
+    ''',
+}
+
+def time_queries(conn, candidate_ids, repeat=3):
+    """Median milliseconds per query over the sample candidates"""
+    timings = {}
+    for name, sql in BENCHMARK_QUERIES.items():
+        samples = []
+        for _ in range(repeat):
+            for candidate_id in candidate_ids:
+                started = time.perf_counter()
+                conn.execute(sql, (candidate_id,)).fetchall()
+                samples.append((time.perf_counter() - started) * 1000)
+        timings[name] = statistics.median(samples)
+    return timings
+
+def migrate_to_compact(conn, vacuum=True, measure=True):
+    """
+    Move an old single-table contributorsFromCommittees into the compact
+    layout. Returns None if there is nothing to migrate, otherwise a report
+    with the database size and query times before and after. Commits.
+    """
+    if object_type(conn, 'contributorsFromCommittees') != 'table':
+        return None
+
+    report = {}
+    candidate_ids = []
+    if measure:
+        candidate_ids = sample_candidates(conn)
+        report['size_before'] = database_size(conn)
+        report['queries_before'] = time_queries(conn, candidate_ids)
+
+    started = time.perf_counter()
+    c = conn.cursor()
+    c.execute('ALTER TABLE contributorsFromCommittees RENAME TO contributors_legacy')
+    for name in ('idx_candidate', 'idx_candidate_year_amount'):
+        c.execute(f'DROP INDEX IF EXISTS {name}')
+    create_compact_schema(conn)
+    drop_fact_indexes(conn)
+    c.execute('''
+        INSERT INTO candidate_dim (candidate_id)
+        SELECT DISTINCT candidate_id FROM contributors_legacy ORDER BY candidate_id
+    ''')
+    c.execute('''
+        INSERT INTO contributor_dim (contributor_name)
+        SELECT DISTINCT contributor_name FROM contributors_legacy ORDER BY contributor_name
+    ''')
+    c.execute('''
+        INSERT INTO contribution_facts (candidate_key, contributor_key, year, entity_type, amount)
+        SELECT cd.candidate_key, kd.contributor_key, l.year, l.entity_type, l.amount
+        FROM contributors_legacy l
+        JOIN candidate_dim cd ON cd.candidate_id = l.candidate_id
+        JOIN contributor_dim kd ON kd.contributor_name = l.contributor_name
+        ORDER BY cd.candidate_key, kd.contributor_key, l.year
+    ''')
+    report['rows'] = c.rowcount
+    create_fact_indexes(conn)
+    c.execute('DROP TABLE contributors_legacy')
+    conn.commit()
+    if vacuum:
+        conn.execute('VACUUM')
+    c.execute('ANALYZE')
+    conn.commit()
+    report['seconds'] = time.perf_counter() - started
+
+    if measure:
+        report['size_after'] = database_size(conn)
+        report['queries_after'] = time_queries(conn, candidate_ids)
+    return report
+
+def print_migration_report(report):
+    print(f"Migrated {report['rows']:,} rows to the compact layout in {report['seconds']:.1f}s")
+    if 'size_before' not in report:
+        return
+    before, after = report['size_before'], report['size_after']
+    print(f"Database size: {before / 1e6:,.1f} MB -> {after / 1e6:,.1f} MB "
+          f"({(1 - after / before) * 100:.0f}% smaller)")
+    for name, old in report['queries_before'].items():
+        new = report['queries_after'][name]
+        print(f"  {name:<28} {old:8.3f}ms -> {new:8.3f}ms ({old / new if new else float('inf'):.1f}x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Migrate contributorsFromCommittees to the compact layout')
+    parser.add_argument('--db', default=WRITER_DB_PATH)
+    parser.add_argument('--no-vacuum', action='store_true', help='skip reclaiming the space of the old table')
+    args = parser.parse_args()
+
+    if args.db == WRITER_DB_PATH:
+        ensure_writer_db()
+    conn = connect(args.db, readonly=False)
+    report = migrate_to_compact(conn, vacuum=not args.no_vacuum)
+    if report is None:
+        print(f"{args.db} already uses the compact layout")
+    else:
+        print_migration_report(report)
+        if args.db == WRITER_DB_PATH:
+            publish_snapshot(conn)
+    conn.close()
@@ -0,0 +1,448 @@
+"""
+Batched Congress.gov client.
+
+Member and bill data for many legislators is fetched concurrently over one
+pooled httpx.AsyncClient. Every request takes a token from a token bucket
+kept next to the cache and shared by every process, so bursts stay under
+the API's rate limit, and is retried with exponential
+backoff on 429, 5xx and connection errors. Responses are cached on disk:
+bodies are stored once under their SHA-256, and each request URL points at
+the body it last returned along with its ETag and Last-Modified. A cached
+response is served as is for CONGRESS_CACHE_TTL seconds and revalidated with
+a conditional request after that, so an unchanged resource costs a 304.
+
+Set CONGRESS_API_URL to the address of congress_stub.py to run against a
+local stub server instead of api.congress.gov.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlencode
+import httpx
+from dotenv import load_dotenv
+from instrumentation import timed
+
+try:
+    import fcntl
+except ImportError:
+    # no flock on Windows; processes there share the bucket file unlocked
+    fcntl = None
+
+load_dotenv()
+
+API_URL = os.environ.get('CONGRESS_API_URL', 'https://api.congress.gov/v3')
+CACHE_DIR = os.environ.get(
+    'CONGRESS_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'congress_cache'))
+CACHE_TTL = float(os.environ.get('CONGRESS_CACHE_TTL', 6 * 3600))
+
+# requests per second and burst size of the token bucket. Congress.gov allows
+# 5,000 requests an hour; a 1,000 burst plus 4,000 an hour never exceeds it
+# and lets a full senator warm-up go out at once.
+RATE = float(os.environ.get('CONGRESS_RATE', 4000 / 3600))
+BURST = int(os.environ.get('CONGRESS_BURST', 1000))
+# requests (and pooled connections) in flight at once
+CONCURRENCY = int(os.environ.get('CONGRESS_CONCURRENCY', 20))
+
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 30.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+PAGE_LIMIT = 250
+BILLS_PER_MEMBER = 5
+
+STATE_CODES = {
+    'Alabama': 'AL', 'Alaska': 'AK', 'Arizona': 'AZ', 'Arkansas': 'AR', 'California': 'CA',
+    'Colorado': 'CO', 'Connecticut': 'CT', 'Delaware': 'DE', 'Florida': 'FL', 'Georgia': 'GA',
+    'Hawaii': 'HI', 'Idaho': 'ID', 'Illinois': 'IL', 'Indiana': 'IN', 'Iowa': 'IA',
+    'Kansas': 'KS', 'Kentucky': 'KY', 'Louisiana': 'LA', 'Maine': 'ME', 'Maryland': 'MD',
+    'Massachusetts': 'MA', 'Michigan': 'MI', 'Minnesota': 'MN', 'Mississippi': 'MS', 'Missouri': 'MO',
+    'Montana': 'MT', 'Nebraska': 'NE', 'Nevada': 'NV', 'New Hampshire': 'NH', 'New Jersey': 'NJ',
+    'New Mexico': 'NM', 'New York': 'NY', 'North Carolina': 'NC', 'North Dakota': 'ND', 'Ohio': 'OH',
+    'Oklahoma': 'OK', 'Oregon': 'OR', 'Pennsylvania': 'PA', 'Rhode Island': 'RI', 'South Carolina': 'SC',
+    'South Dakota': 'SD', 'Tennessee': 'TN', 'Texas': 'TX', 'Utah': 'UT', 'Vermont': 'VT',
+    'Virginia': 'VA', 'Washington': 'WA', 'West Virginia': 'WV', 'Wisconsin': 'WI', 'Wyoming': 'WY',
+}
+
+def api_key():
+    # the frontend's key from the README works here too
+    return os.environ.get('CONGRESS_API_KEY') or os.environ.get('VITE_CONGRESS_API_KEY')
+
+class CongressAPIError(Exception):
+    def __init__(self, status, path):
+        super().__init__(f"Congress.gov returned {status} for {path}")
+        self.status = status
+        self.path = path
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average and up to `capacity` at
+    once. The bucket is refilled by wall clock and, with a path, its level is
+    kept in that file under an exclusive lock, so every client and process
+    using the same file draws from one bucket.
+    """
+
+    def __init__(self, rate, capacity, path=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.path = path
+        self.tokens = capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Take a token if there is one. Returns 0, or the seconds until there is one."""
+        with self.lock:
+            if self.path is None:
+                return self._take()
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a+') as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    self.tokens, self.updated = (float(value) for value in f.read().split())
+                except ValueError:
+                    # new or unreadable, start full
+                    self.tokens, self.updated = self.capacity, time.time()
+                wait = self._take()
+                f.seek(0)
+                f.truncate()
+                f.write(f'{self.tokens!r} {self.updated!r}')
+                return wait
+
+    def _take(self):
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def shared_bucket(rate, capacity, path):
+    """The process-wide bucket kept in path"""
+    with _buckets_lock:
+        bucket = _buckets.get(path)
+        if bucket is None or (bucket.rate, bucket.capacity) != (rate, capacity):
+            bucket = _buckets[path] = TokenBucket(rate, capacity, path)
+        return bucket
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+class ResponseCache:
+    """
+    On-disk response cache. entries/ maps a request key to the metadata of
+    its last response, bodies/ holds each distinct body once by digest.
+    """
+
+    def __init__(self, directory=CACHE_DIR, ttl=CACHE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+
+    @staticmethod
+    def key(path, params):
+        """Request key; the API key is left out so it does not split the cache"""
+        query = urlencode(sorted((k, str(v)) for k, v in params.items() if k != 'api_key'))
+        return hashlib.sha256(f'{path}?{query}'.encode()).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, 'entries', key[:2], f'{key}.json')
+
+    def body_path(self, digest):
+        return os.path.join(self.directory, 'bodies', digest[:2], digest)
+
+    def get(self, key):
+        """The cached entry with its body under 'body', or None"""
+        try:
+            with open(self.entry_path(key), 'rb') as f:
+                entry = json.load(f)
+            with open(self.body_path(entry['digest']), 'rb') as f:
+                entry['body'] = f.read()
+        except (OSError, ValueError, KeyError):
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry['stored_at'] < self.ttl
+
+    def put(self, key, path, body, headers):
+        digest = hashlib.sha256(body).hexdigest()
+        body_path = self.body_path(digest)
+        if not os.path.exists(body_path):
+            write_atomic(body_path, body)
+        entry = {
+            'path': path,
+            'digest': digest,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'stored_at': time.time(),
+        }
+        write_atomic(self.entry_path(key), json.dumps(entry).encode())
+
+    def touch(self, key, entry):
+        """Mark a revalidated entry fresh again"""
+        entry = {k: v for k, v in entry.items() if k != 'body'}
+        entry['stored_at'] = time.time()
+        write_atomic(self.entry_path(key), json.dumps(entry).encode())
+
+    def prune(self):
+        """Delete bodies no entry points at any more. Returns how many were removed."""
+        referenced = set()
+        for root, _, files in os.walk(os.path.join(self.directory, 'entries')):
+            for name in files:
+                try:
+                    with open(os.path.join(root, name), 'rb') as f:
+                        referenced.add(json.load(f)['digest'])
+                except (OSError, ValueError, KeyError):
+                    continue
+        removed = 0
+        for root, _, files in os.walk(os.path.join(self.directory, 'bodies')):
+            for name in files:
+                if name not in referenced:
+                    os.unlink(os.path.join(root, name))
+                    removed += 1
+        return removed
+
+class CongressClient:
+    """
+    Async Congress.gov client, used as `async with CongressClient() as client`.
+    stats counts requests sent, cache hits, 304 revalidations and retries.
+    """
+
+    def __init__(self, base_url=API_URL, key=None, cache=None, rate=RATE, burst=BURST,
+                 concurrency=CONCURRENCY, max_retries=MAX_RETRIES, timeout=30.0):
+        self.base_url = base_url
+        self.key = key or api_key()
+        self.cache = cache if cache is not None else ResponseCache()
+        # one bucket per cache directory for all clients and pool workers,
+        # a client per call must not get a fresh burst
+        self.bucket = shared_bucket(rate, burst, os.path.join(self.cache.directory, 'rate_limit'))
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.stats = Counter()
+        self.http = None
+
+    async def __aenter__(self):
+        self.http = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={'Accept': 'application/json'},
+            limits=httpx.Limits(max_connections=self.concurrency,
+                                max_keepalive_connections=self.concurrency),
+            timeout=self.timeout,
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.http.aclose()
+
+    async def get(self, path, **params):
+        """Decoded JSON for an API path, from the cache when possible"""
+        params = {k: v for k, v in params.items() if v is not None}
+        params['format'] = 'json'
+        key = self.cache.key(path, params)
+        entry = self.cache.get(key)
+        if entry is not None and self.cache.is_fresh(entry):
+            self.stats['cache_hits'] += 1
+            return json.loads(entry['body'])
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        response = await self.request(path, params, headers)
+        if response.status_code == 304 and entry is not None:
+            self.stats['revalidated'] += 1
+            self.cache.touch(key, entry)
+            return json.loads(entry['body'])
+        self.cache.put(key, path, response.content, response.headers)
+        return response.json()
+
+    async def request(self, path, params, headers):
+        """Send a GET, retrying rate limiting, server errors and dropped connections"""
+        if self.key:
+            params = {**params, 'api_key': self.key}
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            response = None
+            async with self.semaphore:
+                self.stats['requests'] += 1
+                try:
+                    response = await self.http.get(path, params=params, headers=headers)
+                except httpx.TransportError as e:
+                    error = e
+            if response is not None:
+                if response.status_code not in RETRY_STATUSES:
+                    if response.status_code >= 400:
+                        raise CongressAPIError(response.status_code, path)
+                    return response
+                error = CongressAPIError(response.status_code, path)
+            if attempt == self.max_retries:
+                raise error
+            self.stats['retries'] += 1
+            await asyncio.sleep(self.backoff(attempt, response))
+
+    @staticmethod
+    def backoff(attempt, response):
+        """Seconds to wait before retrying; honours Retry-After, otherwise jittered exponential"""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), MAX_BACKOFF_SECONDS)
+        return min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    async def get_all(self, path, item_key, **params):
+        """Every item of a paginated list endpoint"""
+        items = []
+        while True:
+            page = await self.get(path, offset=len(items), limit=PAGE_LIMIT, **params)
+            batch = page.get(item_key, [])
+            items.extend(batch)
+            if not batch or not page.get('pagination', {}).get('next'):
+                return items
+
+    async def member(self, bioguide_id):
+        return (await self.get(f'/member/{bioguide_id}'))['member']
+
+    async def sponsored_legislation(self, bioguide_id, limit=BILLS_PER_MEMBER):
+        page = await self.get(f'/member/{bioguide_id}/sponsored-legislation', limit=limit)
+        return page.get('sponsoredLegislation', [])
+
+    async def bill(self, congress, bill_type, number):
+        return (await self.get(f'/bill/{congress}/{bill_type.lower()}/{number}'))['bill']
+
+    async def current_senators(self):
+        """Current members whose latest term is in the Senate"""
+        members = await self.get_all('/member', 'members', currentMember='true')
+        return [member for member in members if latest_chamber(member) == 'Senate']
+
+def latest_chamber(member):
+    terms = member.get('terms', {}).get('item', [])
+    if not terms:
+        return None
+    return max(terms, key=lambda term: term.get('startYear', 0)).get('chamber')
+
+def summarize_member(member):
+    return {
+        'bioguide_id': member.get('bioguideId'),
+        'name': member.get('directOrderName') or member.get('name'),
+        'state': STATE_CODES.get(member.get('state'), member.get('state')),
+        'party': member.get('partyName') or (member.get('partyHistory') or [{}])[-1].get('partyName'),
+        'photoUrl': (member.get('depiction') or {}).get('imageUrl'),
+    }
+
+def summarize_bill(bill):
+    return {
+        'congress': bill.get('congress'),
+        'type': bill.get('type'),
+        'number': bill.get('number'),
+        'title': bill.get('title'),
+        'introduced': bill.get('introducedDate'),
+        'latest_action': bill.get('latestAction'),
+        'policy_area': (bill.get('policyArea') or {}).get('name'),
+    }
+
+async def member_activity(client, bioguide_id, bills=BILLS_PER_MEMBER):
+    """A member's details and their most recent sponsored bills"""
+    member, sponsored = await asyncio.gather(
+        client.member(bioguide_id), client.sponsored_legislation(bioguide_id, bills))
+    # sponsored amendments have no bill type or number
+    details = await asyncio.gather(*(
+        client.bill(item['congress'], item['type'], item['number'])
+        for item in sponsored if item.get('type') and item.get('number')))
+    activity = summarize_member(member)
+    activity['sponsored_bills'] = [summarize_bill(bill) for bill in details]
+    return activity
+
+async def gather_activity(client, bioguide_ids, bills=BILLS_PER_MEMBER):
+    """member_activity for many members at once; failures come back as {'error': ...}"""
+    results = await asyncio.gather(
+        *(member_activity(client, bioguide_id, bills) for bioguide_id in bioguide_ids),
+        return_exceptions=True)
+    activity = {}
+    for bioguide_id, result in zip(bioguide_ids, results):
+        if isinstance(result, Exception):
+            result = {'bioguide_id': bioguide_id, 'error': str(result)}
+        activity[bioguide_id] = result
+    return activity
+
+async def fetch_senator_activity(state=None, bills=BILLS_PER_MEMBER, client=None):
+    """Activity of every current senator, or those of one state"""
+    if client is None:
+        async with CongressClient() as client:
+            return await fetch_senator_activity(state, bills, client)
+    senators = await client.current_senators()
+    if state:
+        senators = [s for s in senators if STATE_CODES.get(s.get('state')) == state.upper()]
+    activity = await gather_activity(client, [s['bioguideId'] for s in senators], bills)
+    return sorted(activity.values(), key=lambda a: (a.get('state') or '', a.get('name') or ''))
+
+@timed()
+def senator_activity(state=None, bills=BILLS_PER_MEMBER):
+    """Current senators with their recent sponsored bills, for server.js"""
+    return asyncio.run(fetch_senator_activity(state or None, int(bills or BILLS_PER_MEMBER)))
+
+@timed()
+def members_activity(bioguide_ids, bills=BILLS_PER_MEMBER):
+    """Details and recent sponsored bills for a list of bioguide IDs"""
+    async def run():
+        async with CongressClient() as client:
+            return await gather_activity(client, list(bioguide_ids), int(bills or BILLS_PER_MEMBER))
+    return asyncio.run(run())
+
+async def warm(bioguide_ids=None, bills=BILLS_PER_MEMBER):
+    async with CongressClient() as client:
+        started = time.perf_counter()
+        if bioguide_ids:
+            activity = list((await gather_activity(client, bioguide_ids, bills)).values())
+        else:
+            activity = await fetch_senator_activity(bills=bills, client=client)
+        elapsed = time.perf_counter() - started
+    failed = [a for a in activity if 'error' in a]
+    print(f"Fetched {len(activity) - len(failed)} members in {elapsed:.2f}s "
+          f"({client.stats['requests']} requests, {client.stats['cache_hits']} cache hits, "
+          f"{client.stats['revalidated']} revalidated, {client.stats['retries']} retries)")
+    for a in failed:
+        print(f"  {a['bioguide_id']}: {a['error']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Warm the Congress.gov cache for current senators or given members')
+    parser.add_argument('bioguide_ids', nargs='*', help='members to fetch instead of all current senators')
+    parser.add_argument('--bills', type=int, default=BILLS_PER_MEMBER, help='sponsored bills per member')
+    parser.add_argument('--prune', action='store_true', help='remove cached bodies no request refers to')
+    args = parser.parse_args()
+
+    if args.prune:
+        print(f"Removed {ResponseCache().prune()} unreferenced bodies")
+    else:
+        asyncio.run(warm(args.bioguide_ids, args.bills))
@@ -0,0 +1,141 @@
+"""
+Local stand-in for the parts of the Congress.gov API that congress_client
+uses: the member list, member details, sponsored legislation and bills.
+Responses are generated deterministically from the seed, carry an ETag and
+answer If-None-Match with 304. --latency adds a delay to every response and
+--fail-rate answers that share of requests with 503, to exercise the
+client's concurrency and retries.
+
+    python congress_stub.py --port 8765 --latency 50
+    CONGRESS_API_URL=http://127.0.0.1:8765/v3 python congress_client.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from congress_client import STATE_CODES
+
+HOUSE_SEATS = 435
+BILLS_PER_MEMBER = 20
+CONGRESS = 119
+
+def make_members(seed=0):
+    """Two senators per state and the House, keyed by bioguide ID"""
+    rng = random.Random(seed)
+    states = sorted(STATE_CODES)
+    members = {}
+    seats = [('Senate', state) for state in states for _ in range(2)]
+    seats += [('House of Representatives', rng.choice(states)) for _ in range(HOUSE_SEATS)]
+    for number, (chamber, state) in enumerate(seats):
+        bioguide_id = f'S{number:06d}'
+        last, first = f'Member{number:03d}', rng.choice(['Alex', 'Jordan', 'Sam', 'Casey', 'Morgan'])
+        members[bioguide_id] = {
+            'bioguideId': bioguide_id,
+            'name': f'{last}, {first}',
+            'directOrderName': f'{first} {last}',
+            'state': state,
+            'partyName': rng.choice(['Democratic', 'Republican']),
+            'terms': {'item': [{'chamber': chamber, 'startYear': rng.choice([2019, 2021, 2023, 2025])}]},
+            'depiction': {'imageUrl': f'https://example.invalid/{bioguide_id}.jpg'},
+        }
+    return members
+
+def make_bills(bioguide_id):
+    rng = random.Random(bioguide_id)
+    bill_type = 'S' if bioguide_id < f'S{2 * len(STATE_CODES):06d}' else 'HR'
+    return [{
+        'congress': CONGRESS,
+        'type': bill_type,
+        'number': str(int(bioguide_id[1:]) * BILLS_PER_MEMBER + i + 1),
+        'title': f'Test Act {i + 1} of {bioguide_id}',
+        'introducedDate': f'2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+        'latestAction': {'actionDate': '2025-06-01', 'text': 'Referred to committee.'},
+        'policyArea': {'name': rng.choice(['Energy', 'Health', 'Taxation', 'Defense'])},
+        'sponsors': [{'bioguideId': bioguide_id}],
+    } for i in range(BILLS_PER_MEMBER)]
+
+class StubHandler(BaseHTTPRequestHandler):
+    members = {}
+    bills = {}
+    latency = 0.0
+    fail_rate = 0.0
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body = self.route(url.path, query)
+        if body is None:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode()
+        etag = '"%s"' % hashlib.sha256(data).hexdigest()[:16]
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def route(self, path, query):
+        offset, limit = int(query.get('offset', 0)), int(query.get('limit', 20))
+        if path == '/v3/member':
+            members = list(self.members.values())
+            if query.get('currentMember') != 'true':
+                members = []
+            page = members[offset:offset + limit]
+            more = offset + limit < len(members)
+            return {'members': page, 'pagination': {
+                'count': len(members), 'next': f'/v3/member?offset={offset + limit}' if more else None}}
+
+        match = re.fullmatch(r'/v3/member/(\w+)(/sponsored-legislation)?', path)
+        if match and match.group(1) in self.members:
+            if match.group(2):
+                bills = self.bills.setdefault(match.group(1), make_bills(match.group(1)))
+                return {'sponsoredLegislation': bills[offset:offset + limit],
+                        'pagination': {'count': len(bills)}}
+            return {'member': self.members[match.group(1)]}
+
+        match = re.fullmatch(r'/v3/bill/(\d+)/(\w+)/(\d+)', path)
+        if match:
+            number = int(match.group(3))
+            bioguide_id = f'S{(number - 1) // BILLS_PER_MEMBER:06d}'
+            if bioguide_id in self.members:
+                bills = self.bills.setdefault(bioguide_id, make_bills(bioguide_id))
+                return {'bill': bills[(number - 1) % BILLS_PER_MEMBER]}
+        return None
+
+    def log_message(self, *args):
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve a stub of the Congress.gov API')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds added to every response')
+    parser.add_argument('--fail-rate', type=float, default=0, help='share of requests answered with 503')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    StubHandler.members = make_members(args.seed)
+    StubHandler.latency = args.latency / 1000
+    StubHandler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), StubHandler)
+    print(f"Congress.gov stub on http://127.0.0.1:{args.port}/v3")
+    server.serve_forever()
@@ -1,63 +1,104 @@
-import sqlite3
-from collections import defaultdict
-from candidate_functions import search_candidate, get_candidate_name
+import heapq
+from array import array
+from database import get_db_connection
+from industries import get_matcher
+from instrumentation import timed
 
-#VISHNU STUFF
-def get_db_connection():
-    """Get a connection to the SQLite database"""
-    try:
-        return sqlite3.connect('politicaldata.db', timeout=20)
-    except sqlite3.OperationalError as e:
-        print(f"Database error: {e}")
-        raise
-
-def classify_industry(contributor_name):
+# spellings of the same contributor are added up under the canonical name,
+# see entity_resolution. Industries are classified once at ingest time,
+# contributors loaded since the last refresh fall back to the classifier
+CONTRIBUTOR_TOTALS_SQL = '''
+    SELECT kd.contributor_name, f.entity_type, SUM(f.amount), ci.industry
+    FROM candidate_dim cd
+    JOIN contribution_facts f ON f.candidate_key = cd.candidate_key
+    LEFT JOIN contributor_entities e ON e.contributor_key = f.contributor_key
+    JOIN contributor_dim kd ON kd.contributor_key = COALESCE(e.entity_key, f.contributor_key)
+    LEFT JOIN contributor_industry ci ON ci.contributor_name = kd.contributor_name
+    WHERE cd.candidate_id = ? {entity_filter}
+    GROUP BY kd.contributor_key
+'''
+
+class IndustryTotals:
+    """Amounts per industry, with the industry names interned to array indexes"""
+    __slots__ = ('index', 'industries', 'amounts')
+
+    def __init__(self):
+        self.index = {}
+        self.industries = []
+        self.amounts = array('d')
+
+    def add(self, industry, amount):
+        code = self.index.get(industry)
+        if code is None:
+            code = self.index[industry] = len(self.industries)
+            self.industries.append(industry)
+            self.amounts.append(0.0)
+        self.amounts[code] += amount
+
+    def items(self):
+        """(industry, amount) pairs, largest first"""
+        return sorted(zip(self.industries, self.amounts), key=lambda item: item[1], reverse=True)
+
+def iter_contributions_by_candidate(candidate_id, include_individuals=True, conn=None):
     """
-    Classify a contributor into an industry based on their name.
-    This is a simple example - you might want to use a more comprehensive mapping.
+    Stream a candidate's contributors as (contributor_name, entity_type,
+    amount, industry), one row per contributor with the amounts summed in
+    SQL, so nothing is held per contributor
     """
-    contributor_name = contributor_name.lower()
-    
-    industry_keywords = {
-        'defense': ['defense', 'military', 'army', 'navy', 'lockheed', 'marine', 'force'],
-        'tech': ['google', 'facebook', 'meta', 'digital', 'technologies', 'software'],
-        'media': ['media', 'advertising', 'marketing', 'communications', 'strategies'],
-        'finance': ['fund', 'financial', 'capital', 'invest', 'strat', 'market', 'busi'],
-        'printing': ['print', 'imaging', 'graphics', 'press'],
-        'politics': ['pac', 'congress', 'senate', 'house', 'elect', 'committee', 'campaign', 'politi', 'president', 'civi', 'friends']
+    if conn is None:
+        conn = get_db_connection()
+    classify = get_matcher().classify
+    entity_filter = '' if include_individuals else "AND f.entity_type != 'IND'"
+    c = conn.cursor()
+    c.execute(CONTRIBUTOR_TOTALS_SQL.format(entity_filter=entity_filter), (candidate_id,))
+    for contributor_name, entity_type, amount, industry in c:
+        yield contributor_name, entity_type, amount, industry or classify(contributor_name)
+
+#VISHNU STUFF
+@timed()
+def get_contributions_by_candidate(candidate_id, conn=None):
+    """Get all contributions for a candidate from the database"""
+    return {
+        contributor_name: {'amount': amount, 'entity_tp': entity_type, 'industry': industry}
+        for contributor_name, entity_type, amount, industry in iter_contributions_by_candidate(candidate_id, conn=conn)
     }
-    
-    for industry, keywords in industry_keywords.items():
-        if any(keyword in contributor_name for keyword in keywords):
-            return industry
 
-    return 'other'
+@timed()
+def top_contributors_by_candidate(candidate_id, n=10, conn=None):
+    """
+    The n largest non-individual contributors to a candidate as
+    (contributor_name, amount, industry), largest first. Only n rows are
+    kept while the rows stream by.
+    """
+    rows = iter_contributions_by_candidate(candidate_id, include_individuals=False, conn=conn)
+    return [(contributor_name, amount, industry) for contributor_name, _, amount, industry in
+            heapq.nlargest(int(n), rows, key=lambda row: row[2])]
 
-def get_contributions_by_candidate(candidate_id):
-    """Get all contributions for a candidate from the database"""
-    conn = get_db_connection()
-    try:
-        c = conn.cursor()
-        c.execute('''
-            SELECT contributor_name, entity_type, amount, year
-            FROM contributorsFromCommittees
-            WHERE candidate_id = ?
-        ''', (candidate_id,))
-        
-        contributions = defaultdict(lambda: {
-            'amount': 0.0,
-            'entity_tp': None,
-            'industry': None
-        })
-        
-        for contributor_name, entity_type, amount, year in c.fetchall():
-            contributions[contributor_name]['amount'] += amount
-            contributions[contributor_name]['entity_tp'] = entity_type
-            contributions[contributor_name]['industry'] = classify_industry(contributor_name)
-            
-        return contributions
-    finally:
-        conn.close()
+@timed()
+def industry_totals_by_candidate(candidate_id, conn=None):
+    """
+    A candidate's non-individual money per industry as (industry, amount),
+    largest first. Classified contributors are summed per industry in SQL;
+    only the ones the ingest has not classified yet come back one by one.
+    """
+    if conn is None:
+        conn = get_db_connection()
+    totals = IndustryTotals()
+    classify = get_matcher().classify
+    c = conn.cursor()
+    c.execute('''
+        SELECT ci.industry, CASE WHEN ci.industry IS NULL THEN kd.contributor_name END, SUM(f.amount)
+        FROM candidate_dim cd
+        JOIN contribution_facts f ON f.candidate_key = cd.candidate_key
+        LEFT JOIN contributor_entities e ON e.contributor_key = f.contributor_key
+        JOIN contributor_dim kd ON kd.contributor_key = COALESCE(e.entity_key, f.contributor_key)
+        LEFT JOIN contributor_industry ci ON ci.contributor_name = kd.contributor_name
+        WHERE cd.candidate_id = ? AND f.entity_type != 'IND'
+        GROUP BY 1, 2
+    ''', (candidate_id,))
+    for industry, unclassified_name, amount in c:
+        totals.add(industry or classify(unclassified_name), amount)
+    return totals.items()
 
 def query_contributors(candidate_id):
     """Query and display contributors for a specific candidate"""
@@ -65,16 +106,15 @@ def query_contributors(candidate_id):
         print("No candidate ID provided")
         return
     
-    contributions = get_contributions_by_candidate(candidate_id)
-    if not contributions:
+    found = False
+    for contributor, _, amount, _ in iter_contributions_by_candidate(candidate_id, include_individuals=False):
+        if not found:
+            print(f"\nContributions to Candidate ID {candidate_id}:\n")
+            found = True
+        print(f"{contributor}: ${amount:,.2f}")
+
+    if not found:
         print(f"No contributions found for candidate ID {candidate_id}")
-        return
-    
-    print(f"\nContributions to Candidate ID {candidate_id}:\n")
-    for contributor, info in contributions.items():
-        if info['entity_tp'] == 'IND':  # Skip individual contributors
-            continue
-        print(f"{contributor}: ${info['amount']:,.2f}")
 
 def query_contributors_by_industry(candidate_id):
     """Group and display contributions by industry"""
@@ -82,20 +122,13 @@ def query_contributors_by_industry(candidate_id):
         print("No candidate ID provided")
         return
     
-    contributions = get_contributions_by_candidate(candidate_id)
-    if not contributions:
+    industry_totals = industry_totals_by_candidate(candidate_id)
+    if not industry_totals:
         print(f"No contributions found for candidate ID {candidate_id}")
         return
     
-    industry_totals = defaultdict(float)
-    for contributor, info in contributions.items():
-        if info['entity_tp'] == 'IND':  # Skip individual contributors
-            continue
-        industry = info['industry']
-        industry_totals[industry] += info['amount']
-    
     print(f"\nIndustry Breakdown for Candidate ID {candidate_id}:")
-    for industry, total in sorted(industry_totals.items(), key=lambda x: x[1], reverse=True):
+    for industry, total in industry_totals:
         print(f"{industry.replace('_', ' ').title()}: ${total:,.2f}")
 
 if __name__ == "__main__":
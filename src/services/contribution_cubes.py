@@ -0,0 +1,330 @@
+"""
+Time-bucketed contribution totals built from TRANSACTION_DT.
+
+Two industry cubes hold the money non-individual contributors gave each
+candidate, per cycle year:
+
+    industry_day_totals    (industry, day, candidate_key, year)
+    industry_month_totals  (industry, month, candidate_key, year)
+
+Incrementally applied transactions update both cubes directly. A bulk load
+queues its cycle years instead, and refresh_contribution_cubes rebuilds
+them from contribution_ledger once the new contributors are classified. The
+cubes are rebuilt completely when the industry taxonomy changes.
+
+A date range query reads the whole months of the range from the month cube
+and the partial months at either end from the day cube, each with an index
+range scan, so contribution_ledger is never read at query time.
+"""
+import argparse
+import sqlite3
+import time
+from datetime import date, timedelta
+from database import get_db_connection
+from industries import get_matcher, get_taxonomy, taxonomy_version
+from ingest_state import get_state, set_state
+from instrumentation import timed
+
+# ingest_state key listing the cycle years waiting for a cube rebuild
+PENDING_YEARS_KEY = 'cube_pending_years'
+
+def create_cube_tables(conn):
+    """Create the day and month industry cubes"""
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS industry_day_totals (
+            industry TEXT NOT NULL,
+            day TEXT NOT NULL,
+            candidate_key INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            transactions INTEGER NOT NULL,
+            PRIMARY KEY (industry, day, candidate_key, year)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_industry_day_totals_candidate
+        ON industry_day_totals(candidate_key, day)
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS industry_month_totals (
+            industry TEXT NOT NULL,
+            month TEXT NOT NULL,
+            candidate_key INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            transactions INTEGER NOT NULL,
+            PRIMARY KEY (industry, month, candidate_key, year)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_industry_month_totals_candidate
+        ON industry_month_totals(candidate_key, month)
+    ''')
+
+def drop_cube_tables(conn):
+    for table in ('industry_day_totals', 'industry_month_totals'):
+        conn.execute(f'DROP TABLE IF EXISTS {table}')
+
+def pending_years(conn):
+    value = get_state(conn, PENDING_YEARS_KEY, '')
+    return sorted({int(year) for year in value.split(',') if year})
+
+def queue_cube_years(conn, years):
+    """Mark cycle years whose ledger rows were replaced. Does not commit."""
+    set_state(conn, PENDING_YEARS_KEY, ','.join(str(year) for year in sorted(set(pending_years(conn)) | set(years))))
+
+def contributor_industry(c, contributor_name):
+    c.execute('SELECT industry FROM contributor_industry WHERE contributor_name = ?', (contributor_name,))
+    row = c.fetchone()
+    # contributors new in this ingest are classified after it, the same way
+    return row[0] if row else get_matcher().classify(contributor_name)
+
+def add_to_cubes(c, year, day, candidate_id, contributor_name, entity_type, amount, transactions):
+    """
+    Add one transaction to the cubes, or back one out with a negative amount
+    and count. Individuals and undated records are skipped. The candidate
+    must already be in candidate_dim. Does not commit.
+    """
+    if day is None or entity_type == 'IND':
+        return
+    industry = contributor_industry(c, contributor_name)
+    c.execute('SELECT candidate_key FROM candidate_dim WHERE candidate_id = ?', (candidate_id,))
+    candidate_key = c.fetchone()[0]
+    for table, bucket, value in (('industry_day_totals', 'day', day),
+                                 ('industry_month_totals', 'month', day[:7])):
+        key = (industry, value, candidate_key, year)
+        c.execute(f'''
+            INSERT INTO {table} (industry, {bucket}, candidate_key, year, amount, transactions)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (industry, {bucket}, candidate_key, year) DO UPDATE SET
+                amount = amount + excluded.amount,
+                transactions = transactions + excluded.transactions
+        ''', (*key, amount, transactions))
+        if transactions < 0:
+            # drop the row once every transaction in it was backed out
+            c.execute(f'''
+                DELETE FROM {table}
+                WHERE industry = ? AND {bucket} = ? AND candidate_key = ? AND year = ? AND transactions <= 0
+            ''', key)
+
+def rebuild_cubes(conn, years=None):
+    """Rebuild the cubes from contribution_ledger, completely or for some cycle years. Does not commit."""
+    c = conn.cursor()
+    params = ()
+    year_filter = ''
+    if years is not None:
+        params = tuple(years)
+        placeholders = ', '.join('?' for _ in years)
+        year_filter = f'AND year IN ({placeholders})'
+        c.execute(f'DELETE FROM industry_day_totals WHERE year IN ({placeholders})', params)
+        c.execute(f'DELETE FROM industry_month_totals WHERE year IN ({placeholders})', params)
+    else:
+        c.execute('DELETE FROM industry_day_totals')
+        c.execute('DELETE FROM industry_month_totals')
+
+    c.execute(f'''
+        INSERT INTO industry_day_totals (industry, day, candidate_key, year, amount, transactions)
+        SELECT ci.industry, l.transaction_date, cd.candidate_key, l.year, SUM(l.amount), COUNT(*)
+        FROM contribution_ledger l
+        JOIN contributor_industry ci ON ci.contributor_name = l.contributor_name
+        JOIN candidate_dim cd ON cd.candidate_id = l.candidate_id
+        WHERE l.entity_type != 'IND' AND l.transaction_date IS NOT NULL {year_filter}
+        GROUP BY ci.industry, l.transaction_date, cd.candidate_key, l.year
+    ''', params)
+    c.execute(f'''
+        INSERT INTO industry_month_totals (industry, month, candidate_key, year, amount, transactions)
+        SELECT industry, substr(day, 1, 7), candidate_key, year, SUM(amount), SUM(transactions)
+        FROM industry_day_totals
+        WHERE true {year_filter}
+        GROUP BY industry, substr(day, 1, 7), candidate_key, year
+    ''', params)
+
+@timed()
+def refresh_contribution_cubes(conn, taxonomy=None):
+    """
+    Rebuild the cube years queued by bulk loads, or everything when the
+    taxonomy changed since the last refresh. Run after
+    refresh_contributor_industries, since the cubes follow contributor_industry.
+    """
+    if taxonomy is None:
+        taxonomy = get_taxonomy()
+    try:
+        create_cube_tables(conn)
+        version = taxonomy_version(taxonomy)
+        if get_state(conn, 'cube_taxonomy_version') != version:
+            rebuild_cubes(conn)
+        else:
+            years = pending_years(conn)
+            if not years:
+                return
+            rebuild_cubes(conn, years)
+        set_state(conn, PENDING_YEARS_KEY, '')
+        set_state(conn, 'cube_taxonomy_version', version)
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        conn.rollback()
+        raise
+
+def parse_day(value):
+    """A date or 'YYYY-MM-DD' string as a date, raising ValueError otherwise"""
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f"Invalid date: {value!r}, expected YYYY-MM-DD") from None
+
+def split_range(start, end):
+    """
+    Split the inclusive range start..end into the whole months it covers, as
+    a ('YYYY-MM', 'YYYY-MM') pair or None, and the (first, last) day ranges
+    left over at either end.
+    """
+    first_full = start if start.day == 1 else (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    next_day = end + timedelta(days=1)
+    last_full = end if next_day.day == 1 else end.replace(day=1) - timedelta(days=1)
+    if first_full > last_full:
+        return None, [(start, end)]
+
+    edges = []
+    if start < first_full:
+        edges.append((start, first_full - timedelta(days=1)))
+    if last_full < end:
+        edges.append((last_full + timedelta(days=1), end))
+    return (first_full.strftime('%Y-%m'), last_full.strftime('%Y-%m')), edges
+
+def range_parts(key_column, key, start, end):
+    """UNION ALL branches and parameters reading start..end from the month and day cubes"""
+    months, edges = split_range(start, end)
+    parts = []
+    params = []
+    if months:
+        parts.append(f'''
+            SELECT industry, candidate_key, amount, transactions FROM industry_month_totals
+            WHERE {key_column} = ? AND month BETWEEN ? AND ?
+        ''')
+        params += [key, *months]
+    for first, last in edges:
+        parts.append(f'''
+            SELECT industry, candidate_key, amount, transactions FROM industry_day_totals
+            WHERE {key_column} = ? AND day BETWEEN ? AND ?
+        ''')
+        params += [key, first.isoformat(), last.isoformat()]
+    return ' UNION ALL '.join(parts), params
+
+@timed()
+def industry_totals_between(industry, start, end, office=None, limit=20, conn=None):
+    """
+    Candidates ranked by the money they received from an industry between
+    two dates (inclusive), optionally only for one office ('S', 'H' or 'P').
+    """
+    if conn is None:
+        conn = get_db_connection()
+    start, end = parse_day(start), parse_day(end)
+    if start > end:
+        return []
+    union, params = range_parts('industry', industry, start, end)
+    office_filter = ''
+    if office:
+        office_filter = 'WHERE cd.candidate_id LIKE ?'
+        params.append(f'{office}%')
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT cd.candidate_id, SUM(p.amount) AS total_amount, SUM(p.transactions)
+        FROM ({union}) p
+        JOIN candidate_dim cd ON cd.candidate_key = p.candidate_key
+        {office_filter}
+        GROUP BY p.candidate_key
+        ORDER BY total_amount DESC
+        LIMIT ?
+    ''', (*params, int(limit or 20)))
+    return [{'candidate_id': candidate_id, 'total_amount': amount, 'transactions': transactions}
+            for candidate_id, amount, transactions in c.fetchall()]
+
+@timed()
+def industry_money_before(industry, before, days=90, office=None, limit=20, conn=None):
+    """Industry money per candidate in the days before a date, e.g. a vote"""
+    before = parse_day(before)
+    days = int(days or 90)
+    return industry_totals_between(industry, before - timedelta(days=days), before - timedelta(days=1),
+                                   office, limit, conn)
+
+@timed()
+def candidate_industries_between(candidate_id, start, end, conn=None):
+    """A candidate's money per industry between two dates (inclusive), largest first"""
+    if conn is None:
+        conn = get_db_connection()
+    start, end = parse_day(start), parse_day(end)
+    c = conn.cursor()
+    c.execute('SELECT candidate_key FROM candidate_dim WHERE candidate_id = ?', (candidate_id,))
+    row = c.fetchone()
+    if row is None or start > end:
+        return []
+    union, params = range_parts('candidate_key', row[0], start, end)
+    c.execute(f'''
+        SELECT industry, SUM(amount) AS total_amount, SUM(transactions)
+        FROM ({union})
+        GROUP BY industry
+        ORDER BY total_amount DESC
+    ''', params)
+    return [{'industry': industry, 'total_amount': amount, 'transactions': transactions}
+            for industry, amount, transactions in c.fetchall()]
+
+@timed()
+def industry_trend(industry, start, end, period='month', candidate_id=None, conn=None):
+    """
+    Monthly or quarterly totals of an industry's money over the months
+    touched by start..end, for all candidates or one.
+    """
+    if conn is None:
+        conn = get_db_connection()
+    start, end = parse_day(start), parse_day(end)
+    if period == 'quarter':
+        bucket = "substr(month, 1, 4) || '-Q' || ((CAST(substr(month, 6, 2) AS INTEGER) + 2) / 3)"
+    elif period == 'month':
+        bucket = 'month'
+    else:
+        raise ValueError(f"Invalid period: {period!r}, expected 'month' or 'quarter'")
+
+    params = [industry, start.strftime('%Y-%m'), end.strftime('%Y-%m')]
+    candidate_filter = ''
+    if candidate_id:
+        candidate_filter = 'AND candidate_key = (SELECT candidate_key FROM candidate_dim WHERE candidate_id = ?)'
+        params.append(candidate_id)
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT {bucket} AS period, SUM(amount), SUM(transactions)
+        FROM industry_month_totals
+        WHERE industry = ? AND month BETWEEN ? AND ? {candidate_filter}
+        GROUP BY period
+        ORDER BY period
+    ''', params)
+    return [{'period': bucket_name, 'total_amount': amount, 'transactions': transactions}
+            for bucket_name, amount, transactions in c.fetchall()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Industry money per candidate in a date range, from the cubes')
+    parser.add_argument('industry', nargs='?', default='Military & Defense')
+    parser.add_argument('--before', help='date of a vote, YYYY-MM-DD; reports the --days before it')
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--start')
+    parser.add_argument('--end')
+    parser.add_argument('--office', default='S', help="'S', 'H', 'P' or '' for all")
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.before:
+        rows = industry_money_before(args.industry, args.before, args.days, args.office or None, args.limit)
+        label = f"in the {args.days} days before {args.before}"
+    else:
+        end = args.end or date.today().isoformat()
+        start = args.start or (parse_day(end) - timedelta(days=args.days)).isoformat()
+        rows = industry_totals_between(args.industry, start, end, args.office or None, args.limit)
+        label = f"from {start} to {end}"
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"{args.industry} money {label} ({elapsed:.2f}ms):")
+    for row in rows:
+        print(f"  {row['candidate_id']}: ${row['total_amount']:,.2f} ({row['transactions']:,} transactions)")
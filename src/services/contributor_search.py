@@ -0,0 +1,237 @@
+"""
+Full-text search over contributor names.
+
+contributor_name_index is an FTS5 index over contributor_dim, which holds
+every distinct contributor name once. It is an external content table
+keyed by contributor_key, so it costs only the index and not a second copy
+of the names. Since contributor_dim only grows between rebuilds, ingest
+just indexes the keys added since the last refresh. contributor_totals
+keeps each contributor's non-individual money and number of candidates,
+so results can be ranked by money without touching the facts.
+
+Queries take plain words, "quoted phrases" and word* prefixes, e.g.
+    lockheed "united technologies" pharma*
+and every part has to match.
+"""
+import argparse
+import base64
+import json
+import re
+import sqlite3
+import time
+from collections import namedtuple
+from database import get_db_connection
+from ingest_state import get_generation, get_state, set_state
+from instrumentation import timed
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# ingest_state keys: the highest contributor_key in the index, and the
+# generation contributor_totals was built for
+INDEXED_KEY = 'contributor_index_max_key'
+TOTALS_GENERATION_KEY = 'contributor_totals_generation'
+
+ORDERS = {
+    'rank': 'rank, t.total_amount DESC',
+    'amount': 't.total_amount DESC, rank',
+}
+
+SearchRecord = namedtuple('SearchRecord', ['contributor_name', 'total_amount', 'candidate_count', 'score'])
+
+# next_cursor is None on the last page
+SearchPage = namedtuple('SearchPage', ['records', 'next_cursor'])
+
+QUERY_PART = re.compile(r'"([^"]*)"|(\S+)')
+WORD = re.compile(r'\w+')
+
+def create_search_tables(conn):
+    """Create the contributor name index and per-contributor totals"""
+    c = conn.cursor()
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS contributor_name_index USING fts5(
+            contributor_name,
+            content = 'contributor_dim',
+            content_rowid = 'contributor_key',
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS contributor_totals (
+            contributor_key INTEGER PRIMARY KEY,
+            total_amount REAL NOT NULL,
+            candidate_count INTEGER NOT NULL
+        )
+    ''')
+
+def drop_search_tables(conn):
+    conn.execute('DROP TABLE IF EXISTS contributor_name_index')
+    conn.execute('DROP TABLE IF EXISTS contributor_totals')
+
+@timed()
+def refresh_contributor_search(conn):
+    """
+    Index the contributor names added since the last refresh and rebuild
+    contributor_totals if new data was loaded. Needs a writable connection;
+    commits.
+    """
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM sqlite_master WHERE name = 'contributor_name_index'")
+    # the ingest_state entries are stale when the tables were dropped
+    fresh = c.fetchone() is None
+    create_search_tables(conn)
+    indexed = 0 if fresh else int(get_state(conn, INDEXED_KEY, 0))
+    newest = c.execute('SELECT COALESCE(MAX(contributor_key), 0) FROM contributor_dim').fetchone()[0]
+    if newest < indexed:
+        # contributor_dim was rebuilt, so the keys no longer line up
+        c.execute("INSERT INTO contributor_name_index (contributor_name_index) VALUES ('rebuild')")
+        added = newest
+    else:
+        c.execute('''
+            INSERT INTO contributor_name_index (rowid, contributor_name)
+            SELECT contributor_key, contributor_name FROM contributor_dim WHERE contributor_key > ?
+        ''', (indexed,))
+        added = c.rowcount
+    set_state(conn, INDEXED_KEY, newest)
+
+    generation = get_generation(conn)
+    if fresh or get_state(conn, TOTALS_GENERATION_KEY) != str(generation):
+        c.execute('DELETE FROM contributor_totals')
+        c.execute('''
+            INSERT INTO contributor_totals (contributor_key, total_amount, candidate_count)
+            SELECT contributor_key, SUM(amount), COUNT(DISTINCT candidate_key)
+            FROM contribution_facts
+            WHERE entity_type != 'IND'
+            GROUP BY contributor_key
+        ''')
+        set_state(conn, TOTALS_GENERATION_KEY, generation)
+    conn.commit()
+    if added:
+        print(f"Indexed {added:,} contributor names")
+    return added
+
+def match_query(text, prefix=False):
+    """
+    Turn a search string into an FTS5 MATCH expression. Words are quoted so
+    user input can never be read as FTS5 syntax. With prefix every word is a
+    prefix, which comes closest to the old LIKE '%keyword%'. Returns None if
+    there is nothing to search for.
+    """
+    terms = []
+    for phrase, word in QUERY_PART.findall(text or ''):
+        if phrase:
+            tokens = WORD.findall(phrase)
+            if tokens:
+                terms.append('"' + ' '.join(tokens) + '"')
+            continue
+        tokens = WORD.findall(word)
+        star = prefix or word.endswith('*')
+        for i, token in enumerate(tokens):
+            # only the last token of word* is a prefix, "s&p*" -> s AND p*
+            terms.append(f'"{token}"*' if star and (prefix or i == len(tokens) - 1) else f'"{token}"')
+    return ' AND '.join(terms) or None
+
+def encode_cursor(offset):
+    return base64.urlsafe_b64encode(json.dumps(offset).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        offset = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return offset
+
+@timed()
+def search_contributors(query, cursor=None, limit=PAGE_SIZE, order='rank', prefix=False, conn=None):
+    """
+    One page of contributors whose names match query, as a SearchPage of
+    SearchRecords. order is 'rank' (best bm25 match first) or 'amount'
+    (most money first). Pass the previous page's next_cursor to continue.
+    """
+    if conn is None:
+        conn = get_db_connection()
+    if order not in ORDERS:
+        raise ValueError(f"Invalid order: {order!r}, expected one of {sorted(ORDERS)}")
+    limit = max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+    offset = decode_cursor(cursor) if cursor else 0
+    match = match_query(query, prefix)
+    if match is None:
+        return SearchPage([], None)
+
+    c = conn.cursor()
+    # one extra row tells us whether there is another page
+    c.execute(f'''
+        SELECT i.contributor_name, COALESCE(t.total_amount, 0), COALESCE(t.candidate_count, 0), i.rank
+        FROM contributor_name_index i
+        LEFT JOIN contributor_totals t ON t.contributor_key = i.rowid
+        WHERE contributor_name_index MATCH ?
+        ORDER BY {ORDERS[order]}, i.rowid
+        LIMIT ? OFFSET ?
+    ''', (match, limit + 1, offset))
+    records = [SearchRecord(name, amount, count, round(-rank, 4)) for name, amount, count, rank in c.fetchall()]
+    next_cursor = None
+    if len(records) > limit:
+        records = records[:limit]
+        next_cursor = encode_cursor(offset + limit)
+    return SearchPage(records, next_cursor)
+
+@timed()
+def keyword_candidate_totals(keyword, limit=20, conn=None):
+    """
+    Candidates ranked by the money from contributors whose names match
+    keyword (every word a prefix), with each candidate's largest matching
+    contributor, as dicts with candidate_id, total and top_contributor.
+    """
+    if conn is None:
+        conn = get_db_connection()
+    match = match_query(keyword, prefix=True)
+    if match is None:
+        return []
+    c = conn.cursor()
+    c.execute('''
+        WITH matched AS (
+            SELECT rowid AS contributor_key FROM contributor_name_index WHERE contributor_name_index MATCH ?
+        ), per_contributor AS (
+            SELECT f.candidate_key, f.contributor_key, SUM(f.amount) AS amount
+            FROM matched m
+            JOIN contribution_facts f ON f.contributor_key = m.contributor_key
+            WHERE f.entity_type != 'IND'
+            GROUP BY f.candidate_key, f.contributor_key
+        ), ranked AS (
+            SELECT candidate_key, contributor_key, amount,
+                   ROW_NUMBER() OVER (PARTITION BY candidate_key ORDER BY amount DESC) AS position,
+                   SUM(amount) OVER (PARTITION BY candidate_key) AS total
+            FROM per_contributor
+        )
+        SELECT cd.candidate_id, r.total, kd.contributor_name
+        FROM ranked r
+        JOIN candidate_dim cd ON cd.candidate_key = r.candidate_key
+        JOIN contributor_dim kd ON kd.contributor_key = r.contributor_key
+        WHERE r.position = 1
+        ORDER BY r.total DESC
+        LIMIT ?
+    ''', (match, int(limit)))
+    return [{'candidate_id': candidate_id, 'total': total, 'top_contributor': top_contributor}
+            for candidate_id, total, top_contributor in c.fetchall()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Search contributor names')
+    parser.add_argument('query', nargs='?', default='lockheed')
+    parser.add_argument('--order', choices=sorted(ORDERS), default='rank')
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--prefix', action='store_true', help='treat every word as a prefix')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    try:
+        page = search_contributors(args.query, limit=args.limit, order=args.order, prefix=args.prefix)
+    except sqlite3.OperationalError as e:
+        raise SystemExit(f"Search failed ({e}); run initialize_db.py to build the index")
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"{args.query!r} ({elapsed:.2f}ms):")
+    for record in page.records:
+        print(f"  {record.contributor_name}: ${record.total_amount:,.2f} to {record.candidate_count} "
+              f"candidate(s), score {record.score}")
@@ -0,0 +1,132 @@
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from instrumentation import connection_factory
+
+SERVICES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# resolved against this file instead of the working directory. DB_PATH is
+# the read snapshot the services and server.js query; ingest writes to
+# WRITER_DB_PATH and publishes the snapshot from it (see snapshot.py)
+DB_PATH = os.environ.get('POLITICALDATA_DB', os.path.join(SERVICES_DIR, 'politicaldata.db'))
+WRITER_DB_PATH = os.environ.get('POLITICALDATA_WRITER_DB', '{0}-writer{1}'.format(*os.path.splitext(DB_PATH)))
+
+# how often cached state (the shared connection, caches and in-memory
+# indexes) is checked against the published snapshot, see VersionCheck
+SNAPSHOT_CHECK_SECONDS = 1.0
+
+# prepared statements kept per connection by the sqlite3 module
+STATEMENT_CACHE_SIZE = 256
+
+READ_PRAGMAS = {
+    'mmap_size': 1024 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+WRITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64 * 1024,
+}
+
+_local = threading.local()
+
+def connect(path=None, readonly=True, timeout=20, immutable=False):
+    """
+    Open a new connection to the database, by default the snapshot for
+    readers and the writer database for writers. Read-only connections are
+    opened with mode=ro so they can never take a write lock, and with
+    immutable they skip locking altogether, which is only safe for a
+    published snapshot. With instrumentation enabled the connection records
+    per-statement timings.
+    """
+    path = path or (DB_PATH if readonly else WRITER_DB_PATH)
+    factory = connection_factory()
+    try:
+        if readonly:
+            flags = '&immutable=1' if immutable else ''
+            # as a file: URI with the path percent-encoded, so ?, # and %
+            # in it are not read as URI syntax
+            uri = pathlib.Path(path).absolute().as_uri()
+            conn = sqlite3.connect(f'{uri}?mode=ro{flags}', uri=True, timeout=timeout, factory=factory,
+                                   cached_statements=STATEMENT_CACHE_SIZE)
+            pragmas = READ_PRAGMAS
+        else:
+            conn = sqlite3.connect(path, timeout=timeout, factory=factory,
+                                   cached_statements=STATEMENT_CACHE_SIZE)
+            pragmas = WRITE_PRAGMAS
+        for name, value in pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+    except sqlite3.OperationalError as e:
+        print(f"Database error: {e}")
+        raise
+
+def snapshot_id(path):
+    """Identity of the file at path, which changes when a snapshot is renamed over it"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+class VersionCheck:
+    """
+    Tells a process-local cache when to reload. changed() reads the version
+    of what was cached with read_version at most once per interval and
+    returns True on the first call and whenever the version differs from the
+    one seen before. Callers serialize their own calls.
+    """
+
+    def __init__(self, read_version, interval=SNAPSHOT_CHECK_SECONDS):
+        self.read_version = read_version
+        self.interval = interval
+        self.version = None
+        self.checked = None
+
+    def changed(self, *args):
+        now = time.monotonic()
+        if self.checked is not None and now - self.checked < self.interval:
+            return False
+        first = self.checked is None
+        self.checked = now
+        version = self.read_version(*args)
+        if not first and version == self.version:
+            return False
+        self.version = version
+        return True
+
+def get_db_connection():
+    """
+    Get the calling thread's shared read-only connection to the snapshot,
+    opening it on first use and again after a new snapshot was published.
+    The connection to the old snapshot is closed then, which releases the
+    replaced file, so callers must not close it nor keep cursors on it
+    across calls into the services.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        _local.snapshot = VersionCheck(lambda: snapshot_id(DB_PATH))
+    if _local.snapshot.changed() or conn is None:
+        if conn is not None:
+            conn.close()
+        conn = _local.conn = connect(immutable=True)
+    return conn
+
+def current_snapshot():
+    """
+    Identity of the snapshot the calling thread's shared connection reads,
+    for keying in-process caches so they are not reused after a publish
+    """
+    get_db_connection()
+    return _local.snapshot.version
+
+def close_db_connection():
+    """Close the calling thread's shared connection, if it has one"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        conn.close()
@@ -0,0 +1,428 @@
+"""
+Collapsing contributor name variants into entities.
+
+The same committee turns up under many spellings, e.g. "LOCKHEED MARTIN
+CORP PAC", "Lockheed Martin Corporation Political Action Committee" and
+"LOCKHEED-MARTIN CORP.". contributor_entities maps every contributor_key to
+the entity_key of its group, which is the contributor_key of the group's
+canonical name, so aggregates can GROUP BY entity_key and look the name up
+in contributor_dim.
+
+Names are normalized (case, punctuation, abbreviations and legal suffixes)
+and then blocked, so only names sharing a bucket are ever compared:
+
+  - one bucket per normalized name, so exact variants always meet
+  - MinHash over the character trigrams, cut into bands of rows, so names
+    with similar trigram sets share a band bucket with high probability
+
+Names in a bucket are merged if their normalized forms are equal, or they
+are long enough, carry the same numbers and their trigram Jaccard
+similarity is at least JACCARD_THRESHOLD. Merges go through a union-find.
+
+The bucket codes of every name are stored with its entity, so a refresh
+only normalizes the names added since the last one and compares them with
+the names they share a bucket with. Existing entities keep their keys; a new
+group picks the name with the most money as canonical.
+
+    python entity_resolution.py [--rebuild] [--top 20]
+"""
+import argparse
+import hashlib
+import json
+import re
+import sqlite3
+import zlib
+from functools import lru_cache
+from itertools import groupby
+import numpy as np
+from database import connect, get_db_connection
+from instrumentation import timed
+
+BATCH_SIZE = 10000
+
+# MinHash signature layout: BANDS bands of ROWS_PER_BAND hashes. Names with
+# trigram Jaccard similarity 0.8 share a band with probability ~0.96
+BANDS = 6
+ROWS_PER_BAND = 4
+
+# the low bits of a bucket code hold the band, EXACT_BAND is the bucket of
+# the normalized name itself
+BAND_BITS = 3
+EXACT_BAND = 7
+
+JACCARD_THRESHOLD = 0.8
+
+# shorter names are only merged when they normalize to the same string
+MIN_FUZZY_LENGTH = 8
+
+# larger buckets are only compared against their first name instead of
+# pairwise, which keeps a bucket of thousands of variants linear
+MAX_BUCKET_PAIRS = 64
+
+PRIME = np.uint64((1 << 31) - 1)
+MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_seeds = np.random.default_rng(20240601).integers(1, (1 << 31) - 1, size=(2, BANDS * ROWS_PER_BAND),
+                                                  dtype=np.uint64)
+HASH_A = _seeds[0][:, None]
+HASH_B = _seeds[1][:, None]
+
+ABBREVIATIONS = {
+    'AMER': 'AMERICAN',
+    'ASSN': 'ASSOCIATION',
+    'ASSOC': 'ASSOCIATION',
+    'BROS': 'BROTHERS',
+    'CMTE': 'COMMITTEE',
+    'COMM': 'COMMITTEE',
+    'CTTE': 'COMMITTEE',
+    'DEPT': 'DEPARTMENT',
+    'EMPL': 'EMPLOYEES',
+    'EMPLS': 'EMPLOYEES',
+    'FED': 'FEDERAL',
+    'GOVT': 'GOVERNMENT',
+    'INS': 'INSURANCE',
+    'INTL': 'INTERNATIONAL',
+    'MFG': 'MANUFACTURING',
+    'MGMT': 'MANAGEMENT',
+    'NATL': 'NATIONAL',
+    'SVC': 'SERVICE',
+    'SVCS': 'SERVICES',
+}
+
+# legal forms and filler that do not tell committees apart
+NOISE_TOKENS = {'AND', 'CO', 'COMPANY', 'CORP', 'CORPORATION', 'FOR', 'INC', 'INCORPORATED', 'LLC', 'LLP',
+                'LP', 'LTD', 'OF', 'PAC', 'PLC', 'THE'}
+
+PAC_PHRASE = ('POLITICAL', 'ACTION', 'COMMITTEE')
+
+JOINED = re.compile(r"['.]")
+NON_WORD = re.compile(r'[^A-Z0-9]+')
+NUMBER = re.compile(r'\S*\d\S*')
+
+def normalize_contributor(name):
+    """Normalize a contributor name for matching, '' if nothing is left"""
+    text = JOINED.sub('', (name or '').upper().replace('&', ' AND '))
+    tokens = [ABBREVIATIONS.get(token, token) for token in NON_WORD.split(text) if token]
+    for i in range(len(tokens) - len(PAC_PHRASE), -1, -1):
+        if tuple(tokens[i:i + len(PAC_PHRASE)]) == PAC_PHRASE:
+            del tokens[i:i + len(PAC_PHRASE)]
+    kept = [token for token in tokens if token not in NOISE_TOKENS]
+    if not any(token.isalpha() for token in kept):
+        # "THE PAC" or "INC 485" say too little once the noise is gone
+        kept = tokens
+    return ' '.join(kept)
+
+def trigrams(normalized):
+    padded = f' {normalized} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def numbers(normalized):
+    """The tokens of a normalized name containing digits, e.g. '12' in 'UAW LOCAL 12'"""
+    return ' '.join(sorted(NUMBER.findall(normalized)))
+
+@lru_cache(maxsize=65536)
+def features(normalized):
+    return numbers(normalized), frozenset(trigrams(normalized))
+
+def similar(a, b):
+    """Whether two normalized names are the same contributor"""
+    if a == b:
+        return True
+    if min(len(a), len(b)) < MIN_FUZZY_LENGTH:
+        return False
+    (a_numbers, a_grams), (b_numbers, b_grams) = features(a), features(b)
+    if a_numbers != b_numbers:
+        # "LOCAL 12" and "LOCAL 13" are different committees
+        return False
+    return len(a_grams & b_grams) / len(a_grams | b_grams) >= JACCARD_THRESHOLD
+
+def exact_code(normalized):
+    value = int.from_bytes(hashlib.blake2b(normalized.encode(), digest_size=8).digest(), 'little', signed=True)
+    return (value & ~((1 << BAND_BITS) - 1)) | EXACT_BAND
+
+def band_codes(names):
+    """
+    MinHash band bucket codes for normalized names, an int64 array of shape
+    (len(names), BANDS). The numbers in a name go into every band, since
+    names with different numbers are never merged anyway.
+    """
+    # normalized names are upper-case ASCII, so each trigram packs into 24
+    # bits of a byte buffer; windows running into a separator are dropped
+    padded = [f' {name} ' for name in names]
+    data = np.frombuffer('\0'.join(padded).encode('ascii'), dtype=np.uint8).astype(np.uint64)
+    grams = (data[:-2] << np.uint64(16)) | (data[1:-1] << np.uint64(8)) | data[2:]
+    grams = grams[(data[:-2] != 0) & (data[1:-1] != 0) & (data[2:] != 0)]
+    offsets = np.cumsum([0] + [len(name) - 2 for name in padded[:-1]])
+    signatures = np.minimum.reduceat((HASH_A * grams + HASH_B) % PRIME, offsets, axis=1)
+
+    number_keys = [zlib.crc32(numbers(name).encode()) for name in names]
+    codes = np.tile(np.array(number_keys, dtype=np.uint64), (BANDS, 1))
+    for band in range(BANDS):
+        for row in signatures[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]:
+            codes[band] = codes[band] * MULTIPLIER + row
+        codes[band] = (codes[band] << np.uint64(BAND_BITS)) | np.uint64(band)
+    return codes.T.view(np.int64)
+
+def bucket_codes(names):
+    """The bucket codes of each normalized name, as bytes of int64s"""
+    codes = np.zeros((len(names), BANDS + 1), dtype=np.int64)
+    codes[:, 0] = [exact_code(name) for name in names]
+    fuzzy = [i for i, name in enumerate(names) if len(name) >= MIN_FUZZY_LENGTH]
+    if fuzzy:
+        codes[fuzzy, 1:] = band_codes([names[i] for i in fuzzy])
+    widths = [0 if not name else 1 + BANDS if len(name) >= MIN_FUZZY_LENGTH else 1 for name in names]
+    return [row[:width].tobytes() for row, width in zip(codes, widths)]
+
+def create_entity_tables(conn):
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS contributor_entities (
+            contributor_key INTEGER PRIMARY KEY,
+            entity_key INTEGER NOT NULL,
+            normalized_name TEXT NOT NULL,
+            buckets BLOB NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_contributor_entities_entity
+        ON contributor_entities(entity_key)
+    ''')
+
+def drop_entity_tables(conn):
+    conn.execute('DROP TABLE IF EXISTS contributor_entities')
+
+class UnionFind:
+    """Disjoint sets over keys, rooted at the smallest key; only keys that were merged are stored"""
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, key):
+        parent = self.parent
+        while parent.get(key, key) != key:
+            parent[key] = parent.get(parent[key], parent[key])
+            key = parent[key]
+        return key
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+    def groups(self):
+        """The merged sets, as lists of keys"""
+        groups = {}
+        for key in list(self.parent):
+            root = self.find(key)
+            groups.setdefault(root, [root]).append(key)
+        return groups.values()
+
+def add_new_names(conn, processed):
+    """
+    Normalize the contributors added after key processed and store them as
+    their own entities. Returns how many were added and their distinct bucket
+    codes, or None for the codes when every name is new.
+    """
+    read = conn.cursor()
+    write = conn.cursor()
+    read.execute('''
+        SELECT contributor_key, contributor_name FROM contributor_dim
+        WHERE contributor_key > ?
+        ORDER BY contributor_key
+    ''', (processed,))
+    codes = []
+    added = 0
+    while True:
+        rows = read.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        names = [normalize_contributor(name) for _, name in rows]
+        buckets = bucket_codes(names)
+        write.executemany('''
+            INSERT INTO contributor_entities (contributor_key, entity_key, normalized_name, buckets)
+            VALUES (?, ?, ?, ?)
+        ''', [(key, key, name, blob) for (key, _), name, blob in zip(rows, names, buckets)])
+        if processed:
+            codes.append(np.frombuffer(b''.join(buckets), dtype=np.int64))
+        added += len(rows)
+    if not processed:
+        return added, None
+    return added, np.unique(np.concatenate(codes)) if codes else np.zeros(0, dtype=np.int64)
+
+def stage_buckets(conn, new_codes):
+    """
+    Fill temp.entity_buckets with the (code, contributor_key) pairs of every
+    stored name in a bucket that a new name is in, all of them if new_codes
+    is None
+    """
+    conn.execute('DROP TABLE IF EXISTS temp.entity_buckets')
+    conn.execute('CREATE TEMP TABLE entity_buckets (code INTEGER, contributor_key INTEGER)')
+    read = conn.cursor()
+    write = conn.cursor()
+    read.execute('SELECT contributor_key, buckets FROM contributor_entities')
+    while True:
+        rows = read.fetchmany(BATCH_SIZE * 10)
+        if not rows:
+            break
+        codes = np.frombuffer(b''.join(blob for _, blob in rows), dtype=np.int64)
+        keys = np.repeat(np.array([key for key, _ in rows], dtype=np.int64),
+                         [len(blob) // 8 for _, blob in rows])
+        if new_codes is not None:
+            wanted = np.isin(codes, new_codes)
+            codes, keys = codes[wanted], keys[wanted]
+        write.executemany('INSERT INTO entity_buckets (code, contributor_key) VALUES (?, ?)',
+                          zip(codes.tolist(), keys.tolist()))
+
+def candidate_pairs(conn, processed):
+    """
+    Pairs of names sharing a bucket, at least one of them new, as
+    ((key, entity_key, normalized_name), (key, entity_key, normalized_name))
+    """
+    c = conn.cursor()
+    c.execute('''
+        SELECT b.code, e.contributor_key, e.entity_key, e.normalized_name
+        FROM temp.entity_buckets b
+        JOIN contributor_entities e ON e.contributor_key = b.contributor_key
+        WHERE b.code IN (SELECT code FROM temp.entity_buckets GROUP BY code HAVING COUNT(*) > 1)
+        ORDER BY b.code, e.contributor_key
+    ''')
+    for code, rows in groupby(c, key=lambda row: row[0]):
+        members = [row[1:] for row in rows]
+        if code & ((1 << BAND_BITS) - 1) == EXACT_BAND or len(members) > MAX_BUCKET_PAIRS:
+            # equal names are transitive, so linking to the first one is enough
+            first = members[0]
+            for member in members[1:]:
+                if member[0] > processed:
+                    yield first, member
+            continue
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                if b[0] > processed:
+                    yield a, b
+
+def contributor_amounts(conn, keys):
+    """Non-individual money per contributor_key, from contributor_totals"""
+    amounts = {}
+    keys = list(keys)
+    try:
+        for start in range(0, len(keys), BATCH_SIZE * 10):
+            chunk = json.dumps(keys[start:start + BATCH_SIZE * 10])
+            amounts.update(conn.execute('''
+                SELECT contributor_key, total_amount FROM contributor_totals
+                WHERE contributor_key IN (SELECT value FROM json_each(?))
+            ''', (chunk,)))
+    except sqlite3.OperationalError:
+        # contributor_search has not run yet; fall back to the oldest name
+        pass
+    return amounts
+
+def apply_groups(conn, groups, processed):
+    """Point every member of a group at the group's entity. Returns the names moved."""
+    groups = list(groups)
+    amounts = contributor_amounts(conn, {key for group in groups for key in group if key > processed})
+    moved = 0
+    c = conn.cursor()
+    for group in groups:
+        existing = [key for key in group if key <= processed]
+        if existing:
+            # stored keys are entity keys here, the oldest entity stays
+            entity_key = min(existing)
+        else:
+            entity_key = min(group, key=lambda key: (-amounts.get(key, 0.0), key))
+        for key in existing:
+            if key != entity_key:
+                c.execute('UPDATE contributor_entities SET entity_key = ? WHERE entity_key = ?', (entity_key, key))
+                moved += c.rowcount
+        new_keys = [(entity_key, key) for key in group if key > processed and key != entity_key]
+        c.executemany('UPDATE contributor_entities SET entity_key = ? WHERE contributor_key = ?', new_keys)
+        moved += len(new_keys)
+    return moved
+
+@timed()
+def refresh_contributor_entities(conn, rebuild=False):
+    """
+    Resolve the contributors added since the last refresh into entities,
+    or all of them with rebuild. Needs a writable connection; commits.
+    Returns the refresh stats.
+    """
+    if rebuild:
+        drop_entity_tables(conn)
+    create_entity_tables(conn)
+    c = conn.cursor()
+    processed = c.execute('SELECT COALESCE(MAX(contributor_key), 0) FROM contributor_entities').fetchone()[0]
+    newest = c.execute('SELECT COALESCE(MAX(contributor_key), 0) FROM contributor_dim').fetchone()[0]
+    if newest < processed:
+        # contributor_dim was rebuilt, so the keys no longer line up
+        return refresh_contributor_entities(conn, rebuild=True)
+
+    try:
+        added, new_codes = add_new_names(conn, processed)
+        stats = {'names': added, 'compared': 0, 'merged': 0}
+        if added:
+            stage_buckets(conn, new_codes)
+            groups = UnionFind()
+            for (a_key, a_entity, a_name), (b_key, b_entity, b_name) in candidate_pairs(conn, processed):
+                # stored names take part through their entity
+                a = a_key if a_key > processed else a_entity
+                b = b_key if b_key > processed else b_entity
+                if groups.find(a) == groups.find(b):
+                    continue
+                stats['compared'] += 1
+                if similar(a_name, b_name):
+                    groups.union(a, b)
+            conn.execute('DROP TABLE temp.entity_buckets')
+            stats['merged'] = apply_groups(conn, groups.groups(), processed)
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        conn.rollback()
+        raise
+    if added:
+        print(f"Resolved {stats['names']:,} contributor names, {stats['compared']:,} compared, "
+              f"{stats['merged']:,} folded into another spelling")
+    return stats
+
+def contributor_entity(contributor_name, conn=None):
+    """
+    The entity a contributor name belongs to, as a dict with entity_key,
+    canonical_name and variants, or None for an unknown name
+    """
+    if conn is None:
+        conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT e.entity_key FROM contributor_dim kd
+        JOIN contributor_entities e ON e.contributor_key = kd.contributor_key
+        WHERE kd.contributor_name = ?
+    ''', (contributor_name,))
+    row = c.fetchone()
+    if row is None:
+        return None
+    c.execute('''
+        SELECT kd.contributor_name FROM contributor_entities e
+        JOIN contributor_dim kd ON kd.contributor_key = e.contributor_key
+        WHERE e.entity_key = ?
+        ORDER BY e.contributor_key = e.entity_key DESC, kd.contributor_name
+    ''', (row[0],))
+    variants = [name for name, in c.fetchall()]
+    return {'entity_key': row[0], 'canonical_name': variants[0], 'variants': variants}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Collapse contributor name variants into entities')
+    parser.add_argument('--rebuild', action='store_true', help='resolve every name again')
+    parser.add_argument('--top', type=int, default=20, help='print the entities with the most variants')
+    args = parser.parse_args()
+
+    writer = connect(readonly=False)
+    refresh_contributor_entities(writer, rebuild=args.rebuild)
+    c = writer.cursor()
+    c.execute('''
+        SELECT kd.contributor_name, COUNT(*) AS variants
+        FROM contributor_entities e
+        JOIN contributor_dim kd ON kd.contributor_key = e.entity_key
+        GROUP BY e.entity_key
+        HAVING variants > 1
+        ORDER BY variants DESC
+        LIMIT ?
+    ''', (args.top,))
+    for name, variants in c.fetchall():
+        print(f"  {name}: {variants} spellings")
+    writer.close()
@@ -0,0 +1,146 @@
+"""
+Reading FEC bulk files as they are published.
+
+The committee contribution dumps come as .zip archives (or .gz once
+recompressed) holding one pipe-delimited text file. Archives are streamed
+with large buffered reads instead of being unpacked next to the data, and
+plain files are read through mmap. Lines are decoded as UTF-8, falling back
+to latin-1 for the lines that are not valid UTF-8, so names with stray
+latin-1 bytes are neither dropped nor mangled.
+"""
+import gzip
+import mmap
+import os
+import zipfile
+
+ARCHIVE_SUFFIXES = ('.zip', '.gz')
+
+# decompressed bytes read from an archive at a time
+READ_SIZE = 16 * 1024 * 1024
+
+def is_archive(data_path):
+    return data_path.lower().endswith(ARCHIVE_SUFFIXES)
+
+def find_data_file(base_path):
+    """The first of base_path.txt, .zip, .txt.gz or .gz that exists, or the .txt path if none does"""
+    for suffix in ('.txt', '.zip', '.txt.gz', '.gz'):
+        if os.path.exists(base_path + suffix):
+            return base_path + suffix
+    return base_path + '.txt'
+
+def open_archive(data_path):
+    """
+    Open the data inside a .zip or .gz archive as a binary stream. A zip
+    archive is expected to hold one data file; if it holds several, the
+    largest one is read.
+    """
+    if data_path.lower().endswith('.gz'):
+        return gzip.open(data_path, 'rb')
+    archive = zipfile.ZipFile(data_path)
+    members = [info for info in archive.infolist() if not info.is_dir()]
+    if not members:
+        archive.close()
+        raise ValueError(f"No data file in archive: {data_path}")
+    member = max(members, key=lambda info: info.file_size)
+    # the member stream keeps the archive open until it is closed itself
+    stream = archive.open(member)
+    archive.close()
+    return stream
+
+def read_blocks(stream, block_size=READ_SIZE):
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            return
+        yield block
+
+def rejoin_lines(blocks):
+    """Turn arbitrary byte blocks into blocks that end on line boundaries"""
+    tail = b''
+    for block in blocks:
+        data = tail + block if tail else block
+        cut = data.rfind(b'\n') + 1
+        tail = data[cut:]
+        if cut:
+            yield data[:cut]
+    if tail:
+        yield tail
+
+def iter_archive_chunks(data_path, chunk_size=READ_SIZE):
+    """Decompressed blocks of about chunk_size bytes that end on line boundaries"""
+    with open_archive(data_path) as stream:
+        yield from rejoin_lines(read_blocks(stream, chunk_size))
+
+def split_file_ranges(data_path, chunk_size, size=None):
+    """Split a plain file into (start, end) byte ranges that end on line boundaries"""
+    if size is None:
+        size = os.path.getsize(data_path)
+    if size == 0:
+        return []
+    ranges = []
+    with open(data_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        start = 0
+        while start < size:
+            # move the end forward to the next newline so no line is split
+            end = view.find(b'\n', min(start + chunk_size, size) - 1)
+            end = size if end < 0 else end + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def read_range(data_path, start, end):
+    """Bytes start to end of a plain file, copied out of an mmap"""
+    if end <= start:
+        return b''
+    with open(data_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        return view[start:end]
+
+def iter_mmap_lines(data_path, offset=0):
+    """Raw lines of a plain file from offset on, split on an mmap. The last line may lack its newline."""
+    if os.path.getsize(data_path) <= offset:
+        return
+    with open(data_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        size = len(view)
+        while offset < size:
+            end = view.find(b'\n', offset)
+            end = size if end < 0 else end + 1
+            yield view[offset:end]
+            offset = end
+
+def complete_lines_size(data_path, size=None):
+    """Offset just past the last newline of a plain file, where its complete records end"""
+    size = os.path.getsize(data_path) if size is None else size
+    if not size:
+        return 0
+    with open(data_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        return view.rfind(b'\n', 0, size) + 1
+
+def decode_line(raw_line):
+    try:
+        return raw_line.decode('utf-8')
+    except UnicodeDecodeError:
+        return raw_line.decode('latin-1')
+
+def decode_lines(data):
+    """Split a block of records into lines, decoding each as UTF-8 or else latin-1"""
+    try:
+        return data.decode('utf-8').split('\n')
+    except UnicodeDecodeError:
+        # only the lines that are not UTF-8 are decoded as latin-1
+        return [decode_line(raw_line) for raw_line in data.split(b'\n')]
+
+def iter_chunks(data_path, chunk_size=READ_SIZE):
+    """Blocks of a plain file or archive that end on line boundaries"""
+    if is_archive(data_path):
+        yield from iter_archive_chunks(data_path, chunk_size)
+        return
+    for start, end in split_file_ranges(data_path, chunk_size):
+        yield read_range(data_path, start, end)
+
+def iter_lines(data_path):
+    """Decoded lines of a plain file or archive, without their newlines"""
+    for chunk in iter_chunks(data_path):
+        lines = decode_lines(chunk)
+        if lines[-1] == '':
+            lines.pop()
+        yield from lines
@@ -0,0 +1,240 @@
+"""
+Deterministic generator for synthetic FEC "contributions from committees"
+data. Writes pipe-delimited con-from-com files in the column order of
+con-from-com-header.csv, so they can be loaded by initialize_db exactly like
+the real dumps. Candidates, contributors and committees are drawn from Zipf
+distributions, so a few candidates and PACs account for most rows, as they
+do in the real data. A small share of records are amendments of earlier
+transactions.
+
+The same seed and sizes always produce byte-identical files.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import sqlite3
+from industries import generate_names, get_taxonomy
+from initialize_db import DATA_DIR, load_headers
+
+HEADER_NAME = 'con-from-com-header.csv'
+
+# file name and year for each two-year cycle, as initialize_db expects them
+CYCLES = [
+    ('con-from-com-21-22.txt', 2021),
+    ('con-from-com-23-24.txt', 2023),
+    ('con-from-com-25-26.txt', 2025),
+]
+
+STATES = ['AK', 'AL', 'AZ', 'CA', 'CO', 'FL', 'GA', 'IL', 'KY', 'MA', 'ME', 'MI', 'MN', 'NC',
+          'NY', 'OH', 'PA', 'TX', 'VA', 'VT', 'WA', 'WI']
+PARTIES = [('DEM', 'Democratic'), ('REP', 'Republican'), ('IND', 'Independent')]
+FIRST_NAMES = ['JOHN', 'MARY', 'ANGUS', 'ELIZABETH', 'TED', 'BERNARD', 'SUSAN', 'MITCH', 'CHARLES',
+               'AMY', 'THOMAS', 'LISA', 'RAND', 'KYRSTEN', 'JON', 'PATTY', 'RON', 'MAZIE', 'TIM', 'JONI']
+LAST_NAMES = ['KING', 'WARREN', 'CRUZ', 'SANDERS', 'COLLINS', 'MCCONNELL', 'SCHUMER', 'KLOBUCHAR',
+              'COTTON', 'MURKOWSKI', 'PAUL', 'SINEMA', 'TESTER', 'SMITH', 'JONES', 'BROWN', 'DAVIS',
+              'MILLER', 'WILSON', 'MOORE', 'TAYLOR', 'ANDERSON', 'THOMAS', 'JACKSON', 'WHITE']
+
+# entity types of contributing committees and how common they are
+ENTITY_TYPES = ['PAC', 'COM', 'ORG', 'CCM', 'PTY', 'IND']
+ENTITY_WEIGHTS = [45, 20, 12, 10, 5, 8]
+
+# share of records that amend an earlier transaction
+AMENDMENT_RATE = 0.02
+
+BATCH_ROWS = 50000
+
+def zipf_weights(count, skew):
+    """Cumulative Zipf weights for ranks 1..count"""
+    return list(itertools.accumulate(1.0 / (rank ** skew) for rank in range(1, count + 1)))
+
+def default_sizes(rows):
+    """Number of candidates, contributors and committees for a row count"""
+    return {
+        'candidates': max(200, rows // 2000),
+        'contributors': max(1000, rows // 40),
+        'committees': max(100, rows // 5000),
+    }
+
+def make_candidates(count, rng):
+    """Candidate tuples (CAND_ID, CAND_NAME, PTY_CD, party, state, first, last)"""
+    candidates = []
+    for i in range(count):
+        office = rng.choices('SHP', weights=[3, 6, 1])[0]
+        state = rng.choice(STATES)
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        party_code, party = rng.choice(PARTIES)
+        name = f'{last}, {first} {rng.choice("ABCDEFGHJKLMRS")}'
+        candidates.append((f'{office}{rng.randint(0, 9)}{state}{i:05d}', name, party_code, party, state, first, last))
+    return candidates
+
+def make_contributors(count, rng, seed):
+    """Contributor tuples (name, entity_type, city, state, zip)"""
+    names = generate_names(count, get_taxonomy(), seed)
+    rng.shuffle(names)
+    entity_types = rng.choices(ENTITY_TYPES, weights=ENTITY_WEIGHTS, k=count)
+    contributors = []
+    for name, entity_type in zip(names, entity_types):
+        if entity_type == 'IND':
+            name = f'{rng.choice(LAST_NAMES)}, {rng.choice(FIRST_NAMES)} {name.split()[-1]}'
+        contributors.append((name, entity_type, 'WASHINGTON', rng.choice(STATES), f'{rng.randint(10000, 99999)}'))
+    return contributors
+
+def generate_dataset(out_dir, rows, seed=0, skew=1.1, candidates=None, contributors=None, committees=None):
+    """
+    Write con-from-com files for every cycle in CYCLES into out_dir, rows in
+    total, plus a copy of the header file. Returns a dict describing the
+    dataset, including the generated candidates for write_reference_tables.
+    """
+    sizes = default_sizes(rows)
+    n_candidates = candidates or sizes['candidates']
+    n_contributors = contributors or sizes['contributors']
+    n_committees = committees or sizes['committees']
+
+    rng = random.Random(seed)
+    candidate_rows = make_candidates(n_candidates, rng)
+    contributor_rows = make_contributors(n_contributors, rng, seed)
+    committee_ids = [f'C{i:08d}' for i in range(1, n_committees + 1)]
+    candidate_weights = zipf_weights(n_candidates, skew)
+    contributor_weights = zipf_weights(n_contributors, skew)
+    committee_weights = zipf_weights(n_committees, skew)
+
+    os.makedirs(out_dir, exist_ok=True)
+    headers = load_headers(os.path.join(DATA_DIR, HEADER_NAME))
+    shutil.copyfile(os.path.join(DATA_DIR, HEADER_NAME), os.path.join(out_dir, HEADER_NAME))
+
+    files = []
+    sub_id = 4000000000000000000
+    per_cycle = [rows // len(CYCLES) + (1 if i < rows % len(CYCLES) else 0) for i in range(len(CYCLES))]
+    for (file_name, year), cycle_rows in zip(CYCLES, per_cycle):
+        path = os.path.join(out_dir, file_name)
+        recent = []
+        written = 0
+        with open(path, 'w', encoding='utf-8', newline='\n') as file:
+            while written < cycle_rows:
+                batch = min(BATCH_ROWS, cycle_rows - written)
+                picked_candidates = rng.choices(candidate_rows, cum_weights=candidate_weights, k=batch)
+                picked_contributors = rng.choices(contributor_rows, cum_weights=contributor_weights, k=batch)
+                picked_committees = rng.choices(committee_ids, cum_weights=committee_weights, k=batch)
+                lines = []
+                for i in range(batch):
+                    sub_id += 1
+                    row_number = written + i
+                    if recent and rng.random() < AMENDMENT_RATE:
+                        # amend a recent transaction: same committee and TRAN_ID, new amount
+                        cmte_id, tran_id, candidate, contributor = rng.choice(recent)
+                        amendment = 'A'
+                    else:
+                        cmte_id = picked_committees[i]
+                        tran_id = f'SA11AI.{row_number}'
+                        candidate, contributor = picked_candidates[i], picked_contributors[i]
+                        amendment = 'N'
+                        if len(recent) < 1000:
+                            recent.append((cmte_id, tran_id, candidate, contributor))
+                        else:
+                            recent[rng.randrange(1000)] = (cmte_id, tran_id, candidate, contributor)
+
+                    name, entity_type, city, state, zip_code = contributor
+                    other_id = '' if entity_type == 'IND' else rng.choice(committee_ids)
+                    month = rng.randint(1, 12)
+                    day = rng.randint(1, 28)
+                    date_year = year + rng.randint(0, 1)
+                    amount = max(1, int(rng.lognormvariate(7, 1.3)))
+                    values = {
+                        'CMTE_ID': cmte_id,
+                        'AMNDT_IND': amendment,
+                        'RPT_TP': rng.choice(('Q1', 'Q2', 'Q3', 'YE', 'M10', 'M11')),
+                        'TRANSACTION_PGI': f'P{year + 1}',
+                        'IMAGE_NUM': f'{date_year}{sub_id % 10 ** 14:014d}',
+                        'TRANSACTION_TP': '24K',
+                        'ENTITY_TP': entity_type,
+                        'NAME': name,
+                        'CITY': city,
+                        'STATE': state,
+                        'ZIP_CODE': zip_code,
+                        'EMPLOYER': '',
+                        'OCCUPATION': '',
+                        'TRANSACTION_DT': f'{month:02d}{day:02d}{date_year}',
+                        'TRANSACTION_AMT': str(amount),
+                        'OTHER_ID': other_id,
+                        'CAND_ID': candidate[0],
+                        'TRAN_ID': tran_id,
+                        'FILE_NUM': str(1000000 + sub_id % 500000),
+                        'MEMO_CD': '',
+                        'MEMO_TEXT': '',
+                        'SUB_ID': str(sub_id),
+                    }
+                    lines.append('|'.join(values[header] for header in headers))
+                file.write('\n'.join(lines) + '\n')
+                written += batch
+        files.append((path, year))
+
+    return {
+        'rows': rows,
+        'seed': seed,
+        'skew': skew,
+        'files': files,
+        'bytes': sum(os.path.getsize(path) for path, _ in files),
+        'candidates': candidate_rows,
+        'contributors': n_contributors,
+        'committees': n_committees,
+    }
+
+def write_reference_tables(db_path, candidate_rows, senators=100, seed=0):
+    """
+    Create the candidates and senate tables the query services join against,
+    with senators picked from the generated Senate candidates.
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS candidates (
+            CAND_ID TEXT PRIMARY KEY,
+            CAND_NAME TEXT,
+            PTY_CD TEXT,
+            CAND_PTY_AFFILIATION TEXT,
+            CAND_OFFICE_ST TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS senate (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            party TEXT NOT NULL,
+            state TEXT NOT NULL,
+            photoUrl TEXT,
+            phones TEXT,
+            UNIQUE(name, state)
+        )
+    ''')
+    c.executemany('INSERT OR REPLACE INTO candidates VALUES (?, ?, ?, ?, ?)',
+                  [(cand_id, name, party_code, party_code, state)
+                   for cand_id, name, party_code, _, state, _, _ in candidate_rows])
+    senate_candidates = [row for row in candidate_rows if row[0].startswith('S')]
+    picked = rng.sample(senate_candidates, min(senators, len(senate_candidates)))
+    c.executemany('''
+        INSERT OR IGNORE INTO senate (name, party, state, photoUrl, phones)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(f'{first.title()} {last.title()}', party, state, None, json.dumps(['202-555-0100']))
+          for _, _, _, party, state, first, last in picked])
+    conn.commit()
+    conn.close()
+    return len(picked)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate synthetic FEC con-from-com files')
+    parser.add_argument('out_dir', help='directory for the generated files')
+    parser.add_argument('--rows', type=int, default=100000, help='total records across all cycles')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent for candidates, contributors and committees')
+    parser.add_argument('--db', help='also write candidates and senate tables to this database')
+    args = parser.parse_args()
+
+    dataset = generate_dataset(args.out_dir, args.rows, seed=args.seed, skew=args.skew)
+    print(f"Wrote {args.rows:,} records ({dataset['bytes'] / 1e6:,.1f} MB) to {args.out_dir}")
+    if args.db:
+        senators = write_reference_tables(args.db, dataset['candidates'], seed=args.seed)
+        print(f"Wrote {len(dataset['candidates']):,} candidates and {senators} senators to {args.db}")
@@ -0,0 +1,355 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import time
+from collections import deque
+from ingest_state import create_state_table, get_state, set_state, get_generation
+from instrumentation import timed
+
+# shared keyword map, also read by server.js
+TAXONOMY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'industries.json')
+
+# contributor names classified per batch during an ingest
+CLASSIFY_BATCH = 50000
+
+_taxonomy = None
+
+def load_taxonomy(path=TAXONOMY_PATH):
+    """Load the industry taxonomy from the shared JSON file"""
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+def get_taxonomy():
+    """Get the taxonomy, loading it on first use"""
+    global _taxonomy
+    if _taxonomy is None:
+        _taxonomy = load_taxonomy()
+    return _taxonomy
+
+def taxonomy_version(taxonomy):
+    """Hash a taxonomy so a change to the keyword map can be detected"""
+    encoded = json.dumps(taxonomy, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+def classify_industry(contributor_name, taxonomy=None):
+    """
+    Classify a contributor into an industry based on their name.
+    The first industry in the taxonomy with a matching keyword wins.
+    """
+    if taxonomy is None:
+        taxonomy = get_taxonomy()
+    contributor_name = contributor_name.lower()
+
+    for industry in taxonomy['industries']:
+        if any(keyword in contributor_name for keyword in industry['keywords']):
+            return industry['name']
+
+    return taxonomy['default']
+
+class IndustryMatcher:
+    """
+    Compiled multi-keyword matcher for the industry taxonomy.
+
+    All keywords are built into one Aho-Corasick automaton, so a name is
+    classified in a single pass over its characters no matter how many
+    industries and keywords the taxonomy has. Every state remembers the best
+    (earliest) industry among the keywords ending there, which gives the same
+    first-industry-wins result as classify_industry.
+    """
+
+    def __init__(self, taxonomy=None):
+        if taxonomy is None:
+            taxonomy = get_taxonomy()
+        self.names = [industry['name'] for industry in taxonomy['industries']]
+        self.default = taxonomy['default']
+        self._no_match = len(self.names)
+
+        # trie of all keywords, each terminal state tagged with its industry rank
+        goto = [{}]
+        ranks = [self._no_match]
+        for rank, industry in enumerate(taxonomy['industries']):
+            for keyword in industry['keywords']:
+                state = 0
+                for char in keyword:
+                    next_state = goto[state].get(char)
+                    if next_state is None:
+                        goto.append({})
+                        ranks.append(self._no_match)
+                        next_state = len(goto) - 1
+                        goto[state][char] = next_state
+                    state = next_state
+                ranks[state] = min(ranks[state], rank)
+
+        # breadth-first pass to add failure links, folded directly into a
+        # complete transition table so matching never has to backtrack
+        fail = [0] * len(goto)
+        transitions = [None] * len(goto)
+        transitions[0] = dict(goto[0])
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            ranks[state] = min(ranks[state], ranks[fail[state]])
+            transitions[state] = dict(transitions[fail[state]])
+            transitions[state].update(goto[state])
+            for char, child in goto[state].items():
+                fail[child] = transitions[fail[state]].get(char, 0) if state else 0
+                queue.append(child)
+
+        self._steps = [table.get for table in transitions]
+        self._ranks = ranks
+
+    @classmethod
+    def from_file(cls, path=TAXONOMY_PATH):
+        """Build a matcher from a taxonomy file"""
+        return cls(load_taxonomy(path))
+
+    def classify(self, contributor_name):
+        """Classify a single contributor name"""
+        steps = self._steps
+        ranks = self._ranks
+        best = ranks[0]
+        state = 0
+        for char in contributor_name.lower():
+            state = steps[state](char, 0)
+            rank = ranks[state]
+            if rank < best:
+                best = rank
+                if best == 0:
+                    break
+        return self.names[best] if best < self._no_match else self.default
+
+    def classify_many(self, contributor_names):
+        """Classify a batch of names, returning a list in the same order"""
+        seen = {}
+        results = []
+        for name in contributor_names:
+            industry = seen.get(name)
+            if industry is None:
+                industry = seen[name] = self.classify(name)
+            results.append(industry)
+        return results
+
+_matcher = None
+
+def get_matcher():
+    """Get a matcher for the shared taxonomy, compiling it on first use"""
+    global _matcher
+    if _matcher is None:
+        _matcher = IndustryMatcher(get_taxonomy())
+    return _matcher
+
+def create_industry_tables(conn):
+    """Create the contributor classification and candidate x industry rollup tables"""
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS contributor_industry (
+            contributor_name TEXT PRIMARY KEY,
+            industry TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_contributor_industry_industry
+        ON contributor_industry(industry)
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS candidate_industry_totals (
+            industry TEXT,
+            candidate_id TEXT,
+            total_amount REAL,
+            contributor_count INTEGER,
+            top_contributor TEXT,
+            top_amount REAL,
+            PRIMARY KEY (industry, candidate_id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_industry_totals_amount
+        ON candidate_industry_totals(industry, total_amount DESC)
+    ''')
+    c.execute('''
+        CREATE INDEX IF NOT EXISTS idx_industry_totals_candidate
+        ON candidate_industry_totals(candidate_id)
+    ''')
+    create_state_table(conn)
+
+def reclassify_contributors(conn, taxonomy):
+    """
+    Re-run the classifier over the already classified contributor names and
+    update only the ones whose industry changed. Returns the set of
+    industries that gained or lost contributors. Names are read in batches
+    of CLASSIFY_BATCH, so memory does not grow with the number of names.
+    """
+    matcher = IndustryMatcher(taxonomy)
+    c = conn.cursor()
+    affected = set()
+    last = ''
+    while True:
+        c.execute('''
+            SELECT contributor_name, industry FROM contributor_industry
+            WHERE contributor_name > ?
+            ORDER BY contributor_name
+            LIMIT ?
+        ''', (last, CLASSIFY_BATCH))
+        rows = c.fetchall()
+        if not rows:
+            return affected
+        last = rows[-1][0]
+        changed = []
+        for (contributor_name, old_industry), industry in zip(rows, matcher.classify_many(name for name, _ in rows)):
+            if industry != old_industry:
+                changed.append((industry, contributor_name))
+                affected.update((industry, old_industry))
+        c.executemany('UPDATE contributor_industry SET industry = ? WHERE contributor_name = ?', changed)
+
+def classify_new_contributors(conn, taxonomy):
+    """Classify contributor names that are not in contributor_industry yet, in batches"""
+    matcher = IndustryMatcher(taxonomy)
+    c = conn.cursor()
+    added = 0
+    last = 0
+    while True:
+        # contributor_dim already holds every distinct name once
+        c.execute('''
+            SELECT kd.contributor_key, kd.contributor_name
+            FROM contributor_dim kd
+            LEFT JOIN contributor_industry ci ON ci.contributor_name = kd.contributor_name
+            WHERE kd.contributor_key > ? AND ci.contributor_name IS NULL
+            ORDER BY kd.contributor_key
+            LIMIT ?
+        ''', (last, CLASSIFY_BATCH))
+        rows = c.fetchall()
+        if not rows:
+            return added
+        last = rows[-1][0]
+        names = [name for _, name in rows]
+        c.executemany('INSERT INTO contributor_industry (contributor_name, industry) VALUES (?, ?)',
+                      zip(names, matcher.classify_many(names)))
+        added += len(rows)
+
+def rebuild_industry_rollup(conn, industries=None):
+    """
+    Rebuild candidate_industry_totals, either completely or only for the
+    given industries, from non-individual contributions.
+    """
+    c = conn.cursor()
+    params = ()
+    industry_filter = ''
+    if industries is not None:
+        industries = sorted(industries)
+        if not industries:
+            return
+        params = tuple(industries)
+        placeholders = ', '.join('?' for _ in industries)
+        industry_filter = f'AND ci.industry IN ({placeholders})'
+        c.execute(f'DELETE FROM candidate_industry_totals WHERE industry IN ({placeholders})', params)
+    else:
+        c.execute('DELETE FROM candidate_industry_totals')
+
+    c.execute(f'''
+        INSERT INTO candidate_industry_totals
+            (industry, candidate_id, total_amount, contributor_count, top_contributor, top_amount)
+        WITH per_contributor AS (
+            SELECT ci.industry, cc.candidate_id, cc.contributor_name, SUM(cc.amount) AS amount
+            FROM contributorsFromCommittees cc
+            JOIN contributor_industry ci ON ci.contributor_name = cc.contributor_name
+            WHERE cc.entity_type != 'IND' {industry_filter}
+            GROUP BY ci.industry, cc.candidate_id, cc.contributor_name
+        ), ranked AS (
+            SELECT industry, candidate_id, contributor_name, amount,
+                   ROW_NUMBER() OVER (PARTITION BY industry, candidate_id ORDER BY amount DESC) AS position,
+                   SUM(amount) OVER (PARTITION BY industry, candidate_id) AS total_amount,
+                   COUNT(*) OVER (PARTITION BY industry, candidate_id) AS contributor_count
+            FROM per_contributor
+        )
+        SELECT industry, candidate_id, total_amount, contributor_count, contributor_name, amount
+        FROM ranked
+        WHERE position = 1
+    ''', params)
+
+@timed()
+def refresh_contributor_industries(conn, taxonomy=None):
+    """
+    Bring contributor_industry and candidate_industry_totals up to date.
+
+    Run after every ingest. New contributor names are classified once, and
+    when the keyword map changed since the last run the existing names are
+    reclassified and only the affected industries are rolled up again.
+    """
+    if taxonomy is None:
+        taxonomy = get_taxonomy()
+    try:
+        create_industry_tables(conn)
+        version = taxonomy_version(taxonomy)
+        affected = set()
+        if get_state(conn, 'taxonomy_version') not in (None, version):
+            affected = reclassify_contributors(conn, taxonomy)
+            print(f"Taxonomy changed, reclassified contributors in {len(affected)} industries")
+        added = classify_new_contributors(conn, taxonomy)
+        print(f"Classified {added:,} new contributors")
+
+        # new contributions can land in any industry, so the rollup is rebuilt
+        # in full after an ingest and only for the changed industries otherwise
+        generation = get_generation(conn)
+        if added or int(get_state(conn, 'rollup_generation', -1)) != generation:
+            rebuild_industry_rollup(conn)
+        else:
+            rebuild_industry_rollup(conn, affected)
+
+        set_state(conn, 'taxonomy_version', version)
+        set_state(conn, 'rollup_generation', generation)
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        conn.rollback()
+        raise
+
+def generate_names(count, taxonomy, seed=0):
+    """Generate distinct contributor-like names, some containing taxonomy keywords"""
+    rng = random.Random(seed)
+    keywords = [keyword for industry in taxonomy['industries'] for keyword in industry['keywords']]
+    words = ['AMERICAN', 'NATIONAL', 'UNITED', 'ASSOCIATION', 'COMPANY', 'GROUP', 'HOLDINGS',
+             'COUNCIL', 'SOCIETY', 'PARTNERS', 'WORKERS', 'UNION', 'INC', 'LLC', 'CORP']
+    names = set()
+    while len(names) < count:
+        parts = rng.sample(words, rng.randint(1, 3))
+        if rng.random() < 0.6:
+            parts.insert(rng.randrange(len(parts) + 1), rng.choice(keywords).upper())
+        parts.append(str(rng.randrange(count)))
+        names.add(' '.join(parts))
+    return sorted(names)
+
+def benchmark(count, taxonomy=None):
+    """Compare classify_industry with IndustryMatcher on generated names"""
+    if taxonomy is None:
+        taxonomy = get_taxonomy()
+    names = generate_names(count, taxonomy)
+
+    started = time.perf_counter()
+    expected = [classify_industry(name, taxonomy) for name in names]
+    naive_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    matcher = IndustryMatcher(taxonomy)
+    compile_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = matcher.classify_many(names)
+    matcher_seconds = time.perf_counter() - started
+
+    mismatches = sum(1 for a, b in zip(expected, results) if a != b)
+    print(f"Classified {count:,} distinct names")
+    print(f"classify_industry: {naive_seconds:.2f}s ({count / naive_seconds:,.0f} names/sec)")
+    print(f"IndustryMatcher:   {matcher_seconds:.2f}s ({count / matcher_seconds:,.0f} names/sec), "
+          f"compiled in {compile_seconds * 1000:.1f}ms")
+    print(f"Speedup: {naive_seconds / matcher_seconds:.1f}x, mismatches: {mismatches}")
+    return mismatches == 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the industry classifiers')
+    parser.add_argument('--names', type=int, default=300000, help='number of distinct names')
+    parser.add_argument('--taxonomy', default=TAXONOMY_PATH, help='taxonomy JSON file')
+    args = parser.parse_args()
+    benchmark(args.names, load_taxonomy(args.taxonomy))
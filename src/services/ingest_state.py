@@ -0,0 +1,38 @@
+import sqlite3
+
+def create_state_table(conn):
+    """Create the key/value table that tracks ingest bookkeeping"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+def get_state(conn, key, default=None):
+    """Read a value from the ingest_state table"""
+    c = conn.cursor()
+    try:
+        c.execute('SELECT value FROM ingest_state WHERE key = ?', (key,))
+    except sqlite3.OperationalError:
+        # the table does not exist until the first ingest
+        return default
+    row = c.fetchone()
+    return row[0] if row else default
+
+def set_state(conn, key, value):
+    """Write a value to the ingest_state table. Does not commit."""
+    conn.execute('''
+        INSERT INTO ingest_state (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    ''', (key, str(value)))
+
+def get_generation(conn):
+    """Get the ingest generation, which changes every time new data is loaded"""
+    return int(get_state(conn, 'ingest_generation', 0))
+
+def bump_generation(conn):
+    """Advance the ingest generation. Does not commit."""
+    generation = get_generation(conn) + 1
+    set_state(conn, 'ingest_generation', generation)
+    return generation
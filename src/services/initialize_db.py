@@ -1,6 +1,33 @@
+import argparse
 import csv
+import hashlib
+import os
 import sqlite3
 from collections import defaultdict
+from datetime import datetime
+from database import connect, SERVICES_DIR
+from bulk_loader import (TERMINATED, bulk_load_contributions, column_indexes, parse_sub_id, parse_transaction_date,
+                         transaction_key)
+from industries import refresh_contributor_industries
+from candidate_index import refresh_candidate_index, refresh_senate_candidates
+from ingest_state import create_state_table, bump_generation
+from compact_schema import create_compact_schema, drop_contributions, migrate_to_compact, print_migration_report
+from contribution_cubes import add_to_cubes, create_cube_tables, drop_cube_tables, refresh_contribution_cubes
+from static_reports import build_reports
+from snapshot import ensure_writer_db, publish_snapshot
+from contributor_search import drop_search_tables, refresh_contributor_search
+from entity_resolution import drop_entity_tables, refresh_contributor_entities
+from committee_graph import drop_graph_tables, refresh_committee_graph
+from fec_files import decode_line, find_data_file, is_archive, iter_lines, iter_mmap_lines
+from instrumentation import timed
+
+# commit a checkpoint after this many appended records
+CHECKPOINT_ROWS = 50000
+
+DATA_DIR = os.path.join(SERVICES_DIR, '..', 'assets', 'data', 'contributions-from-committees')
+
+# number of leading bytes hashed to detect a file that was rewritten in place
+HEAD_BYTES = 64 * 1024
 
 def load_headers(header_csv_path):
     """Load column headers from the CSV file"""
@@ -9,33 +36,39 @@ def load_headers(header_csv_path):
         headers = next(reader)
     return headers
 
-def init_db():
+def init_db(reset=False):
     """Initialize the SQLite database and create necessary tables"""
     try:
-        # close any existing connections
-        conn = sqlite3.connect('politicaldata.db', timeout=20)
+        # writer connection to the writer database; readers use the snapshot
+        # published from it, see snapshot.py
+        ensure_writer_db()
+        conn = connect(readonly=False)
         c = conn.cursor()
         
-        # drop existing table to recreate with new schema
-        c.execute('DROP TABLE IF EXISTS contributorsFromCommittees')
+        # only drop existing tables when a full rebuild is requested
+        if reset:
+            drop_contributions(conn)
+            drop_cube_tables(conn)
+            drop_search_tables(conn)
+            drop_entity_tables(conn)
+            drop_graph_tables(conn)
+            c.execute('DROP TABLE IF EXISTS contribution_ledger')
+            c.execute('DROP TABLE IF EXISTS ingest_manifest')
         
-        # Create table for contributions
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS contributorsFromCommittees (
-                candidate_id TEXT,
-                contributor_name TEXT,
-                entity_type TEXT,
-                amount REAL,
-                year INTEGER,
-                PRIMARY KEY (candidate_id, contributor_name, year)
-            )
-        ''')
+        # databases created before the compact layout are migrated once
+        report = migrate_to_compact(conn)
+        if report is not None:
+            print_migration_report(report)
         
-        # Create index for faster queries
-        c.execute('''
-            CREATE INDEX IF NOT EXISTS idx_candidate 
-            ON contributorsFromCommittees(candidate_id)
-        ''')
+        # contributorsFromCommittees is a view over the dimension and fact
+        # tables, see compact_schema
+        create_compact_schema(conn)
+        create_ledger_tables(conn)
+        create_state_table(conn)
+        
+        # industry x candidate totals per day and month, see contribution_cubes
+        create_cube_tables(conn)
+        add_ledger_columns(conn)
         
         conn.commit()
         return conn
@@ -45,6 +78,66 @@ def init_db():
             conn.close()
         raise
 
+def create_ledger_tables(conn):
+    """Create contribution_ledger and ingest_manifest"""
+    c = conn.cursor()
+    # one row per transaction, used to apply amendments without
+    # counting the amended amount twice
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS contribution_ledger (
+            cmte_id TEXT,
+            tran_id TEXT,
+            year INTEGER,
+            sub_id INTEGER,
+            candidate_id TEXT,
+            contributor_name TEXT,
+            entity_type TEXT,
+            amount REAL,
+            transaction_date TEXT,
+            other_id TEXT,
+            PRIMARY KEY (cmte_id, tran_id, year)
+        ) WITHOUT ROWID
+    ''')
+
+    # how far each data file has been ingested
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_manifest (
+            file_path TEXT PRIMARY KEY,
+            year INTEGER,
+            size INTEGER,
+            mtime REAL,
+            head_hash TEXT,
+            last_offset INTEGER,
+            max_sub_id INTEGER,
+            updated_at TEXT
+        )
+    ''')
+
+# ledger columns added after the ledger was introduced
+LEDGER_COLUMNS = {
+    'transaction_date': 'TEXT',
+    'other_id': 'TEXT',
+}
+
+def add_ledger_columns(conn):
+    """
+    Add the columns in LEDGER_COLUMNS to a ledger created before they were
+    tracked. Loaded files are forgotten so the next ingest reloads them with
+    the new columns filled in.
+    """
+    c = conn.cursor()
+    c.execute('PRAGMA table_info(contribution_ledger)')
+    existing = {column[1] for column in c.fetchall()}
+    missing = [name for name in LEDGER_COLUMNS if name not in existing]
+    if not missing:
+        return
+    for name in missing:
+        c.execute(f'ALTER TABLE contribution_ledger ADD COLUMN {name} {LEDGER_COLUMNS[name]}')
+    c.execute('SELECT COUNT(*) FROM ingest_manifest')
+    if c.fetchone()[0]:
+        print(f"Ledger has no {', '.join(missing)} yet, every file will be reloaded")
+        c.execute('DELETE FROM ingest_manifest')
+
 def load_contributions_to_db(data_path, headers, conn, year):
     """Load contributorsFromCommittees from file into SQLite database"""
     c = conn.cursor()
@@ -53,59 +146,295 @@ def load_contributions_to_db(data_path, headers, conn, year):
     batch_size = 1000
     batch = []
     
-    with open(data_path, 'r', encoding='utf-8') as file:
-        for line in file:
-            parts = line.strip().split('|')
-            if len(parts) != len(headers):
-                continue
-                
-            data = dict(zip(headers, parts))
-            batch.append((
-                data['CAND_ID'],
-                data['NAME'],
-                data['ENTITY_TP'],
-                float(data['TRANSACTION_AMT']),
-                year
-            ))
+    # plain files and .zip/.gz archives, UTF-8 or latin-1
+    for line in iter_lines(data_path):
+        parts = line.strip().split('|')
+        if len(parts) != len(headers):
+            continue
             
-            if len(batch) >= batch_size:
-                c.executemany('''
-                    INSERT INTO contributorsFromCommittees (candidate_id, contributor_name, entity_type, amount, year)
-                    VALUES (?, ?, ?, ?, ?)
-                    ON CONFLICT(candidate_id, contributor_name, year) 
-                    DO UPDATE SET amount = amount + excluded.amount
-                ''', batch)
-                batch = []
+        data = dict(zip(headers, parts))
+        batch.append((
+            data['CAND_ID'],
+            data['NAME'],
+            data['ENTITY_TP'],
+            float(data['TRANSACTION_AMT']),
+            year
+        ))
+        
+        if len(batch) >= batch_size:
+            c.executemany('''
+                INSERT INTO contributorsFromCommittees (candidate_id, contributor_name, entity_type, amount, year)
+                VALUES (?, ?, ?, ?, ?)
+            ''', batch)
+            batch = []
     
     # Insert any remaining records
     if batch:
         c.executemany('''
             INSERT INTO contributorsFromCommittees (candidate_id, contributor_name, entity_type, amount, year)
             VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(candidate_id, contributor_name, year) 
-            DO UPDATE SET amount = amount + excluded.amount
         ''', batch)
     
     conn.commit()
 
+def head_hash(data_path, length):
+    """Hash the first length bytes of a file"""
+    with open(data_path, 'rb') as file:
+        return hashlib.sha1(file.read(length)).hexdigest()
+
+def get_manifest_entry(conn, data_path):
+    """Get the ingest manifest row for a file, or None if it was never loaded"""
+    c = conn.cursor()
+    c.execute('''
+        SELECT year, size, mtime, head_hash, last_offset, max_sub_id
+        FROM ingest_manifest
+        WHERE file_path = ?
+    ''', (os.path.abspath(data_path),))
+    row = c.fetchone()
+    if not row:
+        return None
+    return dict(zip(('year', 'size', 'mtime', 'head_hash', 'last_offset', 'max_sub_id'), row))
+
+def save_checkpoint(conn, data_path, year, offset, max_sub_id):
+    """Record how far a file has been ingested. Does not commit."""
+    stat = os.stat(data_path)
+    conn.execute('''
+        INSERT INTO ingest_manifest (file_path, year, size, mtime, head_hash, last_offset, max_sub_id, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(file_path) DO UPDATE SET
+            year = excluded.year,
+            size = excluded.size,
+            mtime = excluded.mtime,
+            head_hash = excluded.head_hash,
+            last_offset = excluded.last_offset,
+            max_sub_id = excluded.max_sub_id,
+            updated_at = excluded.updated_at
+    ''', (
+        os.path.abspath(data_path),
+        year,
+        stat.st_size,
+        stat.st_mtime,
+        head_hash(data_path, min(HEAD_BYTES, offset)),
+        offset,
+        max_sub_id,
+        datetime.now().isoformat(timespec='seconds')
+    ))
+
+def file_ingest_state(data_path, year, entry):
+    """
+    Compare a file against its manifest entry. Returns 'new', 'rewritten',
+    'appended' or 'unchanged'. An archive that changed at all is 'rewritten',
+    since records appended to the data inside it cannot be found by offset.
+    """
+    if entry is None:
+        return 'new'
+    size = os.path.getsize(data_path)
+    offset = entry['last_offset']
+    if entry['year'] != year or size < offset:
+        return 'rewritten'
+    if head_hash(data_path, min(HEAD_BYTES, offset)) != entry['head_hash']:
+        return 'rewritten'
+    if size == offset:
+        return 'unchanged'
+    if is_archive(data_path):
+        return 'rewritten'
+    return 'appended'
+
+def apply_transaction(c, cmte_id, tran_id, year, sub_id, candidate_id, contributor_name, entity_type, amount,
+                      transaction_date=None, other_id=None, amendment='N'):
+    """
+    Apply a single transaction to the ledger, contributorsFromCommittees and
+    the contribution cubes. amendment is the record's AMNDT_IND.
+
+    If the transaction was already ingested the older record is backed out,
+    under the candidate, contributor and entity type stored with it, before
+    the new amount is added, so amendments replace the amount instead of
+    adding to it. A termination ('T') only backs the transaction out and
+    removes it from the ledger. Records that are not newer than the ledger
+    are ignored, which also makes replaying a partially committed range
+    harmless.
+    """
+    c.execute('''
+        SELECT sub_id, candidate_id, contributor_name, amount, entity_type, transaction_date
+        FROM contribution_ledger
+        WHERE cmte_id = ? AND tran_id = ? AND year = ?
+    ''', (cmte_id, tran_id, year))
+    existing = c.fetchone()
+    if existing and existing[0] >= sub_id:
+        return False
+
+    # the view's insert trigger adds the amount to an existing row
+    upsert = '''
+        INSERT INTO contributorsFromCommittees (candidate_id, contributor_name, entity_type, amount, year)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+    if existing:
+        _, old_candidate_id, old_contributor_name, old_amount, old_entity_type, old_date = existing
+        c.execute(upsert, (old_candidate_id, old_contributor_name, old_entity_type, -old_amount, year))
+        add_to_cubes(c, year, old_date, old_candidate_id, old_contributor_name,
+                     old_entity_type, -old_amount, -1)
+
+    if amendment == TERMINATED:
+        c.execute('''
+            DELETE FROM contribution_ledger
+            WHERE cmte_id = ? AND tran_id = ? AND year = ?
+        ''', (cmte_id, tran_id, year))
+        return existing is not None
+
+    c.execute('''
+        INSERT INTO contribution_ledger
+            (cmte_id, tran_id, year, sub_id, candidate_id, contributor_name, entity_type, amount, transaction_date,
+             other_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(cmte_id, tran_id, year) DO UPDATE SET
+            sub_id = excluded.sub_id,
+            candidate_id = excluded.candidate_id,
+            contributor_name = excluded.contributor_name,
+            entity_type = excluded.entity_type,
+            amount = excluded.amount,
+            transaction_date = excluded.transaction_date,
+            other_id = excluded.other_id
+    ''', (cmte_id, tran_id, year, sub_id, candidate_id, contributor_name, entity_type, amount, transaction_date,
+          other_id))
+    c.execute(upsert, (candidate_id, contributor_name, entity_type, amount, year))
+    add_to_cubes(c, year, transaction_date, candidate_id, contributor_name, entity_type, amount, 1)
+    return True
+
+def ingest_appended_records(data_path, headers, conn, year, entry, checkpoint_rows=CHECKPOINT_ROWS):
+    """
+    Ingest the records written to a file after its last checkpoint.
+
+    The ledger, contributorsFromCommittees and the manifest are committed
+    together every checkpoint_rows records, so a crash resumes from the last
+    committed checkpoint. Returns the number of records applied.
+    """
+    n_columns = len(headers)
+    cand_i, name_i, entity_i, amount_i, cmte_i, tran_i, sub_i, date_i, other_i, amndt_i = column_indexes(
+        headers, ('CAND_ID', 'NAME', 'ENTITY_TP', 'TRANSACTION_AMT', 'CMTE_ID', 'TRAN_ID', 'SUB_ID',
+                  'TRANSACTION_DT', 'OTHER_ID', 'AMNDT_IND'))
+
+    offset = entry['last_offset']
+    max_sub_id = entry['max_sub_id'] or 0
+    applied = 0
+    pending = 0
+    c = conn.cursor()
+    try:
+        for raw_line in iter_mmap_lines(data_path, offset):
+            parts = decode_line(raw_line).strip().split('|')
+            if not raw_line.endswith(b'\n') and len(parts) != n_columns:
+                # partial line that is still being written
+                break
+            offset += len(raw_line)
+            if len(parts) != n_columns:
+                continue
+            try:
+                amount = float(parts[amount_i])
+            except ValueError:
+                continue
+
+            sub_id = parse_sub_id(parts[sub_i])
+            cmte_id, tran_id = transaction_key(parts, cmte_i, tran_i, sub_i)
+            if apply_transaction(c, cmte_id, tran_id, year, sub_id, parts[cand_i], parts[name_i],
+                                 parts[entity_i], amount, parse_transaction_date(parts[date_i]), parts[other_i],
+                                 parts[amndt_i]):
+                applied += 1
+            max_sub_id = max(max_sub_id, sub_id)
+
+            pending += 1
+            if pending >= checkpoint_rows:
+                save_checkpoint(conn, data_path, year, offset, max_sub_id)
+                conn.commit()
+                pending = 0
+
+        save_checkpoint(conn, data_path, year, offset, max_sub_id)
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        conn.rollback()
+        raise
+    return applied
+
+@timed()
+def ingest_contributions(data_files, headers, conn, workers=None):
+    """
+    Bring contributorsFromCommittees up to date with the data files.
+
+    New and rewritten files are bulk loaded in parallel, replacing the rows
+    for their year. Files that only grew since the last run have just the
+    appended records applied, and unchanged files are skipped. The derived
+    industry tables, contribution cubes, contributor search index,
+    contributor entities and committee graph are refreshed afterwards, and
+    the read snapshot is published from the writer database. Returns the bulk
+    load statistics, or None if no file needed a full load.
+    """
+    changed = False
+    full_loads = []
+    stats = None
+    for file_path, year in data_files:
+        entry = get_manifest_entry(conn, file_path)
+        state = file_ingest_state(file_path, year, entry)
+        if state == 'unchanged':
+            print(f"{file_path} is up to date, skipping")
+        elif state == 'appended':
+            print(f"Resuming {file_path} from byte {entry['last_offset']:,}...")
+            applied = ingest_appended_records(file_path, headers, conn, year, entry)
+            print(f"Applied {applied:,} new or amended records for year {year}")
+            changed = changed or applied > 0
+        else:
+            print(f"Loading {file_path} ({state}) for year {year}...")
+            full_loads.append((file_path, year))
+
+    if full_loads:
+        stats = bulk_load_contributions(full_loads, headers, conn, workers=workers, track_transactions=True)
+        c = conn.cursor()
+        for file_path, year in full_loads:
+            c.execute('SELECT MAX(sub_id) FROM contribution_ledger WHERE year = ?', (year,))
+            max_sub_id = c.fetchone()[0] or 0
+            # sizes end after the last complete line of a plain file, so a
+            # partial record is picked up whole by the append path
+            save_checkpoint(conn, file_path, year, stats['sizes'][file_path], max_sub_id)
+        conn.commit()
+        changed = True
+
+    if changed:
+        bump_generation(conn)
+        conn.commit()
+    refresh_contributor_industries(conn)
+    refresh_contribution_cubes(conn)
+    refresh_candidate_index(conn)
+    refresh_senate_candidates(conn)
+    refresh_contributor_search(conn)
+    refresh_contributor_entities(conn)
+    refresh_committee_graph(conn)
+    publish_snapshot(conn)
+    return stats
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load FEC committee contributions into politicaldata.db')
+    parser.add_argument('--workers', type=int, default=None, help='number of parser processes')
+    parser.add_argument('--rebuild', action='store_true', help='drop existing data and reload every file')
+    parser.add_argument('--reports', action='store_true', help='rebuild the static reports afterwards')
+    args = parser.parse_args()
+    
     # initialize database
-    conn = init_db()
+    conn = init_db(reset=args.rebuild)
     
-    # load data into database (only need to do this once)
-    headers = load_headers('../assets/data/contributions-from-committees/con-from-com-header.csv')
+    # load data into database
+    headers = load_headers(os.path.join(DATA_DIR, 'con-from-com-header.csv'))
     
-    # define the data files and their corresponding years
+    # define the data files and their corresponding years; each can also be
+    # the .zip or .gz archive as downloaded from the FEC
     data_files = [
-        ('../assets/data/contributions-from-committees/con-from-com-21-22.txt', 2021),
-        ('../assets/data/contributions-from-committees/con-from-com-23-24.txt', 2023),
-        ('../assets/data/contributions-from-committees/con-from-com-25-26.txt', 2025)
+        (find_data_file(os.path.join(DATA_DIR, 'con-from-com-21-22')), 2021),
+        (find_data_file(os.path.join(DATA_DIR, 'con-from-com-23-24')), 2023),
+        (find_data_file(os.path.join(DATA_DIR, 'con-from-com-25-26')), 2025)
     ]
     
-    # Load each file with its corresponding year
-    for file_path, year in data_files:
-        print(f"Loading data for year {year}...")
-        load_contributions_to_db(file_path, headers, conn, year)
+    # only load what changed since the last run
+    ingest_contributions(data_files, headers, conn, workers=args.workers)
     
     # Close database connection
     conn.close()
+
+    if args.reports:
+        build_reports(workers=args.workers)
@@ -0,0 +1,414 @@
+"""
+Opt-in timing for the service functions and the SQL they run.
+
+Set SERVICES_INSTRUMENTATION=1 (or call enable() before the first
+connection is opened) to turn it on. When it is off, timed functions only
+pay a flag check and connections are plain sqlite3 connections.
+
+When enabled:
+- functions decorated with @timed() get a latency histogram
+- connections from database.connect() are InstrumentedConnections, which
+  record time, rows returned and vm_steps per statement, and capture
+  EXPLAIN QUERY PLAN the first time a statement is slower than
+  SLOW_STATEMENT_MS
+- vm_steps counts VDBE opcodes from a progress handler, in units of
+  PROGRESS_STEPS. It is a measure of work done, not of rows scanned;
+  Python's sqlite3 has no sqlite3_stmt_status, so full scans are flagged
+  from the captured plan instead
+- with SERVICES_METRICS_DIR set, services-<pid>.json and
+  services-<pid>.prom (Prometheus textfile format) are written there every
+  EXPORT_INTERVAL seconds and at exit
+"""
+import atexit
+import bisect
+import functools
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+ENABLED = os.environ.get('SERVICES_INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+METRICS_DIR = os.environ.get('SERVICES_METRICS_DIR')
+
+SLOW_STATEMENT_MS = float(os.environ.get('SERVICES_SLOW_STATEMENT_MS', 50))
+EXPORT_INTERVAL = float(os.environ.get('SERVICES_METRICS_INTERVAL', 30))
+
+# VDBE opcodes between progress handler calls, the resolution of vm_steps
+PROGRESS_STEPS = 1000
+
+# histogram bucket upper bounds in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_PREFIX = 'openpocket'
+
+WHITESPACE = re.compile(r'\s+')
+
+# plan lines that read a whole table or index; subqueries and virtual
+# tables (json_each, FTS5 MATCH) are not counted
+FULL_SCAN = re.compile(r'SCAN (?!\()\S+(?! VIRTUAL TABLE)( USING (COVERING )?INDEX \S+)?$')
+
+_lock = threading.Lock()
+_functions = {}
+_statements = {}
+_last_export = time.monotonic()
+
+class Histogram:
+    """Cumulative-bucket latency histogram, Prometheus style"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given quantile"""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (self.max,), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': round(self.total * 1000, 3),
+            'mean_ms': round(self.total * 1000 / self.count, 4) if self.count else None,
+            'p50_ms': round(self.quantile(0.5) * 1000, 4) if self.count else None,
+            'p99_ms': round(self.quantile(0.99) * 1000, 4) if self.count else None,
+            'max_ms': round(self.max * 1000, 4),
+            'buckets': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'], self.counts)),
+        }
+
+class StatementStats:
+    """Aggregated measurements for one normalized SQL statement"""
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.id = hashlib.sha1(sql.encode()).hexdigest()[:12]
+        self.histogram = Histogram()
+        self.rows = 0
+        self.vm_steps = 0
+        self.plan = None
+        self.plan_params = None
+
+    @property
+    def full_scan(self):
+        """Whether the plan walks a whole table or index, e.g. for a LIKE '%...%'"""
+        return bool(self.plan) and any(FULL_SCAN.match(detail) for detail in self.plan)
+
+    def to_dict(self):
+        result = {
+            'id': self.id,
+            'sql': self.sql,
+            'rows': self.rows,
+            'vm_steps': self.vm_steps,
+            'full_scan': self.full_scan,
+            'plan': self.plan,
+        }
+        result.update(self.histogram.to_dict())
+        return result
+
+def enable(metrics_dir=None):
+    """Turn instrumentation on for connections opened from now on"""
+    global ENABLED, METRICS_DIR
+    ENABLED = True
+    if metrics_dir:
+        METRICS_DIR = metrics_dir
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+def enabled():
+    return ENABLED
+
+def reset():
+    """Forget everything recorded so far"""
+    with _lock:
+        _functions.clear()
+        _statements.clear()
+
+def record_function(name, seconds):
+    """Add one call of a service function to its histogram"""
+    with _lock:
+        histogram = _functions.get(name)
+        if histogram is None:
+            histogram = _functions[name] = Histogram()
+        histogram.observe(seconds)
+    maybe_export()
+
+def timed(name=None):
+    """Decorator recording the function's latency when instrumentation is on"""
+    def decorator(function):
+        label = name or f'{function.__module__}.{function.__qualname__}'
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record_function(label, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+def normalize_sql(sql):
+    return WHITESPACE.sub(' ', sql).strip()
+
+def record_statement(conn, sql, params, seconds, rows, vm_steps):
+    """Add one execution of a statement; explains it the first time it is slow"""
+    key = normalize_sql(sql)
+    with _lock:
+        stats = _statements.get(key)
+        if stats is None:
+            stats = _statements[key] = StatementStats(key)
+        stats.histogram.observe(seconds)
+        stats.rows += max(rows, 0)
+        stats.vm_steps += vm_steps
+        explain = stats.plan is None and seconds * 1000 >= SLOW_STATEMENT_MS and params is not None
+        if explain:
+            stats.plan = []
+    if explain:
+        stats.plan = explain_query_plan(conn, sql, params)
+        stats.plan_params = repr(params)[:200]
+    maybe_export()
+
+def explain_query_plan(conn, sql, params):
+    """EXPLAIN QUERY PLAN details for a statement, on an uninstrumented cursor"""
+    try:
+        cursor = sqlite3.Cursor(conn)
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[3] for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        return [f'unavailable: {e}']
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor that measures each statement from execute until its results are
+    exhausted, including the time spent fetching rows.
+    """
+
+    _pending = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pending = None
+
+    def _start(self, sql, params):
+        self._finish()
+        self._pending = [sql, params, 0.0, 0, self.connection.vm_steps]
+
+    def _add(self, seconds, rows):
+        if self._pending is not None:
+            self._pending[2] += seconds
+            self._pending[3] += rows
+
+    def _finish(self):
+        pending = self._pending
+        if pending is None:
+            return
+        self._pending = None
+        sql, params, seconds, rows, steps_before = pending
+        record_statement(self.connection, sql, params, seconds, rows,
+                         self.connection.vm_steps - steps_before)
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._add(time.perf_counter() - started, 0)
+            if self.description is None:
+                # nothing to fetch
+                self._finish()
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start(sql, None)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._add(time.perf_counter() - started, self.rowcount)
+            self._finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._add(time.perf_counter() - started, row is not None)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._add(time.perf_counter() - started, len(rows))
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._add(time.perf_counter() - started, len(rows))
+        self._finish()
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._add(time.perf_counter() - started, 0)
+            self._finish()
+            raise
+        self._add(time.perf_counter() - started, 1)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection factory whose cursors are InstrumentedCursors"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.vm_steps = 0
+        self.set_progress_handler(self._progress, PROGRESS_STEPS)
+
+    def _progress(self):
+        self.vm_steps += PROGRESS_STEPS
+        return 0
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def connection_factory():
+    """Connection class for sqlite3.connect(factory=...)"""
+    return InstrumentedConnection if ENABLED else sqlite3.Connection
+
+def snapshot():
+    """Everything recorded so far, statements sorted by total time"""
+    with _lock:
+        functions = {name: histogram.to_dict() for name, histogram in sorted(_functions.items())}
+        statements = sorted((stats.to_dict() for stats in _statements.values()),
+                            key=lambda stats: stats['total_ms'], reverse=True)
+    return {
+        'pid': os.getpid(),
+        'generated_at': time.time(),
+        'slow_statement_ms': SLOW_STATEMENT_MS,
+        'functions': functions,
+        'statements': statements,
+    }
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+def histogram_lines(metric, labels, histogram):
+    cumulative = 0
+    lines = []
+    for bound, count in zip([str(bound) for bound in BUCKETS] + ['+Inf'], histogram['buckets'].values()):
+        cumulative += count
+        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{metric}_sum{{{labels}}} {histogram["total_ms"] / 1000}')
+    lines.append(f'{metric}_count{{{labels}}} {histogram["count"]}')
+    return lines
+
+def to_prometheus(data=None):
+    """Render a snapshot in the Prometheus text exposition format"""
+    data = data or snapshot()
+    pid = data['pid']
+    function_metric = f'{METRIC_PREFIX}_function_duration_seconds'
+    statement_metric = f'{METRIC_PREFIX}_sql_statement_duration_seconds'
+    lines = [
+        f'# HELP {function_metric} Service function latency.',
+        f'# TYPE {function_metric} histogram',
+    ]
+    for name, histogram in data['functions'].items():
+        lines += histogram_lines(function_metric, f'pid="{pid}",function="{escape_label(name)}"', histogram)
+
+    lines += [
+        f'# HELP {statement_metric} SQL statement latency including fetching its rows.',
+        f'# TYPE {statement_metric} histogram',
+    ]
+    for stats in data['statements']:
+        lines += histogram_lines(statement_metric, f'pid="{pid}",statement="{stats["id"]}"', stats)
+
+    for name, help_text, field in (
+        ('sql_rows_total', 'Rows returned or changed by the statement.', 'rows'),
+        ('sql_vm_steps_total', f'SQLite VDBE opcodes run by the statement, in steps of {PROGRESS_STEPS}. Not rows scanned.', 'vm_steps'),
+    ):
+        lines += [f'# HELP {METRIC_PREFIX}_{name} {help_text}', f'# TYPE {METRIC_PREFIX}_{name} counter']
+        for stats in data['statements']:
+            lines.append(f'{METRIC_PREFIX}_{name}{{pid="{pid}",statement="{stats["id"]}"}} {stats[field]}')
+
+    lines += [f'# HELP {METRIC_PREFIX}_sql_statement_info Statement text and whether its plan scans a table.',
+              f'# TYPE {METRIC_PREFIX}_sql_statement_info gauge']
+    for stats in data['statements']:
+        lines.append(f'{METRIC_PREFIX}_sql_statement_info{{pid="{pid}",statement="{stats["id"]}",'
+                     f'full_scan="{str(stats["full_scan"]).lower()}",sql="{escape_label(stats["sql"][:200])}"}} 1')
+    return '\n'.join(lines) + '\n'
+
+def write_atomic(path, text):
+    """Write via a temp file and rename, so collectors never see a partial file"""
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as file:
+        file.write(text)
+    os.replace(temp_path, path)
+
+def write_json(path):
+    write_atomic(path, json.dumps(snapshot(), indent=2))
+
+def write_prometheus(path):
+    write_atomic(path, to_prometheus())
+
+def export(metrics_dir=None):
+    """Write services-<pid>.json and services-<pid>.prom to the metrics directory"""
+    global _last_export
+    metrics_dir = metrics_dir or METRICS_DIR
+    if not metrics_dir:
+        return
+    _last_export = time.monotonic()
+    os.makedirs(metrics_dir, exist_ok=True)
+    data = snapshot()
+    base = os.path.join(metrics_dir, f'services-{os.getpid()}')
+    write_atomic(f'{base}.json', json.dumps(data, indent=2))
+    write_atomic(f'{base}.prom', to_prometheus(data))
+
+def maybe_export():
+    """Export if a metrics directory is set and the last export is old enough"""
+    if METRICS_DIR and time.monotonic() - _last_export >= EXPORT_INTERVAL:
+        export()
+
+@atexit.register
+def _export_at_exit():
+    if ENABLED and METRICS_DIR and (_functions or _statements):
+        export()
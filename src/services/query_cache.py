@@ -0,0 +1,146 @@
+import functools
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from database import VersionCheck, get_db_connection
+from ingest_state import get_generation
+
+MAX_ENTRIES = int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', 2048))
+MAX_BYTES = int(float(os.environ.get('QUERY_CACHE_MAX_MB', 64)) * 1024 * 1024)
+TTL_SECONDS = float(os.environ.get('QUERY_CACHE_TTL', 600))
+
+def estimate_size(value):
+    """Rough size in bytes of a query result made of lists/tuples of scalars"""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            size += estimate_size(item)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key) + estimate_size(item)
+    return size
+
+class QueryCache:
+    """
+    Bounded LRU cache with a TTL for query results.
+
+    Entries are dropped when either max_entries or max_bytes is exceeded
+    (least recently used first), when they are older than ttl seconds, and
+    all at once when the ingest generation in the database changes.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, ttl=TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._generation = VersionCheck(lambda: get_generation(get_db_connection()))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_generation(self):
+        """Clear the cache if an ingest happened since the last check"""
+        if self._generation.changed() and self._entries:
+            self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def get(self, key):
+        """Return (True, value) for a live entry, (False, None) otherwise"""
+        now = time.monotonic()
+        with self._lock:
+            self._check_generation()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            value, size, stored_at = entry
+            if now - stored_at > self.ttl:
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def put(self, key, value):
+        """Store a value, evicting least recently used entries to stay in bounds"""
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._check_generation()
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size, now)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Counters for sizing the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'generation': self._generation.version,
+            }
+
+_cache = QueryCache()
+
+def cached_query(name):
+    """
+    Cache a function(candidate_id, year=None, conn=None) on
+    (name, candidate_id, year). Calls with an explicit connection bypass the
+    cache since it may point at a different database. Results are stored as
+    tuples and handed out as fresh lists.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(candidate_id, year=None, conn=None):
+            if conn is not None:
+                return function(candidate_id, year, conn)
+            key = (name, candidate_id, year)
+            found, value = _cache.get(key)
+            if not found:
+                value = tuple(function(candidate_id, year))
+                _cache.put(key, value)
+            return list(value)
+        return wrapper
+    return decorator
+
+def cache_stats():
+    """Hit/miss/eviction counters of the shared query cache"""
+    return _cache.stats()
+
+def clear_cache():
+    """Empty the shared query cache"""
+    _cache.clear()
@@ -1,79 +1,180 @@
-from candidate_functions import search_candidate, candidate_info
-import sqlite3
+import base64
+import json
+from collections import namedtuple
+from database import get_db_connection
+from query_cache import cached_query
+from instrumentation import timed, explain_query_plan
 
-def get_db_connection():
-    """Get a connection to the SQLite database with proper error handling"""
+# rows pulled from sqlite per fetchmany call while streaming
+FETCH_SIZE = 1000
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+ContributorRecord = namedtuple('ContributorRecord', ['contributor_name', 'amount', 'year'])
+
+# next_cursor is None on the last page
+ContributorPage = namedtuple('ContributorPage', ['records', 'next_cursor'])
+
+# the index contributors_sql seeks on, see compact_schema.FACT_INDEXES
+PAGE_INDEX = 'idx_facts_candidate_year_amount'
+
+def contributors_sql(year=None, after=None, limit=None):
+    """
+    Build the contributors query for one candidate. Rows are ordered by
+    (year, amount, contributor_name) descending, which is unique per
+    candidate. idx_facts_candidate_year_amount covers (year, amount), so
+    after can be the last key of the previous page and the query seeks
+    straight to it; only rows tied on amount are sorted by name.
+    """
+    conditions = ["candidate_id = ?", "entity_type != 'IND'"]
+    if year:
+        conditions.append("year = ?")
+    if after:
+        conditions.append("(year, amount, contributor_name) < (?, ?, ?)")
+    sql = f'''
+        SELECT contributor_name, amount, year
+        FROM contributorsFromCommittees
+        WHERE {' AND '.join(conditions)}
+        ORDER BY year DESC, amount DESC, contributor_name DESC
+    '''
+    if limit:
+        sql += f' LIMIT {int(limit)}'
+    return sql
+
+def contributors_params(candidate_id, year=None, after=None):
+    """Parameters matching contributors_sql"""
+    params = [candidate_id]
+    if year:
+        params.append(year)
+    if after:
+        params.extend(after)
+    return params
+
+def encode_cursor(record):
+    """Opaque page cursor pointing after record"""
+    key = json.dumps([record.year, record.amount, record.contributor_name])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+def decode_cursor(cursor):
+    """
+    Turn a cursor from encode_cursor back into a (year, amount, contributor_name)
+    key. Raises ValueError for anything encode_cursor could not have produced.
+    """
     try:
-        return sqlite3.connect('politicaldata.db', timeout=20)
-    except sqlite3.OperationalError as e:
-        print(f"Database error: {e}")
-        raise
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(key, list) or len(key) != 3:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    year, amount, contributor_name = key
+    # bool is an int subclass, but json true is never a year or an amount
+    if (type(year) is not int or type(amount) not in (int, float)
+            or not isinstance(contributor_name, str)):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return year, amount, contributor_name
+
+def page_query_plan(candidate_id, year=None, after=None, conn=None):
+    """
+    EXPLAIN QUERY PLAN details for the query contributors_page runs, and
+    whether it seeks on PAGE_INDEX
+    """
+    if conn is None:
+        conn = get_db_connection()
+
+    plan = explain_query_plan(conn, contributors_sql(year, after, PAGE_SIZE + 1),
+                              contributors_params(candidate_id, year, after))
+    return plan, any(PAGE_INDEX in detail for detail in plan)
+
+@timed()
+@cached_query('contributors')
+def fetch_contributors(candidate_id, year=None, conn=None):
+    """
+    Non-individual contributors to a candidate as (contributor_name, amount, year)
+    rows, largest first. Without a year all years are returned, newest first.
+    Results are cached until the next ingest; use iter_contributors or
+    contributors_page for candidates with many contributors.
+    """
+    if conn is None:
+        conn = get_db_connection()
+
+    c = conn.cursor()
+    c.execute(contributors_sql(year), contributors_params(candidate_id, year))
+    return c.fetchall()
+
+def iter_contributors(candidate_id, year=None, conn=None, batch_size=FETCH_SIZE):
+    """
+    Stream contributors to a candidate as ContributorRecords in the same
+    order as fetch_contributors, holding at most batch_size rows at a time.
+    """
+    if conn is None:
+        conn = get_db_connection()
+
+    c = conn.cursor()
+    c.execute(contributors_sql(year), contributors_params(candidate_id, year))
+    try:
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield ContributorRecord._make(row)
+    finally:
+        c.close()
+
+@timed()
+def contributors_page(candidate_id, year=None, cursor=None, limit=PAGE_SIZE, conn=None):
+    """
+    One page of contributors to a candidate as a ContributorPage. Pass the
+    previous page's next_cursor to continue; pages stay cheap however deep
+    they go since they seek on the index instead of using OFFSET.
+    """
+    if conn is None:
+        conn = get_db_connection()
+
+    year = int(year) if year else None
+    limit = max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+    after = decode_cursor(cursor) if cursor else None
+
+    c = conn.cursor()
+    # one extra row tells us whether there is another page
+    c.execute(contributors_sql(year, after, limit + 1), contributors_params(candidate_id, year, after))
+    records = [ContributorRecord._make(row) for row in c.fetchall()]
+    next_cursor = None
+    if len(records) > limit:
+        records = records[:limit]
+        next_cursor = encode_cursor(records[-1])
+    return ContributorPage(records, next_cursor)
 
 def query_contributors(candidate_id, conn=None):
     """Query contributorsFromCommittees for a specific candidate from the database"""
     if not candidate_id:
         print("No candidate ID provided")
         return
-        
-    should_close = False
-    if conn is None:
-        conn = get_db_connection()
-        should_close = True
-        
-    try:
-        c = conn.cursor()
-        c.execute('''
-            SELECT contributor_name, amount, year
-            FROM contributorsFromCommittees
-            WHERE candidate_id = ? AND entity_type != 'IND'
-            ORDER BY year DESC, amount DESC
-        ''', (candidate_id,))
-        
-        results = c.fetchall()
-        if not results:
-            print(f"No contributors found for candidate ID {candidate_id}")
-            return
-        
+
+    contributors = fetch_contributors(candidate_id, conn=conn)
+    if contributors:
         print(f"\nContributors to Candidate ID {candidate_id}:")
-        for contributor, amount, year in results:
-            print(f"{year}: {contributor}: ${amount:,.2f}")
-            
-    finally:
-        if should_close:
-            conn.close()
+        for contributor_name, amount, year in contributors:
+            print(f"{year}: {contributor_name}: ${amount:,.2f}")
+    else:
+        print(f"No contributors found for candidate ID {candidate_id}")
+        
 
 def query_contributors_by_year(candidate_id, year, conn=None):
     """Query contributors for a specific candidate and year"""
     if not candidate_id:
         print("No candidate ID provided")
         return
-        
-    should_close = False
-    if conn is None:
-        conn = get_db_connection()
-        should_close = True
-        
-    try:
-        c = conn.cursor()
-        c.execute('''
-            SELECT contributor_name, amount
-            FROM contributorsFromCommittees
-            WHERE candidate_id = ? AND entity_type != 'IND' AND year = ?
-            ORDER BY amount DESC
-        ''', (candidate_id, year))
-        
-        results = c.fetchall()
-        if not results:
-            print(f"No contributors found for candidate ID {candidate_id} in year {year}")
-            return
-        
+
+    contributors = fetch_contributors(candidate_id, year, conn)
+    if contributors:
         print(f"\nContributors to Candidate ID {candidate_id} in {year}:")
-        for contributor, amount in results:
-            print(f"{contributor}: ${amount:,.2f}")
-            
-    finally:
-        if should_close:
-            conn.close()
+        for contributor_name, amount, _ in contributors:
+            print(f"{contributor_name}: ${amount:,.2f}")
+    else:
+        print(f"No contributors found for candidate ID {candidate_id} in year {year}")
+        
 
 
 if __name__ == "__main__":
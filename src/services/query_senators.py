@@ -1,100 +1,133 @@
-import sqlite3
 import json
+import os
+import threading
+from database import VersionCheck, get_db_connection
+from candidate_index import load_senate_candidates
+from candidate_functions import getCandidateIdsByNames
+from instrumentation import timed
 
-def get_db_connection():
-    """Get a connection to the SQLite database with proper error handling"""
-    try:
-        return sqlite3.connect('politicaldata.db', timeout=20)
-    except sqlite3.OperationalError as e:
-        print(f"Database error: {e}")
-        raise
+# spellings of the same party in the senate table, FEC codes and requests
+PARTY_CODES = {
+    'D': 'DEM', 'DEMOCRAT': 'DEM', 'DEMOCRATIC': 'DEM',
+    'R': 'REP', 'REPUBLICAN': 'REP',
+    'I': 'IND', 'INDEPENDENT': 'IND',
+}
 
-def get_all_senators(conn=None):
-    """Get all senators from the database"""
-    should_close = False
+def party_code(party):
+    """Normalize 'Democratic Party', 'Democrat', 'D' and 'DEM' to one code"""
+    key = (party or '').strip().upper()
+    if key.endswith(' PARTY'):
+        key = key[:-len(' PARTY')].strip()
+    return PARTY_CODES.get(key, key)
+
+def senator_from_row(senator):
+    return {
+        'id': senator[0],
+        'name': senator[1],
+        'party': senator[2],
+        'state': senator[3],
+        'photoUrl': senator[4],
+        'phones': json.loads(senator[5]) if senator[5] else []
+    }
+
+def copy_senators(senators):
+    """Copies for callers, so nobody can change the shared roster"""
+    return [dict(senator, phones=list(senator['phones'])) for senator in senators]
+
+class Roster:
+    """
+    Snapshot of the senate table, ordered by state and name, with lookups by
+    id, name, state and party and each senator's CAND_ID.
+    """
+
+    def __init__(self, rows, candidate_ids):
+        self.senators = [senator_from_row(row) for row in rows]
+        self.by_id = {senator['id']: senator for senator in self.senators}
+        self.by_name = {}
+        self.by_state = {}
+        self.by_party = {}
+        for senator in self.senators:
+            self.by_name.setdefault((senator['name'] or '').lower(), senator)
+            self.by_state.setdefault(senator['state'], []).append(senator)
+            self.by_party.setdefault(party_code(senator['party']), []).append(senator)
+        self.candidate_ids = candidate_ids
+
+    def party(self, party):
+        """Senators of a party, given any spelling party_code understands"""
+        return self.by_party.get(party_code(party), [])
+
+    def candidate_id(self, senator_name):
+        senator = self.by_name.get(senator_name.lower())
+        return self.candidate_ids.get(senator['id']) if senator else None
+
+def load_roster(conn):
+    c = conn.cursor()
+    c.execute('SELECT * FROM senate ORDER BY state, name')
+    rows = c.fetchall()
+    candidate_ids = load_senate_candidates(conn)
+    if candidate_ids is None:
+        # not stored yet or stale, resolve once for this snapshot
+        names = getCandidateIdsByNames([row[1] for row in rows], conn, office='S')
+        candidate_ids = {row[0]: names[row[1]] for row in rows}
+    return Roster(rows, candidate_ids)
+
+def database_path(conn):
+    return conn.execute('PRAGMA database_list').fetchone()[2]
+
+def file_version(path):
+    """Modification time and size of the database and its WAL, which change on every commit"""
+    if not path:
+        return None
+    version = []
+    for name in (path, path + '-wal'):
+        try:
+            stat = os.stat(name)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            version.append(None)
+    return tuple(version)
+
+# database path -> [roster, VersionCheck on the file version]
+_rosters = {}
+_lock = threading.Lock()
+
+@timed()
+def get_roster(conn=None):
+    """
+    The senate roster of a database, loaded once and reloaded when the
+    database file changed.
+    """
     if conn is None:
         conn = get_db_connection()
-        should_close = True
-        
-    try:
-        c = conn.cursor()
-        c.execute('SELECT * FROM senate ORDER BY state, name')
-        senators = c.fetchall()
-        
-        # Convert to a list of dictionaries for easier handling
-        result = []
-        for senator in senators:
-            result.append({
-                'id': senator[0],
-                'name': senator[1],
-                'party': senator[2],
-                'state': senator[3],
-                'photoUrl': senator[4],
-                'phones': json.loads(senator[5]) if senator[5] else []
-            })
-        
-        return result
-    finally:
-        if should_close:
-            conn.close()
+    path = database_path(conn)
+    with _lock:
+        cached = _rosters.get(path)
+        if cached is None:
+            cached = _rosters[path] = [None, VersionCheck(file_version)]
+        if cached[1].changed(path) or cached[0] is None:
+            cached[0] = load_roster(conn)
+        return cached[0]
+
+def clear_roster_cache():
+    with _lock:
+        _rosters.clear()
+
+@timed()
+def get_all_senators(conn=None):
+    """Get all senators from the database"""
+    return copy_senators(get_roster(conn).senators)
 
 def get_senators_by_state(state, conn=None):
     """Get senators for a specific state"""
-    should_close = False
-    if conn is None:
-        conn = get_db_connection()
-        should_close = True
-        
-    try:
-        c = conn.cursor()
-        c.execute('SELECT * FROM senate WHERE state = ? ORDER BY name', (state,))
-        senators = c.fetchall()
-        
-        # Convert to a list of dictionaries for easier handling
-        result = []
-        for senator in senators:
-            result.append({
-                'id': senator[0],
-                'name': senator[1],
-                'party': senator[2],
-                'state': senator[3],
-                'photoUrl': senator[4],
-                'phones': json.loads(senator[5]) if senator[5] else []
-            })
-        
-        return result
-    finally:
-        if should_close:
-            conn.close()
+    return copy_senators(get_roster(conn).by_state.get(state, []))
 
 def get_senators_by_party(party, conn=None):
     """Get senators for a specific party"""
-    should_close = False
-    if conn is None:
-        conn = get_db_connection()
-        should_close = True
-        
-    try:
-        c = conn.cursor()
-        c.execute('SELECT * FROM senate WHERE party LIKE ? ORDER BY state, name', (f'%{party}%',))
-        senators = c.fetchall()
-        
-        # Convert to a list of dictionaries for easier handling
-        result = []
-        for senator in senators:
-            result.append({
-                'id': senator[0],
-                'name': senator[1],
-                'party': senator[2],
-                'state': senator[3],
-                'photoUrl': senator[4],
-                'phones': json.loads(senator[5]) if senator[5] else []
-            })
-        
-        return result
-    finally:
-        if should_close:
-            conn.close()
+    return copy_senators(get_roster(conn).party(party))
+
+def get_senator_candidate_ids(conn=None):
+    """Map of senator id -> CAND_ID (or None) for every senator"""
+    return dict(get_roster(conn).candidate_ids)
 
 def print_senator_info(senator):
     """Print formatted information about a senator"""
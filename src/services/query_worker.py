@@ -0,0 +1,115 @@
+"""
+Long-lived worker that serves service function calls for server.js.
+
+Reads one JSON request per line from stdin:
+    {"id": 1, "function": "candidate_functions.candidate_info", "args": ["S0ME00001"]}
+and writes one JSON response per line to stdout:
+    {"id": 1, "result": ...} or {"id": 1, "error": "..."}
+
+Modules are imported once at startup, so calls don't pay interpreter
+startup and import costs. Functions can be named as "module.function";
+bare names are looked up in candidate_functions, like runPythonFunction
+always did. Only the functions listed in SERVICE_FUNCTIONS can be called,
+so ingest writers such as the refresh_* functions are never reachable.
+"""
+import importlib
+import json
+import os
+import sys
+import time
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import instrumentation
+
+# the functions each module exports to server.js; nothing else can be called
+SERVICE_FUNCTIONS = {
+    'candidate_functions': ['getCandidateIdByName', 'getCandidateIdsByNames', 'get_candidate_name',
+                            'candidate_info'],
+    'committee_graph': ['committee_flows'],
+    'congress_client': ['senator_activity', 'members_activity'],
+    'contribute': ['get_contributions_by_candidate', 'top_contributors_by_candidate',
+                   'industry_totals_by_candidate'],
+    'contribution_cubes': ['industry_totals_between', 'industry_money_before', 'candidate_industries_between',
+                           'industry_trend'],
+    'contribution_matrix': ['top_candidates_for_industry', 'top_industries_for_candidate'],
+    'contributor_search': ['search_contributors', 'keyword_candidate_totals'],
+    'query_cache': ['cache_stats'],
+    'query_contributors': ['fetch_contributors', 'contributors_page'],
+    'query_senators': ['get_all_senators', 'get_senators_by_state', 'get_senators_by_party',
+                       'get_senator_candidate_ids'],
+    'senator_contributors': ['find_senator_contributors', 'senator_contributors_page', 'analyze_senators'],
+}
+SERVICE_MODULES = list(SERVICE_FUNCTIONS)
+
+DEFAULT_MODULE = 'candidate_functions'
+
+def load_modules():
+    """Import the service modules, skipping any that fail to import"""
+    modules = {}
+    for name in SERVICE_MODULES:
+        try:
+            modules[name] = importlib.import_module(name)
+        except Exception as e:
+            print(f"query_worker: could not import {name}: {e}", file=sys.stderr)
+    return modules
+
+def resolve_function(modules, function_name):
+    """Find the callable for a request, raising ValueError if it is not exported"""
+    module_name, _, attribute = function_name.rpartition('.')
+    module = modules.get(module_name or DEFAULT_MODULE)
+    if module is None:
+        raise ValueError(f"Unknown module for function: {function_name}")
+    if attribute not in SERVICE_FUNCTIONS[module.__name__]:
+        raise ValueError(f"Unknown function: {function_name}")
+    return getattr(module, attribute)
+
+def to_json(value):
+    """Send namedtuples such as query_contributors.ContributorRecord as objects"""
+    if hasattr(value, '_asdict'):
+        return {key: to_json(item) for key, item in value._asdict().items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    return value
+
+def handle_request(modules, request):
+    """Run a single request and build its response"""
+    response = {'id': request.get('id')}
+    try:
+        function = resolve_function(modules, request.get('function', ''))
+    except ValueError as e:
+        response['error'] = str(e)
+        return response
+    started = time.perf_counter()
+    try:
+        response['result'] = to_json(function(*request.get('args', [])))
+    except Exception as e:
+        traceback.print_exc(file=sys.stderr)
+        response['error'] = str(e)
+    if instrumentation.enabled():
+        instrumentation.record_function(f"request:{request['function']}", time.perf_counter() - started)
+    return response
+
+def serve(stdin, stdout):
+    """Serve requests until stdin is closed"""
+    modules = load_modules()
+    for line in stdin:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            response = {'id': None, 'error': f"Invalid request: {e}"}
+        else:
+            response = handle_request(modules, request)
+        stdout.write(json.dumps(response, default=str) + '\n')
+        stdout.flush()
+
+if __name__ == "__main__":
+    # service functions print diagnostics, keep those off the protocol stream
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr
+    serve(sys.stdin, protocol_out)
@@ -1,127 +1,155 @@
-import sqlite3
 import json
-from query_senators import get_senators_by_state, get_senators_by_party, get_all_senators
+from database import get_db_connection
+from query_senators import get_senators_by_state, get_senators_by_party, get_all_senators, get_roster
 from candidate_functions import getCandidateIdByName
+from query_contributors import fetch_contributors, iter_contributors, contributors_page, ContributorPage, PAGE_SIZE
+from instrumentation import timed
 
+def senator_candidate_id(senator_name):
+    """CAND_ID from the roster's stored mapping, searching candidates for names not in the roster"""
+    roster = get_roster()
+    if senator_name.lower() in roster.by_name:
+        return roster.candidate_id(senator_name)
+    return getCandidateIdByName(senator_name)
 
-def get_db_connection():
-    """Get a connection to the SQLite database with proper error handling"""
-    try:
-        return sqlite3.connect('politicaldata.db', timeout=20)
-    except sqlite3.OperationalError as e:
-        print(f"Database error: {e}")
-        raise
-
+@timed()
 def find_senator_contributors(senator_name, year=None, conn=None):
     """
     Find contributors for a senator by searching for their candidate ID
     and then querying the contributors table
     """
-    should_close = False
-    if conn is None:
-        conn = get_db_connection()
-        should_close = True
+    # First, search for the candidate ID using the senator's name
+    candidate_id = senator_candidate_id(senator_name)
     
-    try:
-        # First, search for the candidate ID using the senator's name
-        candidate_id = getCandidateIdByName(senator_name)
-        
-        if not candidate_id:
-            print(f"No candidate found with name: {senator_name}")
-            return []
-        
-        # Now query the contributors table
-        c = conn.cursor()
-        if year:
-            c.execute('''
-                SELECT contributor_name, amount, year
-                FROM contributorsFromCommittees
-                WHERE candidate_id = ? AND year = ? AND entity_type != 'IND'
-                ORDER BY amount DESC
-            ''', (candidate_id, year))
-        else:
-            c.execute('''
-                SELECT contributor_name, amount, year
-                FROM contributorsFromCommittees
-                WHERE candidate_id = ? AND entity_type != 'IND'
-                ORDER BY year DESC, amount DESC
-            ''', (candidate_id,))
-        
-        results = c.fetchall()
-        return results
-    finally:
-        if should_close:
-            conn.close()
+    if not candidate_id:
+        print(f"No candidate found with name: {senator_name}")
+        return []
+    
+    # Now query the contributors table, cached per candidate and year
+    return fetch_contributors(candidate_id, year, conn)
+
+def iter_senator_contributors(senator_name, year=None, conn=None):
+    """Stream a senator's contributors as ContributorRecords without loading them all"""
+    candidate_id = senator_candidate_id(senator_name)
+    if not candidate_id:
+        print(f"No candidate found with name: {senator_name}")
+        return iter(())
+    return iter_contributors(candidate_id, year, conn)
+
+def senator_contributors_page(senator_name, year=None, cursor=None, limit=PAGE_SIZE, conn=None):
+    """One ContributorPage of a senator's contributors, see contributors_page"""
+    candidate_id = senator_candidate_id(senator_name)
+    if not candidate_id:
+        print(f"No candidate found with name: {senator_name}")
+        return ContributorPage([], None)
+    return contributors_page(candidate_id, year, cursor, limit, conn)
 
 def print_senator_contributors(senator_name, year=None):
     """Print contributors for a specific senator"""
-    results = find_senator_contributors(senator_name, year)
-    
-    if not results:
+    found = False
+    for record in iter_senator_contributors(senator_name, year):
+        if not found:
+            print(f"\nContributors to Senator {senator_name}:")
+            found = True
+        print(f"{record.year}: {record.contributor_name}: ${record.amount:,.2f}")
+
+    if not found:
         print(f"No contributors found for senator: {senator_name}")
-        return
-    
-    print(f"\nContributors to Senator {senator_name}:")
-    for contributor, amount, year in results:
-        print(f"{year}: {contributor}: ${amount:,.2f}")
+
+@timed()
+def analyze_senators(top_n=5, conn=None):
+    """
+    Summarize contributions for every senator in the database.
+
+    Senators come from the roster with their stored candidate IDs, then per-year
+    totals and the top_n contributors for every candidate are computed with
+    one query each. Returns a list with one dict per senator:
+        {'senator': {...}, 'candidate_id': ..., 'years': [...], 'top_contributors': [...]}
+    """
+    if conn is None:
+        conn = get_db_connection()
+
+    roster = get_roster(conn)
+    senators = get_all_senators(conn)
+    candidate_ids = roster.candidate_ids
+    wanted = json.dumps(sorted({cid for cid in candidate_ids.values() if cid}))
+
+    c = conn.cursor()
+    c.execute('''
+        SELECT candidate_id, year, SUM(amount) as total_amount, COUNT(*) as contributor_count
+        FROM contributorsFromCommittees
+        WHERE candidate_id IN (SELECT value FROM json_each(?)) AND entity_type != 'IND'
+        GROUP BY candidate_id, year
+        ORDER BY candidate_id, year DESC
+    ''', (wanted,))
+    years = {}
+    for candidate_id, year, total_amount, contributor_count in c.fetchall():
+        years.setdefault(candidate_id, []).append({
+            'year': year,
+            'total_amount': total_amount,
+            'contributor_count': contributor_count
+        })
+
+    # spellings of the same contributor count as one, under the canonical
+    # name, see entity_resolution
+    c.execute('''
+        SELECT t.candidate_id, kd.contributor_name, t.total_amount
+        FROM (
+            SELECT cd.candidate_id, COALESCE(e.entity_key, f.contributor_key) AS entity_key,
+                   SUM(f.amount) as total_amount,
+                   ROW_NUMBER() OVER (PARTITION BY cd.candidate_id ORDER BY SUM(f.amount) DESC) as position
+            FROM candidate_dim cd
+            JOIN contribution_facts f ON f.candidate_key = cd.candidate_key
+            LEFT JOIN contributor_entities e ON e.contributor_key = f.contributor_key
+            WHERE cd.candidate_id IN (SELECT value FROM json_each(?)) AND f.entity_type != 'IND'
+            GROUP BY cd.candidate_id, entity_key
+        ) t
+        JOIN contributor_dim kd ON kd.contributor_key = t.entity_key
+        WHERE t.position <= ?
+        ORDER BY t.candidate_id, t.position
+    ''', (wanted, top_n))
+    top_contributors = {}
+    for candidate_id, contributor_name, total_amount in c.fetchall():
+        top_contributors.setdefault(candidate_id, []).append({
+            'contributor_name': contributor_name,
+            'total_amount': total_amount
+        })
+
+    results = []
+    for senator in senators:
+        candidate_id = candidate_ids.get(senator['id'])
+        results.append({
+            'senator': senator,
+            'candidate_id': candidate_id,
+            'years': years.get(candidate_id, []),
+            'top_contributors': top_contributors.get(candidate_id, [])
+        })
+    return results
 
 def analyze_senator_contributions():
     """Analyze contributions for all senators in the database"""
-    senators = get_all_senators()
-    conn = get_db_connection()
-    
-    try:
-        for senator in senators:
-            senator_name = senator['name']
-            print(f"\nAnalyzing contributions for {senator_name} ({senator['state']})...")
-            
-            # Search for the candidate ID
-            candidate_id = getCandidateIdByName(senator_name)
-            
-            if not candidate_id:
-                print(f"No candidate ID found for {senator_name}")
-                continue
-            
-            # get total contributions by year
-            c = conn.cursor()
-            c.execute('''
-                SELECT year, SUM(amount) as total_amount, COUNT(*) as contributor_count
-                FROM contributorsFromCommittees
-                WHERE candidate_id = ? AND entity_type != 'IND'
-                GROUP BY year
-                ORDER BY year DESC
-            ''', (candidate_id,))
-            
-            year_results = c.fetchall()
-            
-            if not year_results:
-                print(f"No contribution data found for {senator_name}")
-                continue
-            
-            print(f"Contribution Summary for {senator_name}:")
-            for year, total_amount, contributor_count in year_results:
-                print(f"  {year}: ${total_amount:,.2f} from {contributor_count} contributors")
-            
-            # get top 5 contributors
-            c.execute('''
-                SELECT contributor_name, SUM(amount) as total_amount
-                FROM contributorsFromCommittees
-                WHERE candidate_id = ? AND entity_type != 'IND'
-                GROUP BY contributor_name
-                ORDER BY total_amount DESC
-                LIMIT 5
-            ''', (candidate_id,))
-            
-            top_contributors = c.fetchall()
-            
-            if top_contributors:
-                print(f"Top 5 Contributors to {senator_name}:")
-                for contributor, amount in top_contributors:
-                    print(f"  {contributor}: ${amount:,.2f}")
-            
-            print("-" * 50)
-    finally:
-        conn.close()
+    for analysis in analyze_senators(top_n=5):
+        senator_name = analysis['senator']['name']
+        print(f"\nAnalyzing contributions for {senator_name} ({analysis['senator']['state']})...")
+        
+        if not analysis['candidate_id']:
+            print(f"No candidate ID found for {senator_name}")
+            continue
+        
+        if not analysis['years']:
+            print(f"No contribution data found for {senator_name}")
+            continue
+        
+        print(f"Contribution Summary for {senator_name}:")
+        for year in analysis['years']:
+            print(f"  {year['year']}: ${year['total_amount']:,.2f} from {year['contributor_count']} contributors")
+        
+        if analysis['top_contributors']:
+            print(f"Top 5 Contributors to {senator_name}:")
+            for contributor in analysis['top_contributors']:
+                print(f"  {contributor['contributor_name']}: ${contributor['total_amount']:,.2f}")
+        
+        print("-" * 50)
 
 if __name__ == "__main__":
     # Example usage
@@ -132,5 +160,4 @@ if __name__ == "__main__":
     print_senator_contributors(senator_name, 2023)
     
     # Analyze contributions for all senators
-    # Uncomment to run (this might take a while)
-    # analyze_senator_contributions() 
\ No newline at end of file
+    analyze_senator_contributions() 
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""
+Publishing the read snapshot.
+
+Ingest writes to the writer database (WRITER_DB_PATH). When it is done,
+publish_snapshot runs ANALYZE there and copies the database with VACUUM
+INTO into a fresh, defragmented file with the snapshot page size. The copy
+is then renamed over DB_PATH. The rename is atomic, so a reader sees either
+the old snapshot or the new one. Readers open the snapshot with
+immutable=1 and no locking, and get_db_connection reopens it when the file
+was replaced. Connections that are still open keep reading the old file
+until they are closed.
+
+    python snapshot.py [--page-size 8192]
+"""
+import argparse
+import os
+import sqlite3
+import time
+from database import DB_PATH, WRITER_DB_PATH, connect
+from instrumentation import timed
+
+SNAPSHOT_PAGE_SIZE = 8192
+
+def fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def ensure_writer_db(writer_path=None, snapshot_path=None):
+    """
+    Create the writer database from the current snapshot if there is no
+    writer yet, e.g. for a database from before the snapshot split. Returns
+    True if it was created.
+    """
+    writer_path = writer_path or WRITER_DB_PATH
+    snapshot_path = snapshot_path or DB_PATH
+    if os.path.exists(writer_path) or not os.path.exists(snapshot_path):
+        return False
+    print(f"Creating the writer database {writer_path} from {snapshot_path}")
+    source = sqlite3.connect(snapshot_path)
+    target = sqlite3.connect(writer_path)
+    try:
+        # the backup API copies a consistent state, WAL included
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    return True
+
+@timed()
+def publish_snapshot(conn, path=None, page_size=SNAPSHOT_PAGE_SIZE):
+    """
+    Publish the writer connection's database as the read snapshot at path
+    (default DB_PATH). Commits first. Returns the publish stats.
+    """
+    path = path or DB_PATH
+    started = time.perf_counter()
+    conn.commit()
+    # planner statistics travel with the snapshot in sqlite_stat1
+    conn.execute('ANALYZE')
+    conn.commit()
+
+    temp_path = f'{path}.publish-{os.getpid()}'
+    for stale in (temp_path, temp_path + '-journal'):
+        if os.path.exists(stale):
+            os.remove(stale)
+    # VACUUM INTO writes a rollback journal database with the page size
+    # set on the source connection
+    previous_page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    conn.execute(f'PRAGMA page_size = {int(page_size)}')
+    try:
+        conn.execute('VACUUM INTO ?', (temp_path,))
+    finally:
+        conn.execute(f'PRAGMA page_size = {previous_page_size}')
+    fsync_path(temp_path)
+
+    # a snapshot written in place by an older version may have left a WAL
+    # behind, which must not be applied to the new file
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.replace(temp_path, path)
+    fsync_path(os.path.dirname(os.path.abspath(path)))
+
+    stats = {'path': path, 'bytes': os.path.getsize(path), 'page_size': page_size,
+             'seconds': time.perf_counter() - started}
+    print(f"Published {path} ({stats['bytes'] / 1024 / 1024:,.1f} MB, {page_size} byte pages) "
+          f"in {stats['seconds']:.2f}s")
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Publish the writer database as the read snapshot')
+    parser.add_argument('--page-size', type=int, default=SNAPSHOT_PAGE_SIZE)
+    args = parser.parse_args()
+
+    ensure_writer_db()
+    writer = connect(readonly=False)
+    publish_snapshot(writer, page_size=args.page_size)
+    writer.close()
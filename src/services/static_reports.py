@@ -0,0 +1,357 @@
+"""
+Precomputed JSON reports for every candidate and industry.
+
+Everything the Politician and IndustryDetail pages show only changes at
+ingest time, so build_reports writes it out once per ingest as static
+files that server.js sends without touching SQLite:
+
+    reports/current.json                     points at the live build
+    reports/<build>/index.json               candidates and industries
+    reports/<build>/candidates/<CAND_ID>.json
+    reports/<build>/industries/<slug>.json
+
+Every file is also written gzip compressed (.json.gz) and, when the brotli
+package is installed, brotli compressed (.json.br). The version is derived
+from the ingest generation and the taxonomy, so an unchanged database is
+not rebuilt. Each build gets a directory of its own (<version>-<build id>),
+so rebuilding a version never touches the tree being served. It is written
+by a pool of processes under a temporary name, renamed into place and only
+then published in current.json, so readers never see a half written tree.
+
+    python static_reports.py [--workers N] [--force]
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import shutil
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from database import connect, DB_PATH, SERVICES_DIR
+from ingest_state import get_generation, get_state
+from instrumentation import timed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+REPORTS_DIR = os.environ.get('STATIC_REPORTS_DIR', os.path.join(SERVICES_DIR, 'reports'))
+
+# candidates per pool task
+CHUNK_SIZE = 500
+TOP_CONTRIBUTORS = 25
+COMMITTEE_LINKS = 25
+LEADERBOARD_SIZE = 100
+# versions kept on disk besides the current one, for readers still on them
+KEEP_VERSIONS = 1
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+def industry_slug(industry):
+    """File name for an industry, e.g. 'Oil & Gas' -> 'oil-gas' (server.js does the same)"""
+    return re.sub(r'[^a-z0-9]+', '-', industry.lower()).strip('-')
+
+def report_version(conn):
+    """Version of the report tree for the current data and taxonomy"""
+    taxonomy = get_state(conn, 'taxonomy_version') or 'none'
+    return f'{get_generation(conn)}-{taxonomy[:8]}'
+
+def read_current(reports_dir=REPORTS_DIR):
+    """The contents of current.json, or {} before the first build"""
+    try:
+        with open(os.path.join(reports_dir, 'current.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def current_version(reports_dir=REPORTS_DIR):
+    """The published version, or None before the first build"""
+    return read_current(reports_dir).get('version')
+
+def current_directory(reports_dir=REPORTS_DIR):
+    """Name of the published build directory; trees from before builds got their own are named after the version"""
+    current = read_current(reports_dir)
+    return current.get('directory') or current.get('version')
+
+def write_report(path, payload):
+    """
+    Write payload as compact JSON plus its precompressed variants. Returns
+    the number of bytes written per encoding.
+    """
+    data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    variants = {'identity': ('', data), 'gzip': ('.gz', gzip.compress(data, GZIP_LEVEL, mtime=0))}
+    if brotli is not None:
+        variants['br'] = ('.br', brotli.compress(data, quality=BROTLI_QUALITY))
+    sizes = {}
+    for encoding, (suffix, body) in variants.items():
+        with open(path + suffix, 'wb') as f:
+            f.write(body)
+        sizes[encoding] = len(body)
+    return sizes
+
+def add_sizes(totals, sizes):
+    for encoding, size in sizes.items():
+        totals[encoding] = totals.get(encoding, 0) + size
+
+def has_table(conn, name):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+    return row is not None
+
+def candidate_details(conn, candidate_id, with_names=True):
+    """Name, party and state from the candidates table, if it is there"""
+    row = None
+    if with_names:
+        row = conn.execute('''
+            SELECT CAND_NAME, CAND_PTY_AFFILIATION, CAND_OFFICE_ST FROM candidates WHERE CAND_ID = ?
+        ''', (candidate_id,)).fetchone()
+    name, party, state = row or (None, None, None)
+    return {'candidate_id': candidate_id, 'name': name, 'party': party, 'state': state,
+            'office': candidate_id[:1]}
+
+def candidate_report(conn, candidate_key, candidate_id, committees, with_names=True):
+    """Everything the candidate pages need, from the facts and the industry rollup"""
+    c = conn.cursor()
+    report = candidate_details(conn, candidate_id, with_names)
+
+    c.execute('''
+        SELECT year, SUM(amount), COUNT(*)
+        FROM contribution_facts
+        WHERE candidate_key = ? AND entity_type != 'IND'
+        GROUP BY year
+        ORDER BY year
+    ''', (candidate_key,))
+    report['totals_by_year'] = [{'year': year, 'total_amount': amount, 'contributors': contributors}
+                                for year, amount, contributors in c.fetchall()]
+    report['total_amount'] = sum(row['total_amount'] for row in report['totals_by_year'])
+
+    # spellings of the same contributor are added up, see entity_resolution
+    c.execute('''
+        SELECT kd.contributor_name, t.amount
+        FROM (
+            SELECT COALESCE(e.entity_key, f.contributor_key) AS entity_key, SUM(f.amount) AS amount
+            FROM contribution_facts f
+            LEFT JOIN contributor_entities e ON e.contributor_key = f.contributor_key
+            WHERE f.candidate_key = ? AND f.entity_type != 'IND'
+            GROUP BY entity_key
+        ) t
+        JOIN contributor_dim kd ON kd.contributor_key = t.entity_key
+        ORDER BY t.amount DESC, kd.contributor_name
+        LIMIT ?
+    ''', (candidate_key, TOP_CONTRIBUTORS))
+    report['top_contributors'] = [{'contributor_name': name, 'amount': amount}
+                                  for name, amount in c.fetchall()]
+
+    c.execute('''
+        SELECT industry, total_amount, contributor_count, top_contributor, top_amount
+        FROM candidate_industry_totals
+        WHERE candidate_id = ?
+        ORDER BY total_amount DESC
+    ''', (candidate_id,))
+    report['industries'] = [{'industry': industry, 'total_amount': amount, 'contributor_count': count,
+                             'top_contributor': top_contributor, 'top_amount': top_amount}
+                            for industry, amount, count, top_contributor, top_amount in c.fetchall()]
+
+    report['committees'] = committees
+    return report
+
+def build_candidate_chunk(task):
+    """Pool task: write the reports for a chunk of candidates"""
+    db_path, out_dir, candidates, committees = task
+    conn = connect(db_path)
+    summaries = []
+    sizes = {}
+    try:
+        with_names = has_table(conn, 'candidates')
+        for candidate_key, candidate_id in candidates:
+            report = candidate_report(conn, candidate_key, candidate_id, committees.get(candidate_id, []),
+                                      with_names)
+            add_sizes(sizes, write_report(os.path.join(out_dir, 'candidates', f'{candidate_id}.json'), report))
+            summaries.append({key: report[key] for key in
+                              ('candidate_id', 'name', 'party', 'state', 'office', 'total_amount')})
+    finally:
+        conn.close()
+    return summaries, sizes
+
+def build_industry_leaderboards(task):
+    """Pool task: write one leaderboard per industry, largest totals first"""
+    db_path, out_dir = task
+    conn = connect(db_path)
+    summaries = []
+    sizes = {}
+    try:
+        c = conn.cursor()
+        names = ''
+        if has_table(conn, 'candidates'):
+            names = 'LEFT JOIN candidates ca ON ca.CAND_ID = t.candidate_id'
+        columns = 'ca.CAND_NAME, ca.CAND_PTY_AFFILIATION, ca.CAND_OFFICE_ST' if names else 'NULL, NULL, NULL'
+        c.execute('''
+            SELECT industry, SUM(total_amount), COUNT(*)
+            FROM candidate_industry_totals
+            GROUP BY industry
+        ''')
+        for industry, total_amount, candidate_count in c.fetchall():
+            c.execute(f'''
+                SELECT t.candidate_id, {columns}, t.total_amount, t.contributor_count,
+                       t.top_contributor, t.top_amount
+                FROM candidate_industry_totals t
+                {names}
+                WHERE t.industry = ?
+                ORDER BY t.total_amount DESC
+                LIMIT ?
+            ''', (industry, LEADERBOARD_SIZE))
+            leaders = [{'candidate_id': candidate_id, 'name': name, 'party': party, 'state': state,
+                        'total_amount': amount, 'contributor_count': count,
+                        'top_contributor': top_contributor, 'top_amount': top_amount}
+                       for candidate_id, name, party, state, amount, count, top_contributor, top_amount
+                       in c.fetchall()]
+            slug = industry_slug(industry)
+            add_sizes(sizes, write_report(os.path.join(out_dir, 'industries', f'{slug}.json'),
+                                          {'industry': industry, 'candidates': leaders}))
+            summaries.append({'industry': industry, 'slug': slug,
+                              'total_amount': total_amount, 'candidates': candidate_count})
+    finally:
+        conn.close()
+    return summaries, sizes
+
+def committee_links(conn, limit=COMMITTEE_LINKS):
+    """
+    The committees that gave the most to each candidate, from
+    contribution_ledger, as {candidate_id: [link, ...]}. The ledger has no
+    index by candidate, so this is one pass over it rather than one per
+    candidate.
+    """
+    c = conn.cursor()
+    c.execute('''
+        WITH per_committee AS (
+            SELECT candidate_id, cmte_id, MAX(contributor_name) AS committee_name,
+                   SUM(amount) AS amount, COUNT(*) AS transactions
+            FROM contribution_ledger
+            WHERE entity_type != 'IND'
+            GROUP BY candidate_id, cmte_id
+        ), ranked AS (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY candidate_id ORDER BY amount DESC, cmte_id) AS position
+            FROM per_committee
+        )
+        SELECT candidate_id, cmte_id, committee_name, amount, transactions
+        FROM ranked
+        WHERE position <= ?
+        ORDER BY candidate_id, position
+    ''', (limit,))
+    links = {}
+    for candidate_id, cmte_id, committee_name, amount, transactions in c.fetchall():
+        links.setdefault(candidate_id, []).append({
+            'committee_id': cmte_id, 'committee_name': committee_name,
+            'amount': amount, 'transactions': transactions})
+    return links
+
+def publish(reports_dir, version, directory, summary):
+    """Point current.json at the build directory of version, replacing it atomically"""
+    temp_path = os.path.join(reports_dir, f'current.json.{os.getpid()}')
+    with open(temp_path, 'w') as f:
+        json.dump({'version': version, 'directory': directory, **summary}, f)
+    os.replace(temp_path, os.path.join(reports_dir, 'current.json'))
+
+def prune_versions(reports_dir, keep=KEEP_VERSIONS):
+    """Remove old builds and abandoned ones, keeping the current one and the keep newest others"""
+    current = current_directory(reports_dir)
+    versions = []
+    for entry in os.scandir(reports_dir):
+        if not entry.is_dir() or entry.name == current:
+            continue
+        if entry.name.startswith('.build-'):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            versions.append((entry.stat().st_mtime, entry.path))
+    for _, path in sorted(versions, reverse=True)[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+@timed()
+def build_reports(db_path=None, reports_dir=REPORTS_DIR, workers=None, force=False):
+    """
+    Build and publish the report tree for the database, unless the current
+    version is already built. Returns the build stats, or None if there was
+    nothing to do.
+    """
+    started = time.perf_counter()
+    db_path = db_path or DB_PATH
+    conn = connect(db_path)
+    try:
+        version = report_version(conn)
+        if not force and current_version(reports_dir) == version:
+            print(f"Reports for version {version} are up to date")
+            return None
+        candidates = conn.execute('''
+            SELECT candidate_key, candidate_id FROM candidate_dim ORDER BY candidate_key
+        ''').fetchall()
+        try:
+            committees = committee_links(conn)
+        except sqlite3.OperationalError:
+            # databases that were only bulk loaded have no ledger
+            committees = {}
+    finally:
+        conn.close()
+
+    os.makedirs(reports_dir, exist_ok=True)
+    build_dir = os.path.join(reports_dir, f'.build-{version}-{os.getpid()}')
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(os.path.join(build_dir, 'candidates'))
+    os.makedirs(os.path.join(build_dir, 'industries'))
+
+    tasks = []
+    for i in range(0, len(candidates), CHUNK_SIZE):
+        chunk = candidates[i:i + CHUNK_SIZE]
+        chunk_committees = {candidate_id: committees[candidate_id]
+                            for _, candidate_id in chunk if candidate_id in committees}
+        tasks.append((db_path, build_dir, chunk, chunk_committees))
+
+    candidate_summaries = []
+    industry_summaries = []
+    sizes = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(build_industry_leaderboards, (db_path, build_dir)): industry_summaries}
+        futures.update({pool.submit(build_candidate_chunk, task): candidate_summaries for task in tasks})
+        for future in as_completed(futures):
+            summaries, task_sizes = future.result()
+            futures[future].extend(summaries)
+            add_sizes(sizes, task_sizes)
+
+    candidate_summaries.sort(key=lambda row: row['total_amount'], reverse=True)
+    industry_summaries.sort(key=lambda row: row['total_amount'], reverse=True)
+    generated_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    add_sizes(sizes, write_report(os.path.join(build_dir, 'index.json'), {
+        'version': version, 'generated_at': generated_at,
+        'candidates': candidate_summaries, 'industries': industry_summaries}))
+
+    # a new name per build: the live tree, even of the same version, stays
+    # in place until current.json points elsewhere and prune_versions runs
+    directory = f'{version}-{int(time.time() * 1000):x}'
+    os.rename(build_dir, os.path.join(reports_dir, directory))
+    stats = {'candidates': len(candidate_summaries), 'industries': len(industry_summaries),
+             'generated_at': generated_at, 'bytes': sizes}
+    publish(reports_dir, version, directory, stats)
+    prune_versions(reports_dir)
+
+    stats['version'] = version
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Precompute the static candidate and industry reports')
+    parser.add_argument('--db', default=None, help='database path (default: politicaldata.db)')
+    parser.add_argument('--out', default=REPORTS_DIR, help='report tree directory')
+    parser.add_argument('--workers', type=int, default=None, help='number of builder processes')
+    parser.add_argument('--force', action='store_true', help='rebuild even if the version is current')
+    args = parser.parse_args()
+
+    stats = build_reports(args.db, args.out, args.workers, args.force)
+    if stats:
+        print(f"Built version {stats['version']}: {stats['candidates']:,} candidate and "
+              f"{stats['industries']} industry reports in {stats['seconds']:.2f}s")
+        print('  ' + ', '.join(f"{encoding} {size / 1024 / 1024:,.1f} MB"
+                               for encoding, size in stats['bytes'].items()))
+        if brotli is None:
+            print("  brotli is not installed, only gzip variants were written")
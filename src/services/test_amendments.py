@@ -0,0 +1,129 @@
+"""
+Amendments (AMNDT_IND 'A') and terminations ('T') must replace or remove the
+transaction they amend, in the bulk load and in incremental ingests, without
+counting any amount twice.
+"""
+import os
+import sqlite3
+import pytest
+from bulk_loader import bulk_load_contributions
+from compact_schema import create_compact_schema
+from contribution_cubes import create_cube_tables
+from industries import create_industry_tables
+from ingest_state import create_state_table
+from initialize_db import DATA_DIR, apply_transaction, create_ledger_tables, ingest_appended_records, load_headers
+
+YEAR = 2024
+HEADERS = load_headers(os.path.join(DATA_DIR, 'con-from-com-header.csv'))
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'writer.db'))
+    create_compact_schema(conn)
+    create_ledger_tables(conn)
+    create_cube_tables(conn)
+    create_industry_tables(conn)
+    create_state_table(conn)
+    yield conn
+    conn.close()
+
+def record(sub_id, amendment, amount, tran_id='T1', candidate_id='S0AA00001', name='ACME PAC', entity_type='PAC'):
+    values = {
+        'CMTE_ID': 'C00000001', 'AMNDT_IND': amendment, 'ENTITY_TP': entity_type, 'NAME': name,
+        'TRANSACTION_DT': '01152024', 'TRANSACTION_AMT': str(amount), 'CAND_ID': candidate_id,
+        'TRAN_ID': tran_id, 'SUB_ID': str(sub_id),
+    }
+    return '|'.join(values.get(column, '') for column in HEADERS) + '\n'
+
+def write_records(path, records):
+    with open(path, 'w') as f:
+        f.writelines(records)
+    return str(path)
+
+def totals(conn):
+    return dict(((candidate_id, name), amount) for candidate_id, name, amount in conn.execute(
+        'SELECT candidate_id, contributor_name, amount FROM contributorsFromCommittees WHERE amount != 0'))
+
+def ledger(conn):
+    return conn.execute('SELECT tran_id, sub_id, amount FROM contribution_ledger ORDER BY tran_id').fetchall()
+
+def cube_total(conn):
+    return conn.execute('SELECT COALESCE(SUM(amount), 0), COALESCE(SUM(transactions), 0) '
+                        'FROM industry_day_totals').fetchone()
+
+def apply(conn, sub_id, amendment, amount, **columns):
+    columns = {'candidate_id': 'S0AA00001', 'contributor_name': 'ACME PAC', 'entity_type': 'PAC', **columns}
+    applied = apply_transaction(conn.cursor(), 'C00000001', 'T1', YEAR, sub_id, columns['candidate_id'],
+                                columns['contributor_name'], columns['entity_type'], amount, '2024-01-15',
+                                '', amendment)
+    conn.commit()
+    return applied
+
+def test_apply_amendment_then_termination(conn):
+    assert apply(conn, 1, 'N', 100.0)
+    assert totals(conn) == {('S0AA00001', 'ACME PAC'): 100.0}
+    assert cube_total(conn) == (100.0, 1)
+
+    assert apply(conn, 2, 'A', 250.0)
+    assert totals(conn) == {('S0AA00001', 'ACME PAC'): 250.0}
+    assert ledger(conn) == [('T1', 2, 250.0)]
+    assert cube_total(conn) == (250.0, 1)
+
+    # an older record replayed after the amendment is ignored
+    assert not apply(conn, 1, 'N', 100.0)
+
+    assert apply(conn, 3, 'T', 250.0)
+    assert totals(conn) == {}
+    assert ledger(conn) == []
+    assert cube_total(conn) == (0, 0)
+
+def test_amendment_backs_out_stored_columns(conn):
+    apply(conn, 1, 'N', 100.0, entity_type='ORG')
+    apply(conn, 2, 'A', 40.0, candidate_id='S0BB00002', contributor_name='ACME PAC INC', entity_type='PAC')
+    assert totals(conn) == {('S0BB00002', 'ACME PAC INC'): 40.0}
+    assert cube_total(conn) == (40.0, 1)
+
+BULK_RECORDS = [
+    # amended, possibly in another chunk
+    record(10, 'N', 100, tran_id='A1'),
+    record(11, 'N', 7, tran_id='X1', name='OTHER PAC'),
+    record(12, 'N', 7, tran_id='X2', name='OTHER PAC'),
+    record(20, 'A', 150, tran_id='A1'),
+    # terminated
+    record(30, 'N', 60, tran_id='B1'),
+    record(31, 'T', 60, tran_id='B1'),
+    # terminated before a lower SUB_ID turns up
+    record(41, 'T', 80, tran_id='C1'),
+    record(40, 'N', 80, tran_id='C1'),
+    # terminated, then amended again
+    record(50, 'N', 20, tran_id='D1', name='DELTA PAC'),
+    record(51, 'T', 20, tran_id='D1', name='DELTA PAC'),
+    record(52, 'A', 25, tran_id='D1', name='DELTA PAC'),
+]
+
+@pytest.mark.parametrize('chunk_size', [64, 32 * 1024 * 1024])
+def test_bulk_load_amendments(conn, tmp_path, chunk_size):
+    path = write_records(tmp_path / 'itcont.txt', BULK_RECORDS)
+    bulk_load_contributions([(path, YEAR)], HEADERS, conn, workers=1, chunk_size=chunk_size,
+                            track_transactions=True)
+    assert totals(conn) == {
+        ('S0AA00001', 'ACME PAC'): 150.0,
+        ('S0AA00001', 'OTHER PAC'): 14.0,
+        ('S0AA00001', 'DELTA PAC'): 25.0,
+    }
+    assert ledger(conn) == [('A1', 20, 150.0), ('D1', 52, 25.0), ('X1', 11, 7.0), ('X2', 12, 7.0)]
+
+def test_appended_amendments(conn, tmp_path):
+    path = write_records(tmp_path / 'itcont.txt', [
+        record(10, 'N', 100, tran_id='A1'),
+        record(20, 'A', 150, tran_id='A1'),
+        record(30, 'N', 60, tran_id='B1'),
+        record(31, 'T', 60, tran_id='B1'),
+        record(50, 'N', 20, tran_id='D1'),
+        record(51, 'T', 20, tran_id='D1'),
+        record(52, 'A', 25, tran_id='D1'),
+    ])
+    ingest_appended_records(path, HEADERS, conn, YEAR, {'last_offset': 0, 'max_sub_id': 0})
+    assert totals(conn) == {('S0AA00001', 'ACME PAC'): 175.0}
+    assert ledger(conn) == [('A1', 20, 150.0), ('D1', 52, 25.0)]
+    assert cube_total(conn) == (175.0, 2)